@@ -1,11 +1,223 @@
-from django.contrib import admin
+import ipaddress
+
+from django.contrib import admin, messages
+from django.contrib.admin.options import ShowFacets
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.paginator import Paginator
+from django.db import OperationalError, ProgrammingError, connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 
 # Register your models here.
-from .models import Location
+from .ip_sets import suspicious_ips
+from .models import Location, RequestLog, BlockedIP, SuspiciousIP, SuspiciousNetwork
+
+CURSOR_VAR = 'after'
+COUNT_CAP = 10000
+
+
+def table_row_estimate(model, using='default'):
+    """
+    Row count of ``model``'s table from the database statistics, or None.
+    Never scans the table.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        'postgresql': ("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table]),
+        'mysql': (
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            [table],
+        ),
+        'sqlite': ("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table]),
+    }
+    if connection.vendor not in queries:
+        return None
+    sql, params = queries[connection.vendor]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except (OperationalError, ProgrammingError):
+        # sqlite_stat1 only exists once ANALYZE has run
+        return None
+    if not row or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*): unfiltered tables use the
+    planner statistics, filtered querysets are counted up to COUNT_CAP rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = table_row_estimate(queryset.model, using=queryset.db)
+            if estimate is not None:
+                return estimate
+        return queryset.order_by()[:COUNT_CAP].count()
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist that pages with a "Show more" cursor on the admin's
+    ``keyset_field`` + pk instead of OFFSET pages, as long as the default
+    ordering is used. Sorting by a column falls back to regular paging.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        field = self.model_admin.keyset_field
+        if ORDER_VAR in self.params:
+            self.next_page_url = None
+            return super().get_results(request)
+
+        queryset = self.queryset.order_by(f'-{field}', '-pk')
+        cursor = self.decode_cursor(request.GET.get(CURSOR_VAR))
+        if cursor:
+            value, pk = cursor
+            queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+
+        rows = list(queryset[:self.list_per_page + 1])
+        has_more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = False
+        self.next_page_url = None
+        if has_more:
+            last = rows[-1]
+            self.next_page_url = self.get_query_string(
+                {CURSOR_VAR: f"{getattr(last, field).isoformat()}|{last.pk}"}
+            )
+
+    @staticmethod
+    def decode_cursor(value):
+        if not value or '|' not in value:
+            return None
+        timestamp, pk = value.rsplit('|', 1)
+        parsed = parse_datetime(timestamp)
+        if parsed is None or not pk.isdigit():
+            return None
+        return parsed, int(pk)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin for the log tables: estimated counts, keyset paging,
+    no facet counts.
+    """
+    keyset_field = None
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = ShowFacets.NEVER
+    change_list_template = 'admin/core/keyset_change_list.html'
+    list_per_page = 100
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # An IP address is matched with a plain equality on the indexed
+        # column instead of the case-insensitive lookup search_fields use
+        term = search_term.strip()
+        try:
+            ipaddress.ip_address(term)
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(ip_address=term), False
+
 
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
     list_display = ['user', 'latitude', 'longitude', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['user__username']
-    readonly_fields = ['created_at', 'updated_at']
\ No newline at end of file
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.action(description='Block selected IP addresses')
+def block_selected_ips(modeladmin, request, queryset):
+    ip_addresses = queryset.order_by().values_list('ip_address', flat=True).distinct()
+    count = BlockedIP.block_many(ip_addresses, reason=f'Blocked from admin by {request.user}')
+    modeladmin.message_user(request, f"Blocked {count} IP addresses.", messages.SUCCESS)
+
+
+@admin.action(description='Unblock selected IP addresses')
+def unblock_selected_ips(modeladmin, request, queryset):
+    ip_addresses = queryset.order_by().values_list('ip_address', flat=True).distinct()
+    count = BlockedIP.unblock_many(ip_addresses)
+    modeladmin.message_user(request, f"Unblocked {count} IP addresses.", messages.SUCCESS)
+
+
+@admin.action(description='Clear selected suspicious IPs')
+def deactivate_suspicious_ips(modeladmin, request, queryset):
+    count = queryset.update(is_active=False)
+    suspicious_ips.invalidate()
+    modeladmin.message_user(request, f"Cleared {count} suspicious IPs.", messages.SUCCESS)
+
+
+@admin.register(RequestLog)
+class RequestLogAdmin(LargeTableAdmin):
+    keyset_field = 'timestamp'
+    list_display = ['timestamp', 'ip_address', 'method', 'path', 'status_code', 'country', 'city', 'user_agent']
+    # user_agent reads the interned value; join it instead of a query per row
+    list_select_related = ['user_agent_ref']
+    list_filter = ['timestamp']
+    search_fields = ['^path']
+    search_help_text = 'Exact IP address or path prefix'
+    # A select of every interned route or user agent would load the whole table
+    readonly_fields = ['path_ref', 'user_agent_ref']
+    actions = [block_selected_ips, unblock_selected_ips]
+
+
+@admin.register(BlockedIP)
+class BlockedIPAdmin(LargeTableAdmin):
+    keyset_field = 'created_at'
+    list_display = ['ip_address', 'is_active', 'reason', 'created_at', 'expires_at', 'offense_count']
+    list_filter = ['is_active', 'created_at']
+    search_fields = ['=ip_address']
+    actions = [block_selected_ips, unblock_selected_ips]
+
+
+@admin.register(SuspiciousIP)
+class SuspiciousIPAdmin(LargeTableAdmin):
+    keyset_field = 'detected_at'
+    list_display = ['ip_address', 'reason', 'is_active', 'detected_at', 'expires_at', 'offense_count']
+    list_filter = ['is_active', 'reason', 'detected_at']
+    search_fields = ['=ip_address']
+    actions = [block_selected_ips, unblock_selected_ips, deactivate_suspicious_ips]
+
+
+@admin.register(SuspiciousNetwork)
+class SuspiciousNetworkAdmin(LargeTableAdmin):
+    keyset_field = 'detected_at'
+    list_display = ['network', 'reason', 'is_active', 'detected_at']
+    list_filter = ['is_active', 'reason', 'prefix_length', 'detected_at']
+    search_fields = ['=network']
+    search_help_text = 'Network in CIDR notation, or an IP address to find the networks containing it'
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        try:
+            networks = SuspiciousNetwork.networks_of(term)
+        except ValueError:
+            return super(LargeTableAdmin, self).get_search_results(request, queryset, search_term)
+        return queryset.filter(network__in=networks), False
@@ -0,0 +1,344 @@
+"""
+Cold archive of old RequestLog rows.
+
+Rows older than ``REQUEST_LOG_RETENTION_DAYS`` are moved into one segment
+file per UTC day (``request_logs-YYYY-MM-DD.npz``) under
+``REQUEST_LOG_ARCHIVE_DIR``, then deleted from the database in batches of
+``REQUEST_LOG_ARCHIVE_DELETE_BATCH``. A segment is a compressed NumPy
+archive holding one member per column:
+
+* ``id``, ``timestamp`` (µs since the epoch) and ``status_code`` (-1 when
+  unknown) as plain integer arrays
+* ``ip_address``, ``path``, ``user_agent``, ``method``, ``country`` and
+  ``city`` dictionary-encoded: an int32 code per row plus the distinct
+  values as one UTF-8 blob with offsets
+
+Members are decompressed on first access, so a scan only pays for the
+columns it touches: IP and path-prefix predicates are checked against the
+small dictionaries first and skip the segment outright when nothing
+matches, and time ranges skip whole days by file name.
+"""
+import logging
+import os
+from datetime import datetime, time as datetime_time, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .exports import EXPORT_COLUMNS, EXPORT_FIELDS
+from .models import RequestLog
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'request_logs-'
+DICTIONARY_COLUMNS = ['ip_address', 'path', 'user_agent', 'method', 'country', 'city']
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def archive_directory():
+    return str(getattr(settings, 'REQUEST_LOG_ARCHIVE_DIR', 'archive'))
+
+
+def segment_path(directory, day):
+    return os.path.join(directory, f"{SEGMENT_PREFIX}{day.isoformat()}.npz")
+
+
+def segment_day(filename):
+    name = os.path.basename(filename)
+    if not (name.startswith(SEGMENT_PREFIX) and name.endswith('.npz')):
+        return None
+    try:
+        return datetime.strptime(name[len(SEGMENT_PREFIX):-4], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def to_micros(value):
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+class SegmentBuilder:
+    """
+    Builds a segment's columns a chunk of rows at a time: integer columns as
+    arrays, dictionary columns as codes into value lookups shared by every
+    chunk, so memory follows the codes and the distinct values, not the
+    rows. An existing segment is folded in column by column, without
+    decoding its rows.
+    """
+
+    def __init__(self):
+        self._chunks = {'id': [], 'timestamp': [], 'status_code': []}
+        self._lookups = {name: {} for name in DICTIONARY_COLUMNS}
+        for name in DICTIONARY_COLUMNS:
+            self._chunks[name] = []
+
+    def _codes(self, name, values):
+        lookup = self._lookups[name]
+        return np.fromiter(
+            (lookup.setdefault(value or '', len(lookup)) for value in values),
+            dtype=np.int32, count=len(values),
+        )
+
+    def add_rows(self, rows):
+        """Add rows given as tuples in EXPORT_FIELDS order."""
+        if not rows:
+            return
+        columns = dict(zip(EXPORT_FIELDS, zip(*rows)))
+        self._chunks['id'].append(np.asarray(columns['id'], dtype=np.int64))
+        self._chunks['timestamp'].append(
+            np.fromiter((to_micros(t) for t in columns['timestamp']), dtype=np.int64, count=len(rows))
+        )
+        self._chunks['status_code'].append(np.fromiter(
+            (-1 if code is None else code for code in columns['status_code']), dtype=np.int16, count=len(rows),
+        ))
+        for name in DICTIONARY_COLUMNS:
+            self._chunks[name].append(self._codes(name, columns[name]))
+
+    def add_segment(self, segment):
+        """Add every row of an ArchiveSegment."""
+        for name in ('id', 'timestamp', 'status_code'):
+            self._chunks[name].append(segment.column(name))
+        for name in DICTIONARY_COLUMNS:
+            recode = self._codes(name, segment.dictionary(name))
+            self._chunks[name].append(recode[segment.column(f'{name}_codes')])
+
+    def ids(self):
+        return np.concatenate(self._chunks['id']) if self._chunks['id'] else np.empty(0, dtype=np.int64)
+
+    def arrays(self):
+        """The segment's members, rows sorted by (timestamp, id)."""
+        columns = {name: np.concatenate(chunks) for name, chunks in self._chunks.items()}
+        order = np.lexsort((columns['id'], columns['timestamp']))
+        arrays = {name: columns[name][order] for name in ('id', 'timestamp', 'status_code')}
+        for name in DICTIONARY_COLUMNS:
+            encoded = [value.encode() for value in self._lookups[name]]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            arrays[f'{name}_codes'] = columns[name][order]
+            arrays[f'{name}_blob'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            arrays[f'{name}_offsets'] = offsets
+        return arrays
+
+
+def write_segment(path, arrays):
+    """Write a SegmentBuilder's ``arrays()`` to ``path``, atomically."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial = f"{path}.partial"
+    with open(partial, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+
+class ArchiveSegment:
+    """Lazy reader for one segment file; columns are decompressed on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        self.day = segment_day(path)
+        self._data = np.load(path, allow_pickle=False)
+        self._dictionaries = {}
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._data['id'])
+
+    def column(self, name):
+        return self._data[name]
+
+    def dictionary(self, name):
+        if name not in self._dictionaries:
+            blob = self._data[f'{name}_blob'].tobytes()
+            offsets = self._data[f'{name}_offsets']
+            self._dictionaries[name] = [
+                blob[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)
+            ]
+        return self._dictionaries[name]
+
+    def matching_rows(self, start=None, end=None, ip_address=None, path_prefix=None):
+        """Indices of the rows matching every given predicate, or an empty array."""
+        none = np.empty(0, dtype=np.int64)
+        ip_code = None
+        if ip_address:
+            try:
+                ip_code = self.dictionary('ip_address').index(ip_address)
+            except ValueError:
+                return none
+        path_codes = None
+        if path_prefix:
+            path_codes = [
+                code for code, path in enumerate(self.dictionary('path')) if path.startswith(path_prefix)
+            ]
+            if not path_codes:
+                return none
+
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None or end is not None:
+            timestamps = self.column('timestamp')
+            if start is not None:
+                mask &= timestamps >= to_micros(start)
+            if end is not None:
+                mask &= timestamps < to_micros(end)
+        if ip_code is not None:
+            mask &= self.column('ip_address_codes') == ip_code
+        if path_codes is not None:
+            mask &= np.isin(self.column('path_codes'), path_codes)
+        return np.flatnonzero(mask)
+
+    def rows(self, indices=None):
+        """Yield rows as EXPORT_FIELDS dicts, all rows when ``indices`` is None."""
+        if indices is None:
+            indices = np.arange(len(self))
+        if not len(indices):
+            return
+        ids = self.column('id')[indices]
+        timestamps = self.column('timestamp')[indices]
+        status_codes = self.column('status_code')[indices]
+        decoded = {}
+        for name in DICTIONARY_COLUMNS:
+            values = self.dictionary(name)
+            decoded[name] = [values[code] for code in self.column(f'{name}_codes')[indices]]
+        for i in range(len(indices)):
+            status = int(status_codes[i])
+            row = {
+                'id': int(ids[i]),
+                'timestamp': from_micros(timestamps[i]),
+                'status_code': None if status < 0 else status,
+            }
+            for name in DICTIONARY_COLUMNS:
+                row[name] = decoded[name][i]
+            yield {field: row[field] for field in EXPORT_FIELDS}
+
+
+def list_segments(directory=None, start=None, end=None):
+    """Segment paths in day order, skipping days outside [start, end)."""
+    directory = directory or archive_directory()
+    if not os.path.isdir(directory):
+        return []
+    first_day = start.astimezone(dt_timezone.utc).date() if start else None
+    last_day = end.astimezone(dt_timezone.utc).date() if end else None
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        day = segment_day(name)
+        if day is None:
+            continue
+        if first_day and day < first_day:
+            continue
+        if last_day and day > last_day:
+            continue
+        paths.append(os.path.join(directory, name))
+    return paths
+
+
+def iter_archived_logs(start=None, end=None, ip_address=None, path_prefix=None, directory=None):
+    """Yield archived rows matching the predicates, in day order."""
+    for path in list_segments(directory, start, end):
+        with ArchiveSegment(path) as segment:
+            yield from segment.rows(segment.matching_rows(start, end, ip_address, path_prefix))
+
+
+def archive_day(day, directory, delete_batch_size, chunk_size=10000):
+    """Archive every row of ``day`` (UTC) and delete it. Returns rows archived."""
+    day_start = datetime.combine(day, datetime_time.min, tzinfo=dt_timezone.utc)
+    rows = (
+        RequestLog.objects
+        .filter(timestamp__gte=day_start, timestamp__lt=day_start + timedelta(days=1))
+        .order_by('timestamp', 'id')
+        .values_list(*EXPORT_COLUMNS)
+        .iterator(chunk_size=chunk_size)
+    )
+    path = segment_path(directory, day)
+    builder = SegmentBuilder()
+    archived_ids = None
+    if os.path.exists(path):
+        # An earlier run archived part of this day; merge instead of overwriting
+        with ArchiveSegment(path) as segment:
+            builder.add_segment(segment)
+        archived_ids = builder.ids()
+
+    ids = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            ids.append(_add_chunk(builder, chunk, archived_ids))
+            chunk = []
+    ids.append(_add_chunk(builder, chunk, archived_ids))
+    ids = np.concatenate(ids)
+    if not len(ids):
+        return 0
+    if archived_ids is None or len(builder.ids()) > len(archived_ids):
+        write_segment(path, builder.arrays())
+
+    for offset in range(0, len(ids), delete_batch_size):
+        RequestLog.objects.filter(id__in=ids[offset:offset + delete_batch_size].tolist()).delete()
+    logger.info(f"Archived {len(ids)} request logs for {day} to {path}")
+    return len(ids)
+
+
+def _add_chunk(builder, chunk, archived_ids):
+    """
+    Add the rows of ``chunk`` not already archived. Returns the ids of every
+    row in it: rows a crashed run archived but did not delete go now.
+    """
+    ids = np.fromiter((row[0] for row in chunk), dtype=np.int64, count=len(chunk))
+    if archived_ids is not None and len(ids):
+        fresh = ~np.isin(ids, archived_ids)
+        chunk = [row for row, keep in zip(chunk, fresh) if keep]
+    builder.add_rows(chunk)
+    return ids
+
+
+def archive_request_logs(older_than_days=None, directory=None, delete_batch_size=None):
+    """
+    Move RequestLog rows older than ``older_than_days`` full days into
+    per-day segments, then drop segments past the archive retention.
+    Safe to rerun after a crash: segments are written before rows are
+    deleted and rows already archived are not duplicated.
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'REQUEST_LOG_RETENTION_DAYS', 30)
+    directory = directory or archive_directory()
+    delete_batch_size = delete_batch_size or getattr(settings, 'REQUEST_LOG_ARCHIVE_DELETE_BATCH', 5000)
+
+    cutoff = datetime.combine(
+        (timezone.now() - timedelta(days=older_than_days)).astimezone(dt_timezone.utc).date(),
+        datetime_time.min, tzinfo=dt_timezone.utc,
+    )
+    stats = {'days': 0, 'rows': 0, 'pruned': 0}
+    old = RequestLog.objects.filter(timestamp__lt=cutoff).order_by('timestamp')
+    oldest = old.values_list('timestamp', flat=True).first()
+    while oldest is not None:
+        day = oldest.astimezone(dt_timezone.utc).date()
+        stats['rows'] += archive_day(day, directory, delete_batch_size)
+        stats['days'] += 1
+        next_day = datetime.combine(day + timedelta(days=1), datetime_time.min, tzinfo=dt_timezone.utc)
+        oldest = old.filter(timestamp__gte=next_day).values_list('timestamp', flat=True).first()
+
+    keep_days = getattr(settings, 'REQUEST_LOG_ARCHIVE_RETENTION_DAYS', 365)
+    expired_before = cutoff.date() - timedelta(days=keep_days)
+    for path in list_segments(directory):
+        if segment_day(path) < expired_before:
+            os.remove(path)
+            stats['pruned'] += 1
+
+    logger.info(
+        f"Archived {stats['rows']} request logs from {stats['days']} days, "
+        f"pruned {stats['pruned']} expired segments"
+    )
+    return stats
@@ -0,0 +1,365 @@
+"""
+Unique visitor counts: distinct client IPs per route, per country and
+site-wide, per minute and per hour.
+
+RequestLoggingMiddleware hands each request's IP to ``unique_visitors``,
+which buffers the values in process and adds them to HyperLogLog counters
+every ``CARDINALITY_FLUSH_INTERVAL`` seconds:
+
+* ``RedisCardinalityBackend``: one pipelined ``PFADD`` per counter, merged
+  at query time by ``PFCOUNT`` over several keys. Used whenever the default
+  cache is django-redis.
+* ``LocalCardinalityBackend``: the fallback, and what a flush falls back to
+  when Redis fails. Each worker keeps its own ``HyperLogLog`` registers and
+  writes them to the cache under a slot claimed with an atomic ``incr``;
+  queries merge the slots.
+
+Counters exist per minute (kept ``CARDINALITY_MINUTE_RETENTION`` seconds) and
+per hour (kept ``CARDINALITY_HOUR_RETENTION`` seconds). A query over a time
+range is answered by merging the whole hours inside it and the minutes at its
+edges, rounded out to whole minutes (the minute holding ``until`` included);
+edges older than the minute retention use their whole hour. Estimates are within about 1.6% (local, 4096
+registers) or 0.8% (Redis) of the true count.
+
+Each worker counts at most ``CARDINALITY_MAX_ROUTES`` routes per bucket;
+past the cap, routes it has not counted in that bucket yet go under
+``OTHER_ROUTES``. The cap is applied before the backend is chosen, so a scan
+of random paths can neither grow a worker's counters nor the Redis keyspace
+(at most that many route keys per worker and bucket) without bound.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .dimensions import normalize_path
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+RESOLUTIONS = {'minute': MINUTE, 'hour': HOUR}
+DIMENSIONS = ['all', 'path', 'country']
+CACHE_PREFIX = 'unique_visitors'
+OTHER_ROUTES = '<other>'
+
+
+class HyperLogLog:
+    """HyperLogLog (Flajolet et al.) with a process-independent 64-bit hash."""
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another counter of the same precision into this one (register-wise max)."""
+        merged = np.maximum(
+            np.frombuffer(self.registers, dtype=np.uint8),
+            np.frombuffer(other.registers if isinstance(other, HyperLogLog) else other, dtype=np.uint8),
+        )
+        self.registers = bytearray(merged.tobytes())
+
+    def count(self):
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / float(np.sum(np.exp2(-registers.astype(np.float64))))
+        zeros = self.size - int(np.count_nonzero(registers))
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate while many registers are empty
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+def counter_key(dimension, value, resolution, bucket):
+    return f"{CACHE_PREFIX}:{dimension}:{resolution}:{bucket}:{value}"
+
+
+class RedisCardinalityBackend:
+    def __init__(self, client, retention):
+        self.client = client
+        self.retention = retention
+
+    def add_many(self, pending):
+        """Add {(dimension, value, resolution, bucket): set of IPs} in one round trip."""
+        pipeline = self.client.pipeline(transaction=False)
+        for (dimension, value, resolution, bucket), ips in pending.items():
+            key = counter_key(dimension, value, resolution, bucket)
+            pipeline.pfadd(key, *ips)
+            pipeline.expire(key, self.retention[resolution])
+        pipeline.execute()
+
+    def count(self, keys):
+        if not keys:
+            return 0
+        return int(self.client.pfcount(*(counter_key(*key) for key in keys)))
+
+    def count_each(self, keys):
+        """The estimate of each key on its own, in one round trip."""
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.pfcount(counter_key(*key))
+        return [int(count) for count in pipeline.execute()]
+
+
+class LocalCardinalityBackend:
+    """In-process HyperLogLog counters, shared between workers through cache slots."""
+
+    def __init__(self, retention, precision=12, clock=time.time):
+        self.retention = retention
+        self.precision = precision
+        self.clock = clock
+        self._counters = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def add_many(self, pending):
+        # Writes stay under the lock too, so a key never claims two slots
+        with self._lock:
+            self._expire()
+            touched = {}
+            for key, ips in pending.items():
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = HyperLogLog(self.precision)
+                for ip_address in ips:
+                    counter.add(ip_address)
+                touched[key] = counter
+            for key, counter in touched.items():
+                self._write(key, counter.to_bytes())
+
+    def _expire(self):
+        # Once a bucket has closed, its last flush has been written
+        now = self.clock()
+        for key in list(self._counters):
+            _, _, resolution, bucket = key
+            if (bucket + 2) * RESOLUTIONS[resolution] < now:
+                del self._counters[key]
+                self._slots.pop(key, None)
+
+    def _write(self, key, registers):
+        name = counter_key(*key)
+        timeout = self.retention[key[2]]
+        try:
+            slot = self._slots.get(key)
+            if slot is None:
+                cache.add(f"{name}:slots", 0, timeout)
+                slot = self._slots[key] = cache.incr(f"{name}:slots") - 1
+            cache.set(f"{name}:{slot}", registers, timeout)
+        except Exception as e:
+            logger.error(f"Failed to store unique visitor counter {name}: {e}")
+
+    def count(self, keys):
+        counter = HyperLogLog(self.precision)
+        for registers in self._registers(keys).values():
+            for slot in registers:
+                counter.merge(slot)
+        return counter.count()
+
+    def count_each(self, keys):
+        """The estimate of each key on its own, from the same two cache calls as ``count``."""
+        registers = self._registers(keys)
+        counts = []
+        for key in keys:
+            counter = HyperLogLog(self.precision)
+            for slot in registers.get(counter_key(*key), []):
+                counter.merge(slot)
+            counts.append(counter.count())
+        return counts
+
+    def _registers(self, keys):
+        """{counter name: [registers of each worker slot]} in two cache calls."""
+        names = [counter_key(*key) for key in keys]
+        slot_counts = cache.get_many([f"{name}:slots" for name in names])
+        slot_keys = {
+            f"{name}:{slot}": name
+            for name in names
+            for slot in range(slot_counts.get(f"{name}:slots", 0))
+        }
+        registers = defaultdict(list)
+        for slot_key, slot in cache.get_many(list(slot_keys)).items():
+            registers[slot_keys[slot_key]].append(slot)
+        return registers
+
+
+def resolve_backend(choice, retention):
+    """
+    Backend for a ``CARDINALITY_BACKEND`` value: 'redis', 'local', or 'auto'
+    (Redis when the default cache is django-redis). None means local only.
+    """
+    if choice == 'local':
+        return None
+    try:
+        from django_redis import get_redis_connection
+
+        return RedisCardinalityBackend(get_redis_connection('default'), retention)
+    except (ImportError, NotImplementedError):
+        if choice == 'redis':
+            logger.warning("CARDINALITY_BACKEND is 'redis' but the default cache is not django-redis")
+        return None
+
+
+class UniqueVisitorCounter:
+    def __init__(
+        self,
+        backend='auto',
+        flush_interval=1.0,
+        minute_retention=3 * HOUR,
+        hour_retention=8 * 24 * HOUR,
+        max_pending=50000,
+        max_routes=1000,
+        clock=time.time,
+    ):
+        self.retention = {'minute': minute_retention, 'hour': hour_retention}
+        if isinstance(backend, str):
+            backend = resolve_backend(backend, self.retention)
+        self.backend = backend
+        self.local = LocalCardinalityBackend(self.retention, clock=clock)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_routes = max_routes
+        self.clock = clock
+        self._pending = defaultdict(set)
+        self._routes = defaultdict(set)
+        self._pending_values = 0
+        self._lock = threading.Lock()
+        self._last_flush = clock()
+
+    def record(self, ip_address, path=None):
+        """Count ``ip_address`` as a visitor of the site and, if given, of ``path``'s route."""
+        values = [('all', '')]
+        if path is not None:
+            values.append(('path', normalize_path(path)))
+        self._add(ip_address, values)
+
+    def record_country(self, ip_address, country):
+        self._add(ip_address, [('country', country)])
+
+    def _add(self, ip_address, values):
+        now = self.clock()
+        with self._lock:
+            for dimension, value in values:
+                for resolution, seconds in RESOLUTIONS.items():
+                    self._pending[(dimension, value, resolution, int(now // seconds))].add(ip_address)
+            self._pending_values += len(values)
+            due = now - self._last_flush >= self.flush_interval or self._pending_values >= self.max_pending
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(set)
+            self._pending_values = 0
+            self._last_flush = self.clock()
+            pending = self._cap_routes(pending)
+        if not pending:
+            return
+        if self.backend is not None:
+            try:
+                self.backend.add_many(pending)
+                return
+            except Exception as e:
+                logger.error(f"Unique visitor counters unavailable, keeping them in process: {e}")
+        self.local.add_many(pending)
+
+    def _cap_routes(self, pending):
+        """Fold the routes past ``max_routes`` in a bucket into OTHER_ROUTES; called under the lock."""
+        now = self.clock()
+        for resolution, bucket in list(self._routes):
+            if (bucket + 2) * RESOLUTIONS[resolution] < now:
+                del self._routes[(resolution, bucket)]
+        capped = defaultdict(set)
+        for (dimension, value, resolution, bucket), ips in pending.items():
+            if dimension == 'path':
+                routes = self._routes[(resolution, bucket)]
+                if value not in routes:
+                    if len(routes) < self.max_routes:
+                        routes.add(value)
+                    else:
+                        value = OTHER_ROUTES
+            capped[(dimension, value, resolution, bucket)] |= ips
+        return capped
+
+    def buckets(self, since, until):
+        """(resolution, bucket) pairs covering [since, until) in Unix seconds."""
+        now = self.clock()
+        start = int(since // MINUTE) * MINUTE
+        end = (int(until // MINUTE) + 1) * MINUTE
+        covering, seen = [], set()
+        t = start
+        while t < end:
+            if t % HOUR == 0 and t + HOUR <= end:
+                covering.append(('hour', t // HOUR))
+                t += HOUR
+            elif now - t > self.retention['minute']:
+                hour = ('hour', t // HOUR)
+                if hour not in seen:
+                    seen.add(hour)
+                    covering.append(hour)
+                t = (t // HOUR + 1) * HOUR
+            else:
+                covering.append(('minute', t // MINUTE))
+                t += MINUTE
+        return covering
+
+    def count(self, dimension='all', value='', since=None, until=None):
+        """Estimated distinct IPs of ``dimension``/``value`` in [since, until) (datetimes)."""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        if dimension == 'path':
+            value = normalize_path(value)
+        until = until.timestamp() if until else self.clock()
+        since = since.timestamp() if since else until - HOUR
+        return self._count([
+            (dimension, value, resolution, bucket) for resolution, bucket in self.buckets(since, until)
+        ])
+
+    def series(self, dimension='all', value='', since=None, until=None, resolution='hour'):
+        """[(bucket start, estimated distinct IPs)] for each ``resolution`` bucket in the range."""
+        seconds = RESOLUTIONS[resolution]
+        until = until.timestamp() if until else self.clock()
+        since = since.timestamp() if since else until - HOUR
+        if dimension == 'path':
+            value = normalize_path(value)
+        buckets = range(int(since // seconds), int(until // seconds) + 1)
+        counts = self._count([(dimension, value, resolution, bucket) for bucket in buckets], each=True)
+        return [
+            (datetime.fromtimestamp(bucket * seconds, tz=dt_timezone.utc), count)
+            for bucket, count in zip(buckets, counts)
+        ]
+
+    def _count(self, keys, each=False):
+        """The estimate over all ``keys`` merged, or with ``each`` a list with one per key."""
+        if self.backend is not None:
+            try:
+                return self.backend.count_each(keys) if each else self.backend.count(keys)
+            except Exception as e:
+                logger.error(f"Unique visitor counters unavailable, answering from the fallback: {e}")
+        return self.local.count_each(keys) if each else self.local.count(keys)
+
+
+unique_visitors = UniqueVisitorCounter(
+    backend=getattr(settings, 'CARDINALITY_BACKEND', 'auto'),
+    flush_interval=getattr(settings, 'CARDINALITY_FLUSH_INTERVAL', 1.0),
+    minute_retention=getattr(settings, 'CARDINALITY_MINUTE_RETENTION', 3 * HOUR),
+    hour_retention=getattr(settings, 'CARDINALITY_HOUR_RETENTION', 8 * 24 * HOUR),
+    max_routes=getattr(settings, 'CARDINALITY_MAX_ROUTES', 1000),
+)
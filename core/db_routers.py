@@ -0,0 +1,61 @@
+"""
+Database routing for request-log traffic.
+
+RequestLog, SuspiciousIP, SuspiciousNetwork, BlockedIP and the tables that only exist to serve
+them (IPGeolocation, TaskWatermark, IPWindowAggregate, the UserAgent/RequestPath dimensions) live on the ``REQUEST_LOG_DATABASE``
+alias, so append-heavy logging never queues behind auth and session writes
+on the default database. Without that alias everything stays on
+``default``. Detection can read from ``DETECTION_READ_DATABASE`` (a replica
+of the logs database) when one is configured.
+"""
+from django.conf import settings
+
+LOG_MODELS = {
+    'requestlog', 'suspiciousip', 'blockedip', 'ipgeolocation', 'taskwatermark',
+    'useragent', 'requestpath', 'suspiciousnetwork', 'ipwindowaggregate',
+}
+
+
+def logs_database():
+    alias = getattr(settings, 'REQUEST_LOG_DATABASE', 'logs')
+    return alias if alias in settings.DATABASES else 'default'
+
+
+def detection_database():
+    """Alias detection reads use: the replica if configured, else the logs database."""
+    alias = getattr(settings, 'DETECTION_READ_DATABASE', None)
+    return alias if alias and alias in settings.DATABASES else logs_database()
+
+
+def is_log_model(model):
+    return model._meta.app_label == 'core' and model._meta.model_name in LOG_MODELS
+
+
+class RequestLogRouter:
+    def db_for_read(self, model, **hints):
+        if is_log_model(model):
+            return logs_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_log_model(model):
+            return logs_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_log_model(type(obj1)) != is_log_model(type(obj2)):
+            return logs_database() == 'default'
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        logs = logs_database()
+        if db == getattr(settings, 'DETECTION_READ_DATABASE', None) and db != logs:
+            # Replicas get their schema and rows from the primary
+            return False
+        if logs == 'default':
+            return None
+        if app_label == 'core' and model_name in LOG_MODELS:
+            return db == logs
+        if db == logs:
+            return False
+        return None
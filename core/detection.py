@@ -0,0 +1,528 @@
+"""
+Columnar detection engine.
+
+A time window of RequestLog is streamed once into NumPy arrays:
+
+* ``ip_codes``: int64 code per row into ``ips``; each distinct address is
+  parsed once into integers (``ip_hi``/``ip_lo`` 64-bit words, ``ip_versions``)
+* ``path_codes``: int64 dictionary code per row into ``paths``
+* ``timestamps``: int64 microseconds since the epoch
+* ``status_codes``: int16 response status (0 when unknown)
+
+Every registered rule is evaluated against the same frame with vectorized
+grouping (``bincount`` / ``unique``), so adding a rule never adds a scan.
+Register a rule with ``@register_rule`` and enable it in ``DETECTION_RULES``.
+
+``NetworkAggregator`` rolls the per-IP counts up into IPv4/IPv6 networks
+(``NETWORK_DETECTION_RULES``), masking the integer address words so a /24
+or /64 is one ``unique`` over the distinct addresses, not a Python loop.
+"""
+import ipaddress
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from .db_routers import detection_database
+from .models import RequestLog
+from .ip_classifier import ip_classifier, parse as parse_ip
+from .tasks import SENSITIVE_PATHS
+
+logger = logging.getLogger(__name__)
+
+MICROSECONDS = 1_000_000
+
+RULES = {}
+
+
+def register_rule(rule_class):
+    RULES[rule_class.name] = rule_class
+    return rule_class
+
+
+class WindowFrame:
+    """Columnar view of the RequestLog rows in one time window."""
+
+    def __init__(self, ips, paths, ip_codes, path_codes, timestamps, status_codes, start=None, end=None):
+        self.start = start
+        self.end = end
+        self.ips = ips
+        self.paths = paths
+        self.ip_codes = ip_codes
+        self.path_codes = path_codes
+        self.timestamps = timestamps
+        self.status_codes = status_codes
+        self.ip_hi, self.ip_lo, self.ip_versions = ip_columns(ips)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.ip_codes)
+
+    @property
+    def n_ips(self):
+        return len(self.ips)
+
+    @property
+    def n_paths(self):
+        return len(self.paths)
+
+    def requests_per_ip(self):
+        if 'requests' not in self._cache:
+            self._cache['requests'] = np.bincount(self.ip_codes, minlength=self.n_ips)
+        return self._cache['requests']
+
+    def sensitive_rows(self):
+        """Boolean mask of the rows whose path starts with a sensitive prefix."""
+        if 'sensitive_rows' not in self._cache:
+            prefixes = tuple(SENSITIVE_PATHS)
+            sensitive_path = np.fromiter(
+                (path.startswith(prefixes) for path in self.paths),
+                dtype=bool, count=self.n_paths,
+            )
+            self._cache['sensitive_rows'] = sensitive_path[self.path_codes]
+        return self._cache['sensitive_rows']
+
+    def sensitive_requests_per_ip(self):
+        if 'sensitive_requests' not in self._cache:
+            self._cache['sensitive_requests'] = np.bincount(
+                self.ip_codes[self.sensitive_rows()], minlength=self.n_ips
+            )
+        return self._cache['sensitive_requests']
+
+    def distinct_per_ip(self, codes, size, mask=None):
+        """Number of distinct ``codes`` per IP, optionally over masked rows only."""
+        ip_codes = self.ip_codes if mask is None else self.ip_codes[mask]
+        codes = codes if mask is None else codes[mask]
+        pairs = np.unique(ip_codes * size + codes)
+        return np.bincount(pairs // size, minlength=self.n_ips)
+
+    @classmethod
+    def load(cls, start, end, chunk_size=10000):
+        """Stream RequestLog rows in [start, end) into a frame."""
+        ip_lookup = {}
+        path_lookup = {}
+        ip_chunks, path_chunks, ts_chunks, status_chunks = [], [], [], []
+
+        rows = (
+            RequestLog.objects.using(detection_database())
+            .filter(timestamp__gte=start, timestamp__lt=end)
+            .order_by()
+            .values_list('ip_address', 'path', 'timestamp', 'status_code')
+            .iterator(chunk_size=chunk_size)
+        )
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                cls._encode_chunk(chunk, ip_lookup, path_lookup,
+                                  ip_chunks, path_chunks, ts_chunks, status_chunks)
+                chunk = []
+        if chunk:
+            cls._encode_chunk(chunk, ip_lookup, path_lookup,
+                              ip_chunks, path_chunks, ts_chunks, status_chunks)
+
+        def concat(chunks, dtype):
+            return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+        return cls(
+            ips=list(ip_lookup),
+            paths=list(path_lookup),
+            ip_codes=concat(ip_chunks, np.int64),
+            path_codes=concat(path_chunks, np.int64),
+            timestamps=concat(ts_chunks, np.int64),
+            status_codes=concat(status_chunks, np.int16),
+            start=start,
+            end=end,
+        )
+
+    @staticmethod
+    def _encode_chunk(chunk, ip_lookup, path_lookup,
+                      ip_chunks, path_chunks, ts_chunks, status_chunks):
+        count = len(chunk)
+        ip_chunks.append(np.fromiter(
+            (ip_lookup.setdefault(row[0], len(ip_lookup)) for row in chunk),
+            dtype=np.int64, count=count,
+        ))
+        path_chunks.append(np.fromiter(
+            (path_lookup.setdefault(row[1], len(path_lookup)) for row in chunk),
+            dtype=np.int64, count=count,
+        ))
+        ts_chunks.append(np.fromiter(
+            (int(row[2].timestamp() * MICROSECONDS) for row in chunk),
+            dtype=np.int64, count=count,
+        ))
+        status_chunks.append(np.fromiter(
+            (row[3] or 0 for row in chunk),
+            dtype=np.int16, count=count,
+        ))
+
+
+def ip_columns(ips):
+    """Parse distinct addresses once into (high word, low word, version) arrays."""
+    hi = np.zeros(len(ips), dtype=np.uint64)
+    lo = np.zeros(len(ips), dtype=np.uint64)
+    versions = np.zeros(len(ips), dtype=np.uint8)
+    for code, ip in enumerate(ips):
+        parsed = parse_ip(ip)
+        if parsed is None:
+            continue
+        version, value = parsed
+        hi[code] = value >> 64
+        lo[code] = value & 0xFFFFFFFFFFFFFFFF
+        versions[code] = version
+    return hi, lo, versions
+
+
+def network_masks(version, prefix_length):
+    """(high word, low word) masks keeping the first ``prefix_length`` bits."""
+    full = (1 << 64) - 1
+    if version == 4:
+        # IPv4 addresses live in the low 32 bits of the low word
+        return np.uint64(0), np.uint64(((1 << 32) - 1) ^ ((1 << (32 - prefix_length)) - 1))
+    high = full ^ ((1 << max(64 - prefix_length, 0)) - 1)
+    low = full ^ ((1 << min(128 - prefix_length, 64)) - 1)
+    return np.uint64(high), np.uint64(low)
+
+
+class NetworkAggregator:
+    """
+    Roll per-IP request and sensitive-path counts up into networks.
+
+    Each rule names an IP version and prefix length plus the thresholds a
+    network must reach: ``requests`` or ``sensitive_requests`` in total,
+    spread over at least ``min_ips`` addresses (a single noisy address is
+    the per-IP rules' job). All rules read the same per-IP arrays, so the
+    log window is still scanned once.
+    """
+    defaults = {'requests': 1000, 'sensitive_requests': 20, 'min_ips': 4, 'top_ips': 10}
+    default_rules = [
+        {'version': 4, 'prefix_length': 24},
+        {'version': 6, 'prefix_length': 64},
+        {'version': 6, 'prefix_length': 48},
+    ]
+
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = getattr(settings, 'NETWORK_DETECTION_RULES', self.default_rules)
+        self.rules = [{**self.defaults, **rule} for rule in rules]
+
+    def evaluate_frame(self, frame):
+        return self.evaluate(
+            frame.ips, frame.ip_hi, frame.ip_lo, frame.ip_versions,
+            frame.requests_per_ip(), frame.sensitive_requests_per_ip(),
+        )
+
+    def evaluate_aggregates(self, merged):
+        """Same as ``evaluate`` for the {ip: aggregates} dicts of the sharded engine."""
+        ips = list(merged)
+        hi, lo, versions = ip_columns(ips)
+        requests = np.fromiter((merged[ip]['requests'] for ip in ips), dtype=np.int64, count=len(ips))
+        sensitive = np.fromiter(
+            (merged[ip]['sensitive_requests'] for ip in ips), dtype=np.int64, count=len(ips)
+        )
+        return self.evaluate(ips, hi, lo, versions, requests, sensitive)
+
+    def evaluate(self, ips, hi, lo, versions, requests, sensitive_requests):
+        """
+        Returns {network: (reason, details)} for every flagged network, with
+        ``network`` in CIDR notation, e.g. '203.0.113.0/24'.
+        """
+        findings = {}
+        for rule in self.rules:
+            network_class = ipaddress.IPv4Network if rule['version'] == 4 else ipaddress.IPv6Network
+            version, prefix_length = rule['version'], rule['prefix_length']
+            members = np.flatnonzero(versions == version)
+            if not members.size:
+                continue
+            mask_hi, mask_lo = network_masks(version, prefix_length)
+            key_hi, key_lo = hi[members] & mask_hi, lo[members] & mask_lo
+            if version == 6 and prefix_length > 64:
+                keys, inverse = np.unique(np.stack([key_hi, key_lo], axis=1), axis=0, return_inverse=True)
+                key_hi, key_lo = keys[:, 0], keys[:, 1]
+            elif version == 6:
+                key_hi, inverse = np.unique(key_hi, return_inverse=True)
+                key_lo = np.zeros(len(key_hi), dtype=np.uint64)
+            else:
+                key_lo, inverse = np.unique(key_lo, return_inverse=True)
+                key_hi = np.zeros(len(key_lo), dtype=np.uint64)
+            inverse = inverse.ravel()
+
+            ip_counts = np.bincount(inverse)
+            request_counts = np.bincount(inverse, weights=requests[members]).astype(np.int64)
+            sensitive_counts = np.bincount(inverse, weights=sensitive_requests[members]).astype(np.int64)
+            volume = request_counts >= rule['requests']
+            probing = sensitive_counts >= rule['sensitive_requests']
+            flagged = np.flatnonzero((ip_counts >= rule['min_ips']) & (volume | probing))
+            if not flagged.size:
+                continue
+
+            # Members grouped by network, so each network's addresses are one run
+            order = np.argsort(inverse, kind='stable')
+            starts = np.searchsorted(inverse[order], flagged, side='left')
+            ends = np.searchsorted(inverse[order], flagged, side='right')
+            for network_code, start, end in zip(flagged, starts, ends):
+                value = (int(key_hi[network_code]) << 64) | int(key_lo[network_code])
+                network = network_class((value, prefix_length))
+                if ip_classifier.is_loopback(str(network.network_address)):
+                    continue
+                addresses = members[order[start:end]]
+                top = addresses[np.argsort(-requests[addresses], kind='stable')[:rule['top_ips']]]
+                reasons = [
+                    reason for reason, hit in
+                    [('network_volume', volume[network_code]), ('network_sensitive_paths', probing[network_code])]
+                    if hit
+                ]
+                findings[str(network)] = (
+                    reasons[0] if len(reasons) == 1 else 'multiple_reasons',
+                    {
+                        'reasons': reasons,
+                        'prefix_length': prefix_length,
+                        'request_count': int(request_counts[network_code]),
+                        'total_sensitive_requests': int(sensitive_counts[network_code]),
+                        'ip_count': int(ip_counts[network_code]),
+                        'top_ips': {ips[code]: int(requests[code]) for code in top},
+                    },
+                )
+        return findings
+
+
+class DetectionRule:
+    """
+    Base class for detection rules.
+
+    ``evaluate`` returns {ip_code: details} for every IP the rule flags.
+    Options come from the rule's entry in ``DETECTION_RULES``.
+    """
+    name = None
+    reason = None
+    defaults = {}
+
+    def __init__(self, **options):
+        self.options = {**self.defaults, **options}
+
+    def evaluate(self, frame):
+        raise NotImplementedError
+
+
+@register_rule
+class VolumeRule(DetectionRule):
+    name = 'volume'
+    reason = 'high_volume'
+    defaults = {'threshold': 100}
+
+    def evaluate(self, frame):
+        requests = frame.requests_per_ip()
+        flagged = np.flatnonzero(requests > self.options['threshold'])
+        return {int(code): {'request_count': int(requests[code])} for code in flagged}
+
+
+@register_rule
+class SensitivePathRule(DetectionRule):
+    name = 'sensitive_paths'
+    reason = 'sensitive_paths'
+    defaults = {'min_requests': 1}
+
+    def evaluate(self, frame):
+        rows = frame.sensitive_rows()
+        hits = frame.sensitive_requests_per_ip()
+
+        # Distinct (ip, path) pairs come back sorted by IP, so each IP's
+        # paths are one contiguous run
+        size = max(frame.n_paths, 1)
+        pairs = np.unique(frame.ip_codes[rows] * size + frame.path_codes[rows])
+        pair_ips, pair_paths = pairs // size, pairs % size
+
+        flagged = np.flatnonzero(hits >= self.options['min_requests'])
+        starts = np.searchsorted(pair_ips, flagged, side='left')
+        ends = np.searchsorted(pair_ips, flagged, side='right')
+
+        findings = {}
+        for code, start, end in zip(flagged, starts, ends):
+            if ip_classifier.is_loopback(frame.ips[code]):
+                continue
+            findings[int(code)] = {
+                'sensitive_paths_accessed': sorted(frame.paths[p] for p in pair_paths[start:end]),
+                'total_sensitive_requests': int(hits[code]),
+                'unique_sensitive_paths': int(end - start),
+            }
+        return findings
+
+
+@register_rule
+class PathDiversityRule(DetectionRule):
+    name = 'path_diversity'
+    reason = 'path_diversity'
+    defaults = {'min_distinct_paths': 50}
+
+    def evaluate(self, frame):
+        distinct = frame.distinct_per_ip(frame.path_codes, max(frame.n_paths, 1))
+        flagged = np.flatnonzero(distinct >= self.options['min_distinct_paths'])
+        return {int(code): {'distinct_paths': int(distinct[code])} for code in flagged}
+
+
+@register_rule
+class ErrorRatioRule(DetectionRule):
+    name = 'error_ratio'
+    reason = 'error_ratio'
+    defaults = {'min_requests': 20, 'ratio': 0.5}
+
+    def evaluate(self, frame):
+        requests = frame.requests_per_ip()
+        client_errors = (frame.status_codes >= 400) & (frame.status_codes < 500)
+        errors = np.bincount(frame.ip_codes[client_errors], minlength=frame.n_ips)
+        ratio = errors / np.maximum(requests, 1)
+        flagged = np.flatnonzero(
+            (requests >= self.options['min_requests']) & (ratio >= self.options['ratio'])
+        )
+        return {
+            int(code): {'client_errors': int(errors[code]), 'error_ratio': round(float(ratio[code]), 3)}
+            for code in flagged
+        }
+
+
+@register_rule
+class BurstRule(DetectionRule):
+    name = 'burst'
+    reason = 'burst'
+    defaults = {'bucket_seconds': 60, 'per_bucket': 60}
+
+    def evaluate(self, frame):
+        if not len(frame):
+            return {}
+        buckets = frame.timestamps // (self.options['bucket_seconds'] * MICROSECONDS)
+        buckets -= buckets.min()
+        size = int(buckets.max()) + 1
+        pairs, counts = np.unique(frame.ip_codes * size + buckets, return_counts=True)
+        peak = np.zeros(frame.n_ips, dtype=np.int64)
+        np.maximum.at(peak, pairs // size, counts)
+        active = np.bincount(pairs // size, minlength=frame.n_ips)
+
+        flagged = np.flatnonzero(peak >= self.options['per_bucket'])
+        requests = frame.requests_per_ip()
+        return {
+            int(code): {
+                'peak_requests_per_bucket': int(peak[code]),
+                'burstiness': round(float(peak[code] * active[code] / requests[code]), 3),
+            }
+            for code in flagged
+        }
+
+
+@register_rule
+class PathScanRule(DetectionRule):
+    """
+    A route that more than ``min_unique_ips`` distinct IPs requested in the
+    window (HyperLogLog estimate from core.cardinality, no per-IP scan) and
+    that answers mostly 4xx is being scanned. Flags the IPs with at least
+    ``min_failed_requests`` failed requests to scanned routes, or failures on
+    ``min_scanned_routes`` distinct ones; a browser's single favicon 404 is
+    neither.
+    """
+    name = 'path_scan'
+    reason = 'path_scan'
+    defaults = {
+        'min_unique_ips': 50, 'min_error_ratio': 0.9, 'min_failed_requests': 5, 'min_scanned_routes': 3,
+    }
+
+    def evaluate(self, frame):
+        from .cardinality import unique_visitors
+        from .dimensions import normalize_path
+
+        if not len(frame) or frame.start is None:
+            return {}
+        client_errors = (frame.status_codes >= 400) & (frame.status_codes < 500)
+        routes = {}
+        for code, path in enumerate(frame.paths):
+            routes.setdefault(normalize_path(path), []).append(code)
+        route_codes = np.zeros(frame.n_paths, dtype=np.int64)
+        for route_code, codes in enumerate(routes.values()):
+            route_codes[codes] = route_code
+        row_routes = route_codes[frame.path_codes]
+        requests = np.bincount(row_routes, minlength=len(routes))
+        errors = np.bincount(row_routes[client_errors], minlength=len(routes))
+        # Only ask the counters about routes that are failing for most clients
+        failing = np.flatnonzero(errors >= np.maximum(requests * self.options['min_error_ratio'], 1))
+
+        names = list(routes)
+        scanned = {}
+        for route_code in failing:
+            # The frame alone cannot clear the threshold when it saw too few rows
+            if requests[route_code] <= self.options['min_unique_ips']:
+                continue
+            visitors = unique_visitors.count('path', names[route_code], since=frame.start, until=frame.end)
+            if visitors > self.options['min_unique_ips']:
+                scanned[int(route_code)] = visitors
+        if not scanned:
+            return {}
+
+        rows = client_errors & np.isin(row_routes, list(scanned))
+        size = len(routes)
+        pairs = np.unique(frame.ip_codes[rows] * size + row_routes[rows])
+        pair_ips, pair_routes = pairs // size, pairs % size
+        failed = np.bincount(frame.ip_codes[rows], minlength=frame.n_ips)
+        routes_failed = np.bincount(pair_ips, minlength=frame.n_ips)
+        flagged = np.flatnonzero(
+            (failed >= self.options['min_failed_requests'])
+            | (routes_failed >= self.options['min_scanned_routes'])
+        )
+        starts = np.searchsorted(pair_ips, flagged, side='left')
+        ends = np.searchsorted(pair_ips, flagged, side='right')
+
+        findings = {}
+        for code, start, end in zip(flagged, starts, ends):
+            if ip_classifier.is_loopback(frame.ips[code]):
+                continue
+            findings[int(code)] = {
+                'failed_requests': int(failed[code]),
+                'scanned_routes': {names[route]: scanned[int(route)] for route in pair_routes[start:end]},
+            }
+        return findings
+
+
+class DetectionEngine:
+    """Evaluate the configured rules against one load of the window."""
+
+    def __init__(self, rules=None, chunk_size=10000, network_rules=None):
+        if rules is None:
+            rules = getattr(settings, 'DETECTION_RULES', {name: {} for name in RULES})
+        self.rules = [RULES[name](**(options or {})) for name, options in rules.items()]
+        self.networks = NetworkAggregator(network_rules)
+        self.chunk_size = chunk_size
+
+    def load(self, start, end):
+        frame = WindowFrame.load(start, end, chunk_size=self.chunk_size)
+        logger.info(f"Loaded {len(frame)} rows, {frame.n_ips} IPs, {frame.n_paths} paths")
+        return frame
+
+    def run(self, start, end):
+        return self.evaluate(self.load(start, end))
+
+    def run_with_networks(self, start, end):
+        """(IP findings, network findings) from a single load of the window."""
+        frame = self.load(start, end)
+        return self.evaluate(frame), self.networks.evaluate_frame(frame)
+
+    def evaluate(self, frame):
+        """
+        Returns {ip: (reason, details)} in the same shape as
+        ``core.tasks.evaluate_aggregates``.
+        """
+        findings = {}
+        requests = frame.requests_per_ip()
+        for rule in self.rules:
+            for code, details in rule.evaluate(frame).items():
+                ip_address = frame.ips[code]
+                reasons, merged = findings.setdefault(
+                    ip_address, ([], {'request_count': int(requests[code])})
+                )
+                reasons.append(rule.reason)
+                merged.update(details)
+
+        return {
+            ip_address: (
+                reasons[0] if len(reasons) == 1 else 'multiple_reasons',
+                {**details, 'reasons': reasons},
+            )
+            for ip_address, (reasons, details) in findings.items()
+        }
@@ -0,0 +1,122 @@
+"""
+Interned dimension values for RequestLog.
+
+User agents repeat millions of times, so RequestLog stores an integer
+reference into the UserAgent table instead of the string. Normalized routes
+go to RequestPath the same way, next to the raw path rather than instead of
+it: normalizing is lossy, and detection and exports need the exact path.
+Each dimension row is keyed by a 64-bit BLAKE2 digest of its value
+(a unique integer index). ``DimensionCache`` keeps a bounded in-process
+value -> id map in front of the table and resolves a whole batch of new
+values with one SELECT and one INSERT.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+
+_NUMERIC = re.compile(r'^\d+$')
+_OPAQUE_ID = re.compile(r'^(?:[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}|[0-9a-fA-F]{16,})$')
+ID_PLACEHOLDER = ':id'
+
+
+def digest(value):
+    """Signed 64-bit BLAKE2 digest of ``value``, the lookup key of a dimension row."""
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def normalize_path(path):
+    """
+    Route of a request path: query string dropped and numeric or opaque id
+    segments replaced with ':id', so /api/orders/42/ and /api/orders/43/
+    share one row.
+    """
+    path = (path or '').split('?', 1)[0].split('#', 1)[0]
+    segments = [
+        ID_PLACEHOLDER if _NUMERIC.match(segment) or _OPAQUE_ID.match(segment) else segment
+        for segment in path.split('/')
+    ]
+    return '/'.join(segments)[:255]
+
+
+class DimensionCache:
+    def __init__(self, model_name, normalize=None, max_entries=10000):
+        self.model_name = model_name
+        self.normalize = normalize or (lambda value: value or '')
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        from django.apps import apps
+
+        return apps.get_model('core', self.model_name)
+
+    def get_id(self, value):
+        return self.get_ids([value]).get(self.normalize(value))
+
+    def get_ids(self, values):
+        """Return {normalized value: id}, creating the rows that do not exist yet."""
+        wanted = {self.normalize(value) for value in values}
+        found = {}
+        with self._lock:
+            for value in wanted:
+                if value in self._ids:
+                    self._ids.move_to_end(value)
+                    found[value] = self._ids[value]
+
+        missing = {digest(value): value for value in wanted if value not in found}
+        if not missing:
+            return found
+
+        model = self.model
+        resolved = self._fetch(model, missing)
+        new = [model(digest=key, value=value) for key, value in missing.items() if value not in resolved]
+        if new:
+            model.objects.bulk_create(new, ignore_conflicts=True)
+            resolved.update(self._fetch(model, {row.digest: row.value for row in new}))
+        found.update(resolved)
+
+        # Only remember ids once they are committed, so a rolled back
+        # transaction cannot leave ids of rows that do not exist
+        transaction.on_commit(lambda: self._remember(resolved), using=model.objects.db)
+        return found
+
+    @staticmethod
+    def _fetch(model, by_digest):
+        rows = model.objects.filter(digest__in=list(by_digest)).values_list('id', 'digest', 'value')
+        # Compare the values too: a digest collision must not alias two strings
+        return {value: pk for pk, key, value in rows if by_digest.get(key) == value}
+
+    def _remember(self, resolved):
+        with self._lock:
+            self._ids.update(resolved)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+user_agents = DimensionCache('UserAgent')
+request_paths = DimensionCache('RequestPath', normalize=normalize_path)
+
+
+def intern_request_logs(logs):
+    """Set the user agent and route references of unsaved RequestLog objects in bulk."""
+    pending_agents = [log for log in logs if log.pending_user_agent is not None]
+    pending_paths = [log for log in logs if log.path_ref_id is None and log.path]
+
+    if pending_agents:
+        ids = user_agents.get_ids(log.pending_user_agent for log in pending_agents)
+        for log in pending_agents:
+            log.user_agent_ref_id = ids.get(user_agents.normalize(log.pending_user_agent))
+            log.pending_user_agent = None
+    if pending_paths:
+        ids = request_paths.get_ids(log.path for log in pending_paths)
+        for log in pending_paths:
+            log.path_ref_id = ids.get(normalize_path(log.path))
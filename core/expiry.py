@@ -0,0 +1,173 @@
+"""
+Expiry of SuspiciousIP and BlockedIP entries.
+
+Every entry gets an ``expires_at`` when it is flagged or blocked:
+
+* SuspiciousIP: ``SUSPICIOUS_IP_TTLS[reason]`` seconds, else
+  ``SUSPICIOUS_IP_DEFAULT_TTL``
+* BlockedIP: ``BLOCKED_IP_TTL`` seconds unless the caller gives a TTL;
+  None never expires
+
+Repeat offenders stay longer. ``offense_count`` goes up each time an entry
+that had lapsed (inactive or expired) is flagged again, and the TTL is
+multiplied by ``IP_TTL_ESCALATION_FACTOR`` for every earlier offense, up to
+``IP_TTL_MAX``. Flagging an entry that is still active only pushes its
+expiry out.
+
+Expired entries drop out of the in-process snapshots at their next reload.
+``sweep_expired_ips`` then deactivates them in ``IP_SWEEP_BATCH_SIZE``-row
+UPDATEs and bumps the snapshot versions so every worker reloads. Entries
+that expired more than ``EXPIRED_IP_RETENTION_DAYS`` ago are deleted,
+which also forgets their offenses. The active sets, and so every snapshot
+rebuild, stay the size of the current threats.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUSPICIOUS_IP_TTLS = {
+    'high_volume': 6 * 3600,
+    'burst': 6 * 3600,
+    'error_ratio': 12 * 3600,
+    'sensitive_paths': 24 * 3600,
+    'path_diversity': 24 * 3600,
+    'path_scan': 24 * 3600,
+    'multiple_reasons': 72 * 3600,
+}
+
+
+def unexpired(now=None):
+    """Filter for entries without an expiry or whose expiry is still ahead."""
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=now or timezone.now())
+
+
+def suspicious_ip_ttl(reason):
+    ttls = getattr(settings, 'SUSPICIOUS_IP_TTLS', DEFAULT_SUSPICIOUS_IP_TTLS)
+    return ttls.get(reason, getattr(settings, 'SUSPICIOUS_IP_DEFAULT_TTL', 24 * 3600))
+
+
+def blocked_ip_ttl():
+    return getattr(settings, 'BLOCKED_IP_TTL', 30 * 24 * 3600)
+
+
+def escalated_ttl(ttl, offense_count):
+    """``ttl`` seconds grown by the escalation factor for each earlier offense, capped."""
+    factor = getattr(settings, 'IP_TTL_ESCALATION_FACTOR', 2)
+    return min(ttl * factor ** max(0, offense_count - 1), getattr(settings, 'IP_TTL_MAX', 90 * 24 * 3600))
+
+
+def next_expiry(existing, ttl, now):
+    """
+    (offense_count, expires_at) for an entry being flagged again. ``existing``
+    is its (is_active, offense_count, expires_at), or None for a new entry;
+    ``ttl`` None means it never expires. An active entry that never expires
+    stays that way.
+    """
+    if existing is None:
+        offense_count = 1
+    else:
+        is_active, offense_count, expires_at = existing
+        if not is_active or (expires_at is not None and expires_at <= now):
+            offense_count += 1
+        elif expires_at is None:
+            return offense_count, None
+        elif ttl is not None:
+            # Still active: push the expiry out, never pull it in
+            return offense_count, max(expires_at, now + timedelta(seconds=escalated_ttl(ttl, offense_count)))
+    if ttl is None:
+        return offense_count, None
+    return offense_count, now + timedelta(seconds=escalated_ttl(ttl, offense_count))
+
+
+def existing_entries(model, ip_addresses, batch_size=500):
+    """{ip: (is_active, offense_count, expires_at)} of the ``model`` rows for ``ip_addresses``."""
+    ip_addresses = list(ip_addresses)
+    existing = {}
+    for offset in range(0, len(ip_addresses), batch_size):
+        rows = (
+            model.objects.filter(ip_address__in=ip_addresses[offset:offset + batch_size])
+            .order_by()
+            .values_list('ip_address', 'is_active', 'offense_count', 'expires_at')
+        )
+        for ip_address, is_active, offense_count, expires_at in rows:
+            existing[ip_address] = (is_active, offense_count, expires_at)
+    return existing
+
+
+def _in_batches(queryset, apply, batch_size):
+    """Run ``apply`` on ``queryset`` ``batch_size`` primary keys at a time; returns rows affected."""
+    total = 0
+    while True:
+        ids = list(queryset.order_by().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return total
+        total += apply(queryset.model.objects.filter(id__in=ids))
+        if len(ids) < batch_size:
+            return total
+
+
+def sweep_model(model, index, now=None, batch_size=None, retention_days=None):
+    """Deactivate ``model``'s expired entries and delete long-expired ones; returns both counts."""
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'IP_SWEEP_BATCH_SIZE', 1000)
+    if retention_days is None:
+        retention_days = getattr(settings, 'EXPIRED_IP_RETENTION_DAYS', 90)
+
+    deactivated = _in_batches(
+        model.objects.filter(is_active=True, expires_at__lte=now),
+        lambda batch: batch.update(is_active=False),
+        batch_size,
+    )
+    deleted = _in_batches(
+        model.objects.filter(is_active=False, expires_at__lte=now - timedelta(days=retention_days)),
+        lambda batch: batch.delete()[0],
+        batch_size,
+    )
+    if deactivated or deleted:
+        index.invalidate()
+    return deactivated, deleted
+
+
+def sweep_expired_ips(now=None, batch_size=None, retention_days=None):
+    """Sweep both SuspiciousIP and BlockedIP. Returns {'suspicious_ips': (deactivated, deleted), ...}."""
+    from .ip_sets import blocked_ips, suspicious_ips
+    from .models import BlockedIP, SuspiciousIP
+
+    now = now or timezone.now()
+    result = {
+        'suspicious_ips': sweep_model(SuspiciousIP, suspicious_ips, now, batch_size, retention_days),
+        'blocked_ips': sweep_model(BlockedIP, blocked_ips, now, batch_size, retention_days),
+    }
+    logger.info(f"Swept expired IP entries (deactivated, deleted): {result}")
+    return result
+
+
+def backfill_expiry(batch_size=None):
+    """
+    Give entries created before expiry existed an ``expires_at`` from their
+    creation time and default TTL, so the sweeper can retire them too.
+    BlockedIP rows stay permanent when ``BLOCKED_IP_TTL`` is None.
+    """
+    from .models import BlockedIP, SuspiciousIP
+
+    batch_size = batch_size or getattr(settings, 'IP_SWEEP_BATCH_SIZE', 1000)
+    updated = 0
+    for reason in dict(SuspiciousIP.REASON_CHOICES):
+        ttl = timedelta(seconds=suspicious_ip_ttl(reason))
+        updated += _backfill(SuspiciousIP.objects.filter(reason=reason), 'detected_at', ttl, batch_size)
+    if blocked_ip_ttl() is not None:
+        updated += _backfill(BlockedIP.objects.all(), 'created_at', timedelta(seconds=blocked_ip_ttl()), batch_size)
+    return updated
+
+
+def _backfill(queryset, created_field, ttl, batch_size):
+    return _in_batches(
+        queryset.filter(expires_at__isnull=True),
+        lambda batch: batch.update(expires_at=F(created_field) + ttl),
+        batch_size,
+    )
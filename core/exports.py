@@ -0,0 +1,96 @@
+"""
+Streaming export of RequestLog rows.
+
+Rows are read in keyset order on (timestamp, id): every page starts right
+after the last row of the previous one, so there is no OFFSET and no
+re-sorting of rows already sent, and memory stays at one page.
+"""
+import csv
+import json
+
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import RequestLog
+
+EXPORT_FIELDS = [
+    'id', 'timestamp', 'ip_address', 'method', 'path',
+    'status_code', 'country', 'city', 'user_agent',
+]
+# Lookups for EXPORT_FIELDS, in the same order
+EXPORT_COLUMNS = EXPORT_FIELDS[:-1] + ['user_agent_ref__value']
+
+
+def parse_export_time(value):
+    """Parse an ISO 8601 filter value, assuming the current time zone if naive."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid datetime: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_request_logs(ip_address=None, path_prefix=None, country=None, since=None, until=None):
+    logs = RequestLog.objects.all()
+    if ip_address and '/' in ip_address:
+        logs = logs.filter(ip__in_network=ip_address)
+    elif ip_address:
+        logs = logs.filter(ip_address=ip_address)
+    if path_prefix:
+        logs = logs.filter(path__startswith=path_prefix)
+    if country:
+        logs = logs.filter(country=country)
+    if since:
+        logs = logs.filter(timestamp__gte=since)
+    if until:
+        logs = logs.filter(timestamp__lt=until)
+    return logs
+
+
+def iter_request_logs(queryset, page_size=5000):
+    """Yield rows of ``queryset`` as dicts, one keyset page at a time."""
+    last = None
+    while True:
+        page = queryset.order_by('timestamp', 'id')
+        if last is not None:
+            page = page.filter(
+                Q(timestamp__gt=last[0]) | Q(timestamp=last[0], id__gt=last[1])
+            )
+        count = 0
+        rows = page.values(*EXPORT_FIELDS[:-1], user_agent=F('user_agent_ref__value'))
+        for row in rows[:page_size].iterator(chunk_size=page_size):
+            count += 1
+            last = (row['timestamp'], row['id'])
+            yield row
+        if count < page_size:
+            return
+
+
+class Echo:
+    """File-like object whose write() hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+def render_ndjson(rows):
+    for row in rows:
+        row['timestamp'] = row['timestamp'].isoformat()
+        yield json.dumps(row) + '\n'
+
+
+RENDERERS = {
+    'csv': (render_csv, 'text/csv'),
+    'ndjson': (render_ndjson, 'application/x-ndjson'),
+}
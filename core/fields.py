@@ -0,0 +1,116 @@
+"""
+Packed IP address columns.
+
+``PackedIPField`` stores the address of its ``source`` field as 16 big-endian
+bytes, IPv4 in its IPv4-mapped IPv6 form (::ffff:a.b.c.d), so byte order is
+address order for both versions and any network is one contiguous range:
+
+    RequestLog.objects.filter(ip__in_network='203.0.113.0/24')
+
+compiles to ``ip BETWEEN <first> AND <last>``, an index range scan.
+``IPVersionField`` keeps the 4/6 flag next to it. Both are computed from
+the source field whenever a row is saved or bulk-created.
+"""
+import ipaddress
+
+from django.db import models
+from django.db.models import Lookup
+
+from .ip_classifier import parse as parse_ip
+
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+
+
+def pack_ip(ip_address):
+    """16-byte sortable form of ``ip_address``, or None when it is not an address."""
+    parsed = parse_ip(ip_address)
+    if parsed is None:
+        return None
+    version, value = parsed
+    if version == 4:
+        value |= IPV4_MAPPED_PREFIX
+    return value.to_bytes(16, 'big')
+
+
+def unpack_ip(packed):
+    value = int.from_bytes(packed, 'big')
+    if value >> 32 == 0xFFFF:
+        return str(ipaddress.IPv4Address(value & 0xFFFFFFFF))
+    return str(ipaddress.IPv6Address(value))
+
+
+def network_bounds(network):
+    """(first, last) packed addresses of a CIDR network such as '203.0.113.0/24'."""
+    network = ipaddress.ip_network(network, strict=False)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4:
+        first |= IPV4_MAPPED_PREFIX
+        last |= IPV4_MAPPED_PREFIX
+    return first.to_bytes(16, 'big'), last.to_bytes(16, 'big')
+
+
+class PackedIPField(models.BinaryField):
+    def __init__(self, *args, source='ip_address', **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 16)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        kwargs.pop('max_length', None)
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        if connection.vendor == 'mysql':
+            # BinaryField is a BLOB there, which cannot be indexed
+            return 'varbinary(16)'
+        return super().db_type(connection)
+
+    def pre_save(self, model_instance, add):
+        value = pack_ip(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            return pack_ip(value)
+        return super().get_prep_value(value)
+
+    def from_db_value(self, value, expression, connection):
+        return bytes(value) if value is not None else None
+
+
+class IPVersionField(models.PositiveSmallIntegerField):
+    def __init__(self, *args, source='ip_address', **kwargs):
+        self.source = source
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        parsed = parse_ip(getattr(model_instance, self.source))
+        value = parsed[0] if parsed else None
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+@PackedIPField.register_lookup
+class InNetwork(Lookup):
+    lookup_name = 'in_network'
+    prepare_rhs = False
+
+    def get_prep_lookup(self):
+        return network_bounds(self.rhs)
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        first, last = self.rhs
+        return f"{lhs} BETWEEN %s AND %s", (*lhs_params, first, last)
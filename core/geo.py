@@ -0,0 +1,111 @@
+"""
+Geohash helpers for Location proximity queries.
+
+A geohash is a base32 string where every extra character narrows the cell,
+so "all points in a cell" is a prefix match on an indexed column. Queries
+cover the search area with a handful of cells, prefilter on those prefixes
+and refine with an exact bounding-box and great-circle check.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = (value << 1) | 1
+                lon_range[0] = mid
+            else:
+                value <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell."""
+    lat_bits = (5 * precision) // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _steps(low, high, step):
+    value = low
+    while value < high:
+        yield value
+        value += step
+    yield high
+
+
+def covering_cells(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """
+    Geohash prefixes whose cells together cover the bounding box, using the
+    finest precision that needs at most ``max_cells`` cells. An empty list
+    means the box is too large to prefilter.
+    """
+    if min_lon > max_lon:
+        # Box crosses the antimeridian
+        west = covering_cells(min_lat, min_lon, max_lat, 180.0, max_cells // 2)
+        east = covering_cells(min_lat, -180.0, max_lat, max_lon, max_cells // 2)
+        return west + east if west and east else []
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.ceil((max_lat - min_lat) / height) + 1
+        columns = math.ceil((max_lon - min_lon) / width) + 1
+        if rows * columns <= max_cells:
+            return sorted({
+                encode(lat, lon, precision)
+                for lat in _steps(min_lat, max_lat, height)
+                for lon in _steps(min_lon, max_lon, width)
+            })
+    return []
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """Bounding box (min_lat, min_lon, max_lat, max_lon) around a circle."""
+    latitude, longitude = float(latitude), float(longitude)
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-9 or radius_km / (KM_PER_DEGREE_LAT * cos_lat) >= 180:
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    min_lon = (longitude - dlon + 180) % 360 - 180
+    max_lon = (longitude + dlon + 180) % 360 - 180
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,270 @@
+"""
+Tiered geolocation storage.
+
+Lookups go through the Redis cache first (``geolocation_{ip}``, 24h) and fall
+back to the durable ``IPGeolocation`` table, refilling the cache on the way
+out. New provider answers land in the cache immediately and are written to
+the table behind the request, in bulk upserts, including partial ones (a
+country without a city, or nothing at all): the provider will not know more
+tomorrow, and the table ages them out after ``GEOLOCATION_DB_MAX_AGE_DAYS``.
+Failed lookups (the provider errored or its circuit is open) are only cached
+for ``GEOLOCATION_NEGATIVE_CACHE_TTL`` seconds, so an outage does not pin
+'Error' on every IP seen during it.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .ip_classifier import ip_classifier
+from .models import IPGeolocation, RequestLog, TaskWatermark
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 86400
+UNRESOLVED = {'', 'Unknown', 'Error', 'Local', 'Private', 'Blocked'}
+# RequestLog values the backfill retries; Local/Private are final answers
+BACKFILL_VALUES = ['', 'Unknown', 'Error']
+BACKFILL_WATERMARK = 'geolocation_backfill'
+
+
+def cache_key(ip_address):
+    return f"geolocation_{ip_address}"
+
+
+def is_resolved(country, city):
+    return country not in UNRESOLVED and city not in UNRESOLVED
+
+
+def is_answered(country, city):
+    """The provider gave its answer, even if it knows only the country or nothing."""
+    return country not in ('', 'Error')
+
+
+class GeolocationStore:
+    def __init__(self, max_age_days=30, write_batch_size=200, write_interval=5.0):
+        self.max_age = timedelta(days=max_age_days)
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_write = time.monotonic()
+
+    def get(self, ip_address):
+        return self.get_many([ip_address]).get(ip_address)
+
+    def get_many(self, ip_addresses):
+        """
+        Return {ip: (country, city)} for every IP known to the cache or the
+        table; one cache round trip and at most one query for the whole batch.
+        """
+        ip_addresses = list(dict.fromkeys(ip_addresses))
+        found = {}
+        for key, data in cache.get_many([cache_key(ip) for ip in ip_addresses]).items():
+            found[key[len('geolocation_'):]] = (data.get('country', 'Unknown'), data.get('city', 'Unknown'))
+
+        missing = [ip for ip in ip_addresses if ip not in found]
+        if missing:
+            rows = (
+                IPGeolocation.objects
+                .filter(ip_address__in=missing, resolved_at__gte=timezone.now() - self.max_age)
+                .values_list('ip_address', 'country', 'city')
+            )
+            from_db = {ip: (country, city) for ip, country, city in rows}
+            if from_db:
+                cache.set_many(
+                    {cache_key(ip): {'country': c, 'city': t} for ip, (c, t) in from_db.items()},
+                    CACHE_TTL,
+                )
+                found.update(from_db)
+        return found
+
+    def put(self, ip_address, country, city):
+        """Cache a provider answer now and queue it for the durable table."""
+        if not is_answered(country, city):
+            ttl = getattr(settings, 'GEOLOCATION_NEGATIVE_CACHE_TTL', 60)
+            if ttl:
+                cache.set(cache_key(ip_address), {'country': country, 'city': city}, ttl)
+            return
+        cache.set(cache_key(ip_address), {'country': country, 'city': city}, CACHE_TTL)
+        with self._lock:
+            self._pending[ip_address] = (country, city)
+            due = (
+                len(self._pending) >= self.write_batch_size
+                or time.monotonic() - self._last_write >= self.write_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_write = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            return save_geolocations(pending, source='provider')
+        except Exception as e:
+            logger.error(f"Failed to persist {len(pending)} geolocations: {e}")
+            return 0
+
+
+def save_geolocations(locations, source='provider'):
+    """Upsert {ip: (country, city)} into IPGeolocation in one statement per batch."""
+    now = timezone.now()
+    IPGeolocation.objects.bulk_create(
+        [
+            IPGeolocation(ip_address=ip, country=country, city=city, source=source, resolved_at=now)
+            for ip, (country, city) in locations.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['ip_address'],
+        update_fields=['country', 'city', 'source', 'resolved_at'],
+    )
+    return len(locations)
+
+
+def warm_geolocations(limit=1000, days=7):
+    """
+    Preload the ``limit`` busiest IPs of the last ``days`` into the cache.
+    IPs missing from IPGeolocation are recovered from their latest resolved
+    RequestLog row and persisted. Returns the number of IPs cached.
+    """
+    since = timezone.now() - timedelta(days=days)
+    recent = RequestLog.objects.filter(timestamp__gte=since).order_by()
+    hottest = [
+        row['ip_address'] for row in
+        recent.values('ip_address').annotate(requests=Count('id')).order_by('-requests')[:limit]
+    ]
+    if not hottest:
+        return 0
+
+    known = {
+        ip: (country, city) for ip, country, city in
+        IPGeolocation.objects.filter(ip_address__in=hottest).values_list('ip_address', 'country', 'city')
+    }
+
+    recovered = {}
+    unknown = [ip for ip in hottest if ip not in known]
+    if unknown:
+        rows = (
+            recent.filter(ip_address__in=unknown)
+            .exclude(country__in=UNRESOLVED)
+            .exclude(city__in=UNRESOLVED)
+            .order_by('ip_address', '-timestamp')
+            .values_list('ip_address', 'country', 'city')
+        )
+        for ip, country, city in rows.iterator(chunk_size=2000):
+            recovered.setdefault(ip, (country, city))
+        if recovered:
+            save_geolocations(recovered, source='request_log')
+
+    resolved = {**known, **recovered}
+    cache.set_many(
+        {cache_key(ip): {'country': c, 'city': t} for ip, (c, t) in resolved.items()},
+        CACHE_TTL,
+    )
+    logger.info(
+        f"Warmed geolocation cache with {len(resolved)} of {len(hottest)} hottest IPs "
+        f"({len(recovered)} recovered from request logs)"
+    )
+    return len(resolved)
+
+
+def backfill_request_logs(provider=None, batch_size=1000, max_batches=None, restart=False):
+    """
+    Resolve RequestLog rows stored without a location.
+
+    Rows are walked in id order, ``batch_size`` at a time, from the
+    ``geolocation_backfill`` watermark. Each batch resolves its distinct IPs
+    through the cache and IPGeolocation tiers, sends the rest to the provider
+    as one batch, and writes back with one UPDATE per distinct location for
+    every unresolved row of those IPs. Partial answers (a country without a
+    city, or 'Unknown') are stored like full ones so those IPs are not asked
+    again. The watermark moves after each batch, so a killed run resumes
+    where it stopped, but never past the first row whose public IP the
+    provider failed to answer (it errored or its circuit was open): the next
+    run retries from there. Returns a stats dict.
+    """
+    if provider is None:
+        from .geolocation_providers import get_provider
+        provider = get_provider()
+
+    watermark, _ = TaskWatermark.objects.get_or_create(name=BACKFILL_WATERMARK)
+    if restart:
+        watermark.position = 0
+        watermark.save(update_fields=['position', 'updated_at'])
+    unresolved = Q(country__in=BACKFILL_VALUES) | Q(city__in=BACKFILL_VALUES)
+    stats = {'batches': 0, 'ips': 0, 'looked_up': 0, 'resolved': 0, 'rows_updated': 0, 'unresolved': 0}
+    position = watermark.position
+    retry_from = None
+
+    while max_batches is None or stats['batches'] < max_batches:
+        start = position
+        rows = list(
+            RequestLog.objects.filter(unresolved, id__gt=start)
+            .order_by('id')
+            .values_list('id', 'ip_address')[:batch_size]
+        )
+        if not rows:
+            break
+
+        ips = {ip for _, ip in rows if ip_classifier.is_public(ip)}
+        locations = geolocation_store.get_many(ips)
+        missing = [ip for ip in ips if ip not in locations or not is_answered(*locations[ip])]
+        if missing:
+            looked_up = provider.lookup_many(missing)
+            stats['looked_up'] += len(missing)
+            found = {ip: loc for ip, loc in looked_up.items() if is_answered(*loc)}
+            if found:
+                save_geolocations(found, source='provider')
+                cache.set_many(
+                    {cache_key(ip): {'country': c, 'city': t} for ip, (c, t) in found.items()},
+                    CACHE_TTL,
+                )
+            locations.update(looked_up)
+
+        by_location = {}
+        for ip in ips:
+            location = locations.get(ip)
+            if location and is_answered(*location):
+                by_location.setdefault(location, []).append(ip)
+
+        for (country, city), group in by_location.items():
+            stats['rows_updated'] += (
+                RequestLog.objects.filter(unresolved, id__gt=start, ip_address__in=group)
+                .exclude(country=country, city=city)
+                .update(country=country, city=city)
+            )
+            stats['resolved'] += len(group)
+
+        failed = ips.difference(*by_location.values())
+        stats['unresolved'] += len(failed)
+        if failed and retry_from is None:
+            retry_from = next(row_id for row_id, ip in rows if ip in failed)
+        position = rows[-1][0]
+        watermark.position = position if retry_from is None else retry_from - 1
+        watermark.save(update_fields=['position', 'updated_at'])
+        stats['batches'] += 1
+        stats['ips'] += len(ips)
+
+    logger.info(
+        f"Geolocation backfill: {stats['rows_updated']} rows updated from {stats['resolved']} of "
+        f"{stats['ips']} IPs ({stats['looked_up']} provider lookups, {stats['batches']} batches, "
+        f"{stats['unresolved']} IPs left to retry)"
+    )
+    return stats
+
+
+geolocation_store = GeolocationStore(
+    max_age_days=getattr(settings, 'GEOLOCATION_DB_MAX_AGE_DAYS', 30),
+    write_interval=getattr(settings, 'GEOLOCATION_WRITE_INTERVAL', 5.0),
+)
+atexit.register(geolocation_store.flush)
@@ -0,0 +1,311 @@
+"""
+Geolocation providers.
+
+``GEOLOCATION_PROVIDER`` names the class used by the request middleware and
+the backfill task. Every provider answers single lookups and batches;
+batches run with at most ``GEOLOCATION_CONCURRENCY`` lookups in flight.
+
+HTTP providers keep one pooled keep-alive session per process, give every
+call ``GEOLOCATION_TIMEOUT`` seconds in total (batch calls
+``GEOLOCATION_BATCH_TIMEOUT``) and sit behind a circuit breaker, so an
+outage costs a few timed-out calls and then fails fast until a probe after
+the cooldown succeeds.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+COUNTRY_NAMES = {
+    'US': 'United States', 'GB': 'United Kingdom', 'CA': 'Canada',
+    'AU': 'Australia', 'DE': 'Germany', 'FR': 'France', 'JP': 'Japan',
+    'CN': 'China', 'IN': 'India', 'BR': 'Brazil', 'RU': 'Russia',
+    'NG': 'Nigeria', 'ZA': 'South Africa', 'EG': 'Egypt', 'KE': 'Kenya',
+}
+
+
+# What a lookup returns when the provider could not be asked (timeout,
+# outage, open circuit), as opposed to an answer that knows nothing
+LOOKUP_FAILED = ('Error', 'Error')
+
+
+def get_country_name(country_code):
+    """Convert a country code to its full name when we know it."""
+    return COUNTRY_NAMES.get(country_code, country_code)
+
+
+class CircuitBreaker:
+    """
+    Opens when at least ``error_rate`` of the last ``window`` calls failed
+    (after ``min_calls``), rejects calls for ``cooldown`` seconds, then lets
+    a single probe through: success closes it, failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, error_rate=0.5, min_calls=5, window=20, cooldown=30.0, clock=time.monotonic):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                logger.info("Geolocation provider recovered, closing circuit")
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if (
+                self.state == self.CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.error_rate
+            ):
+                self._open()
+
+    def _open(self):
+        logger.warning(f"Geolocation provider failing, opening circuit for {self.cooldown}s")
+        self.state = self.OPEN
+        self._opened_at = self.clock()
+        self._probing = False
+
+
+class GeolocationProvider:
+    def __init__(self, concurrency=4):
+        self.concurrency = max(1, concurrency)
+
+    def lookup(self, ip_address):
+        """
+        Return (country, city), with 'Unknown' for what the provider does not
+        know, or LOOKUP_FAILED when the provider could not answer.
+        """
+        raise NotImplementedError
+
+    def lookup_many(self, ip_addresses):
+        """Return {ip: (country, city)} for a batch of IPs."""
+        ip_addresses = list(ip_addresses)
+        if len(ip_addresses) <= 1 or self.concurrency == 1:
+            return {ip: self.lookup(ip) for ip in ip_addresses}
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(ip_addresses))) as pool:
+            return dict(zip(ip_addresses, pool.map(self.lookup, ip_addresses)))
+
+
+class HTTPProvider(GeolocationProvider):
+    """
+    Base for JSON-over-HTTP providers: one pooled ``requests.Session``, a
+    per-call latency budget and a circuit breaker around every call.
+    """
+    base_url = None
+
+    def __init__(self, concurrency=4, base_url=None, timeout=None, breaker=None):
+        super().__init__(concurrency)
+        if base_url is not None:
+            self.base_url = base_url.rstrip('/')
+        self.timeout = timeout if timeout is not None else getattr(settings, 'GEOLOCATION_TIMEOUT', 1.5)
+        self.breaker = breaker or CircuitBreaker(
+            error_rate=getattr(settings, 'GEOLOCATION_BREAKER_ERROR_RATE', 0.5),
+            min_calls=getattr(settings, 'GEOLOCATION_BREAKER_MIN_CALLS', 5),
+            cooldown=getattr(settings, 'GEOLOCATION_BREAKER_COOLDOWN', 30.0),
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Return the decoded JSON body, or None when the call failed or the
+        circuit is open. Timeouts, connection errors, 429 and 5xx count as
+        provider failures; other 4xx answers mean the provider is up.
+
+        ``timeout`` (``self.timeout`` by default) is the budget of the whole
+        call, not of each socket operation: a server that answers slowly or
+        trickles its body is dropped once the budget is spent.
+        """
+        timeout = timeout or self.timeout
+        if not self.breaker.allow():
+            logger.debug(f"Geolocation circuit open, skipping {url}")
+            return None
+        deadline = time.monotonic() + timeout
+        try:
+            response = self.session.request(method, url, timeout=timeout, stream=True, **kwargs)
+            body = read_before(response, deadline)
+        except requests.exceptions.Timeout:
+            logger.warning(f"Geolocation API timeout after {timeout}s: {url}")
+            self.breaker.record_failure()
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Geolocation API error for {url}: {e}")
+            self.breaker.record_failure()
+            return None
+
+        if response.status_code == 429 or response.status_code >= 500:
+            logger.warning(f"Geolocation API returned {response.status_code}: {url}")
+            self.breaker.record_failure()
+            return None
+        self.breaker.record_success()
+        if response.status_code >= 400:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            logger.warning(f"Geolocation API returned invalid JSON: {url}")
+            return None
+
+
+def read_before(response, deadline):
+    """
+    Read a streamed response's body, giving up with Timeout once
+    ``deadline`` (time.monotonic()) has passed. The connection goes back to
+    the pool when the body was read, and is closed when it was not.
+    """
+    body = bytearray()
+    try:
+        while True:
+            if time.monotonic() > deadline:
+                raise requests.exceptions.Timeout(f"Response not read within the deadline: {response.url}")
+            chunk = response.raw.read1(8192, decode_content=True)
+            if not chunk:
+                break
+            body += chunk
+    except urllib3.exceptions.ReadTimeoutError as e:
+        response.close()
+        raise requests.exceptions.Timeout(e)
+    except (urllib3.exceptions.HTTPError, OSError) as e:
+        response.close()
+        raise requests.exceptions.ConnectionError(e)
+    except requests.exceptions.Timeout:
+        response.close()
+        raise
+    response.raw.release_conn()
+    return bytes(body)
+
+
+class IPInfoProvider(HTTPProvider):
+    """ipinfo.io, using the batch endpoint when an API token is configured."""
+
+    base_url = 'https://ipinfo.io'
+
+    def __init__(self, concurrency=4, api_key=None, batch_timeout=None, **kwargs):
+        super().__init__(concurrency, **kwargs)
+        self.api_key = api_key if api_key is not None else os.environ.get('IPINFO_API_KEY')
+        self.batch_timeout = batch_timeout if batch_timeout is not None else getattr(
+            settings, 'GEOLOCATION_BATCH_TIMEOUT', self.timeout * 3
+        )
+
+    @staticmethod
+    def _location(data):
+        if data is None:
+            return LOOKUP_FAILED
+        if not isinstance(data, dict):
+            return 'Unknown', 'Unknown'
+        return get_country_name(data.get('country', 'Unknown')), data.get('city', 'Unknown')
+
+    def lookup(self, ip_address):
+        if self.api_key:
+            url = f"{self.base_url}/{ip_address}/json?token={self.api_key}"
+        else:
+            url = f"{self.base_url}/{ip_address}/json"
+
+        country, city = self._location(self.request('GET', url))
+        logger.info(f"Fetched geolocation for {ip_address}: {country}, {city}")
+        return country, city
+
+    def lookup_many(self, ip_addresses, batch_size=100):
+        if not self.api_key:
+            return super().lookup_many(ip_addresses)
+
+        ip_addresses = list(ip_addresses)
+        results = {}
+        for start in range(0, len(ip_addresses), batch_size):
+            batch = ip_addresses[start:start + batch_size]
+            data = self.request(
+                'POST',
+                f"{self.base_url}/batch?token={self.api_key}",
+                timeout=self.batch_timeout,
+                json=[f"{ip}/json" for ip in batch],
+            )
+            for ip in batch:
+                results[ip] = self._location(None if data is None else data.get(f"{ip}/json", {}))
+        return results
+
+
+class StubProvider(GeolocationProvider):
+    """
+    Offline provider for tests and local runs. Answers from ``locations``
+    ({ip: (country, city)}; map an IP to LOOKUP_FAILED to stand in for an
+    outage) and 'Unknown' for anything else, after
+    ``latency`` seconds to stand in for the network round trip.
+    """
+
+    def __init__(self, concurrency=4, locations=None, latency=None):
+        super().__init__(concurrency)
+        self.locations = locations if locations is not None else getattr(
+            settings, 'GEOLOCATION_STUB_LOCATIONS', {}
+        )
+        self.latency = latency if latency is not None else getattr(settings, 'GEOLOCATION_STUB_LATENCY', 0)
+        self.calls = []
+
+    def lookup(self, ip_address):
+        self.calls.append(ip_address)
+        if self.latency:
+            time.sleep(self.latency)
+        return tuple(self.locations.get(ip_address, ('Unknown', 'Unknown')))
+
+
+_provider = None
+
+
+def get_provider():
+    """The configured provider, created once per process."""
+    global _provider
+    if _provider is None:
+        provider_class = import_string(
+            getattr(settings, 'GEOLOCATION_PROVIDER', 'core.geolocation_providers.IPInfoProvider')
+        )
+        _provider = provider_class(concurrency=getattr(settings, 'GEOLOCATION_CONCURRENCY', 4))
+    return _provider
+
+
+def set_provider(provider):
+    """Replace the process-wide provider (e.g. with a StubProvider); returns the previous one."""
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
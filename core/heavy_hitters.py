@@ -0,0 +1,341 @@
+"""
+Real-time heavy hitters: the top client IPs, routes and (IP, route) pairs.
+
+Every request updates, per dimension, a Space-Saving summary of the
+``capacity`` most frequent keys and a Count-Min sketch of all keys, both
+fixed size and O(1) per update. Counts are kept per time window of
+``HEAVY_HITTERS_WINDOW_SECONDS``; every ``HEAVY_HITTERS_FLUSH_INTERVAL``
+seconds a worker writes its sketches for the current window to the cache
+under a slot it claimed with an atomic ``incr``. ``report`` merges the slots
+of the last ``HEAVY_HITTERS_WINDOWS`` windows from every worker.
+
+Each reported key carries bounds on its true count: at least
+``min_count`` and at most ``count``. ``count`` is the smaller of the
+Space-Saving overestimate and the Count-Min estimate; the latter is within
+``count_min_error`` of the truth with probability ``count_min_confidence``.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from array import array
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .dimensions import normalize_path
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ['ip', 'path', 'ip_path']
+CACHE_PREFIX = 'heavy_hitters'
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary (Metwally et al.) with its stream-summary buckets,
+    so an update is O(1) however many keys are monitored.
+
+    A monitored key's true count lies in [count - error, count]; a key that
+    is not monitored occurred at most ``floor`` times.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._buckets = {}
+        self._min_count = 0
+        self._floor = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def floor(self):
+        return max(self._floor, self._min_count if len(self.counts) >= self.capacity else 0)
+
+    def add(self, key):
+        count = self.counts.get(key)
+        if count is not None:
+            bucket = self._buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[count]
+                if count == self._min_count:
+                    self._min_count = count + 1
+        elif len(self.counts) < self.capacity:
+            count = 0
+            self.errors[key] = 0
+            self._min_count = 1
+        else:
+            # Replace a key with the smallest count; the newcomer may have
+            # occurred up to that many times unseen
+            count = self._min_count
+            bucket = self._buckets[count]
+            victim, _ = bucket.popitem()
+            if not bucket:
+                del self._buckets[count]
+                self._min_count = count + 1
+            del self.counts[victim]
+            del self.errors[victim]
+            self.errors[key] = count
+        self.counts[key] = count + 1
+        self._buckets.setdefault(count + 1, {})[key] = None
+
+    def top(self, limit):
+        """[(key, count, error)] by descending count."""
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])[:limit]
+        return [(key, count, self.errors[key]) for key, count in ranked]
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'floor': self.floor,
+            'items': [[key, count, self.errors[key]] for key, count in self.counts.items()],
+        }
+
+    @classmethod
+    def merge(cls, summaries, capacity):
+        """
+        Combine summaries of disjoint streams (dicts from ``to_dict``). A key
+        missing from a summary is counted with that summary's floor, both in
+        its count and its error, so the bounds stay valid.
+        """
+        summaries = list(summaries)
+        keys = set()
+        for summary in summaries:
+            keys.update(key for key, _, _ in summary['items'])
+        counts = dict.fromkeys(keys, 0)
+        errors = dict.fromkeys(keys, 0)
+        for summary in summaries:
+            monitored = {key: (count, error) for key, count, error in summary['items']}
+            for key in keys:
+                count, error = monitored.get(key, (summary['floor'], summary['floor']))
+                counts[key] += count
+                errors[key] += error
+
+        merged = cls(capacity)
+        ranked = sorted(counts, key=lambda key: -counts[key])
+        dropped = ranked[capacity:]
+        merged._floor = max(
+            sum(summary['floor'] for summary in summaries),
+            max((counts[key] for key in dropped), default=0),
+        )
+        for key in ranked[:capacity]:
+            merged.counts[key] = counts[key]
+            merged.errors[key] = errors[key]
+            merged._buckets.setdefault(counts[key], {})[key] = None
+        merged._min_count = min(merged.counts.values(), default=0)
+        return merged
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch (Cormode & Muthukrishnan) with a process-independent
+    hash. Rows are plain int64 arrays: cheaper than NumPy for the handful of
+    counters one update touches, and cheap to sum as NumPy when merging.
+    """
+
+    def __init__(self, width=2048, depth=4, data=None):
+        self.width = width
+        self.depth = depth
+        if data is None:
+            data = bytes(8 * width * depth)
+        self.rows = [array('q', data[8 * width * row:8 * width * (row + 1)]) for row in range(depth)]
+
+    def _columns(self, key):
+        value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=16).digest(), 'big')
+        first, second = value >> 64, (value & 0xFFFFFFFFFFFFFFFF) | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        for row, column in zip(self.rows, self._columns(key)):
+            row[column] += count
+
+    def estimate(self, key):
+        return min(row[column] for row, column in zip(self.rows, self._columns(key)))
+
+    def error_bound(self, total):
+        """Additive overestimate bound e/width * total, holding with probability 1 - e^-depth."""
+        return math.ceil(math.e / self.width * total)
+
+    @property
+    def confidence(self):
+        return 1 - math.exp(-self.depth)
+
+    def to_bytes(self):
+        return b''.join(row.tobytes() for row in self.rows)
+
+    @classmethod
+    def merge(cls, blobs, width, depth):
+        """Sketch of the combined streams of serialized same-shape sketches."""
+        total = np.zeros(width * depth, dtype=np.int64)
+        for blob in blobs:
+            total += np.frombuffer(blob, dtype=np.int64)
+        return cls(width, depth, total.tobytes())
+
+
+class HeavyHitterTracker:
+    """Per-worker sketches of the current window, flushed to the cache on an interval."""
+
+    def __init__(
+        self,
+        capacity=200,
+        width=2048,
+        depth=4,
+        window_seconds=60,
+        windows=5,
+        flush_interval=10.0,
+        max_slots=256,
+        clock=time.time,
+    ):
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self.window_seconds = window_seconds
+        self.windows = windows
+        self.flush_interval = flush_interval
+        self.max_slots = max_slots
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._finished = None
+        self._start_window(self._window_of(clock()))
+
+    def _window_of(self, now):
+        return int(now // self.window_seconds)
+
+    def _start_window(self, window):
+        self._window = window
+        self._slot = None
+        self._total = 0
+        self._summaries = {dimension: SpaceSaving(self.capacity) for dimension in DIMENSIONS}
+        self._sketches = {dimension: CountMinSketch(self.width, self.depth) for dimension in DIMENSIONS}
+        self._last_flush = self.clock()
+
+    def record(self, ip_address, path):
+        route = normalize_path(path)
+        keys = {'ip': ip_address, 'path': route, 'ip_path': f"{ip_address} {route}"}
+        now = self.clock()
+        with self._lock:
+            if self._window_of(now) != self._window:
+                self._finished = self._snapshot()
+                self._start_window(self._window_of(now))
+            self._total += 1
+            for dimension, key in keys.items():
+                self._summaries[dimension].add(key)
+                self._sketches[dimension].add(key)
+            due = self._finished is not None or now - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def _snapshot(self):
+        """Serializable copy of the current window; call with the lock held."""
+        if not self._total:
+            return None
+        return {
+            'window': self._window,
+            'slot': self._slot,
+            'total': self._total,
+            'summaries': {dimension: summary.to_dict() for dimension, summary in self._summaries.items()},
+            'sketches': {dimension: sketch.to_bytes() for dimension, sketch in self._sketches.items()},
+        }
+
+    def flush(self):
+        # One flush at a time, so a worker never claims two slots for a window
+        with self._flush_lock:
+            with self._lock:
+                snapshots = [self._finished, self._snapshot()]
+                self._finished = None
+                self._last_flush = self.clock()
+            for snapshot in snapshots:
+                if snapshot is None:
+                    continue
+                slot = self._write(snapshot)
+                with self._lock:
+                    if self._window == snapshot['window']:
+                        self._slot = slot
+                    elif self._finished and self._finished['window'] == snapshot['window']:
+                        self._finished['slot'] = slot
+
+    def _write(self, snapshot):
+        """Store ``snapshot`` in its worker slot, claiming one first. Returns the slot."""
+        window, slot = snapshot['window'], snapshot['slot']
+        timeout = self.window_seconds * (self.windows + 1)
+        try:
+            if slot is None:
+                counter = self._key(window, 'slots')
+                cache.add(counter, 0, timeout)
+                slot = cache.incr(counter) - 1
+            if slot >= self.max_slots:
+                logger.error(f"Heavy hitter window {window} ran out of worker slots")
+                return slot
+            cache.set(self._key(window, slot), {
+                'total': snapshot['total'],
+                'summaries': snapshot['summaries'],
+                'sketches': snapshot['sketches'],
+            }, timeout)
+        except Exception as e:
+            logger.error(f"Failed to flush heavy hitter sketches: {e}")
+        return slot
+
+    @staticmethod
+    def _key(window, slot):
+        return f"{CACHE_PREFIX}:{window}:{slot}"
+
+    def report(self, limit=20, windows=None):
+        """Heavy hitters of the last ``windows`` windows, merged across every worker."""
+        windows = windows or self.windows
+        current = self._window_of(self.clock())
+        recent = range(current - windows + 1, current + 1)
+        slot_counts = cache.get_many([self._key(window, 'slots') for window in recent])
+        keys = [
+            self._key(window, slot)
+            for window in recent
+            for slot in range(min(slot_counts.get(self._key(window, 'slots'), 0), self.max_slots))
+        ]
+        payloads = list(cache.get_many(keys).values())
+
+        total = sum(payload['total'] for payload in payloads)
+        report = {
+            'window_seconds': self.window_seconds,
+            'windows': windows,
+            'since': (current - windows + 1) * self.window_seconds,
+            'total_requests': total,
+            'workers_flushed': len(payloads),
+            'dimensions': {},
+        }
+        for dimension in DIMENSIONS:
+            summary = SpaceSaving.merge(
+                (payload['summaries'][dimension] for payload in payloads), self.capacity
+            )
+            sketch = CountMinSketch.merge(
+                (payload['sketches'][dimension] for payload in payloads), self.width, self.depth
+            )
+            report['dimensions'][dimension] = {
+                'space_saving_floor': summary.floor,
+                'count_min_error': sketch.error_bound(total),
+                'count_min_confidence': round(sketch.confidence, 4),
+                'top': [
+                    {
+                        'key': key,
+                        'count': min(count, sketch.estimate(key)),
+                        'min_count': count - error,
+                    }
+                    for key, count, error in summary.top(limit)
+                ],
+            }
+        return report
+
+
+heavy_hitters = HeavyHitterTracker(
+    capacity=getattr(settings, 'HEAVY_HITTERS_CAPACITY', 200),
+    width=getattr(settings, 'HEAVY_HITTERS_SKETCH_WIDTH', 2048),
+    depth=getattr(settings, 'HEAVY_HITTERS_SKETCH_DEPTH', 4),
+    window_seconds=getattr(settings, 'HEAVY_HITTERS_WINDOW_SECONDS', 60),
+    windows=getattr(settings, 'HEAVY_HITTERS_WINDOWS', 5),
+    flush_interval=getattr(settings, 'HEAVY_HITTERS_FLUSH_INTERVAL', 10.0),
+)
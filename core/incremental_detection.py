@@ -0,0 +1,228 @@
+"""
+Incremental suspicious IP detection over the sliding one-hour window.
+
+The per-IP aggregates of the sharded engine (requests, sensitive-path
+requests and the sensitive paths themselves, here with a count each) are
+kept in IPWindowAggregate. The ``detection_window`` TaskWatermark records
+the window they cover and the last RequestLog id folded in. A run over
+[start, end) then only reads:
+
+* new rows: id past the watermark, timestamp inside the window
+* old rows timestamped inside the new window but outside the previous one
+  (e.g. written ahead of the clock by bulk loads), which are added
+* old rows timestamped inside the previous window but outside the new one,
+  whose contributions are subtracted
+
+so its cost follows the traffic since the last run, not the window size.
+The stored aggregates then equal a full recompute of the window over the
+rows up to the new watermark. Scheduled runs end their window on a
+``DETECTION_INTERVAL_MINUTES`` boundary (``tasks.detection_window_end``),
+so consecutive windows slide by whole intervals whatever the beat's jitter.
+
+Ids are allocated at insert but become visible at commit, so a row past the
+watermark may still be in flight while a later one is visible. The watermark
+therefore only advances to the last row timestamped more than
+``DETECTION_COMMIT_GRACE_SECONDS`` ago: every row up to it has committed, and
+newer ones are folded by a later run. Should a row still slip through, the
+subtraction would take a count below zero; the run then rebuilds the window
+instead of storing it.
+
+Rules are re-evaluated for the IPs whose aggregates changed; findings of
+the others are the same as last run. Network rules read every stored
+aggregate (one row per IP, not per request). As the stored aggregates
+equal a rebuilt window's, so do the IPs flagged. The window state is
+replaced with a full recompute when it does not overlap the new window or
+``rebuild`` is set.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .db_routers import detection_database, logs_database
+from .models import IPWindowAggregate, RequestLog, TaskWatermark
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = 'detection_window'
+BATCH_SIZE = 500
+
+
+class WindowDrift(Exception):
+    """The stored aggregates no longer match the rows: a count would go negative."""
+
+
+def aggregate_rows(queryset):
+    """{ip: {'requests', 'sensitive_requests', 'sensitive_paths': Counter}} of the rows in ``queryset``."""
+    from .tasks import sensitive_path_query
+
+    queryset = queryset.order_by()
+    sensitive = sensitive_path_query()
+    aggregates = {}
+    counts = queryset.values('ip_address').annotate(
+        requests=Count('id'),
+        sensitive_requests=Count('id', filter=sensitive),
+    )
+    for row in counts.iterator():
+        aggregates[row['ip_address']] = {
+            'requests': row['requests'],
+            'sensitive_requests': row['sensitive_requests'],
+            'sensitive_paths': Counter(),
+        }
+    paths = queryset.filter(sensitive).values('ip_address', 'path').annotate(count=Count('id'))
+    for row in paths.iterator():
+        aggregates[row['ip_address']]['sensitive_paths'][row['path']] += row['count']
+    return aggregates
+
+
+def combine(delta, aggregates, sign):
+    for ip_address, data in aggregates.items():
+        entry = delta.setdefault(ip_address, {'requests': 0, 'sensitive_requests': 0, 'sensitive_paths': Counter()})
+        entry['requests'] += sign * data['requests']
+        entry['sensitive_requests'] += sign * data['sensitive_requests']
+        for path, count in data['sensitive_paths'].items():
+            entry['sensitive_paths'][path] += sign * count
+
+
+def apply_delta(delta):
+    """Add ``delta`` to the stored aggregates; returns the new ones of the IPs it touched."""
+    changed = {}
+    ips = list(delta)
+    for offset in range(0, len(ips), BATCH_SIZE):
+        batch = ips[offset:offset + BATCH_SIZE]
+        stored = {row.ip_address: row for row in IPWindowAggregate.objects.filter(ip_address__in=batch)}
+        rows, emptied = [], []
+        for ip_address in batch:
+            change = delta[ip_address]
+            row = stored.get(ip_address) or IPWindowAggregate(ip_address=ip_address)
+            paths = Counter(row.sensitive_paths)
+            paths.update(change['sensitive_paths'])
+            requests = row.requests + change['requests']
+            sensitive_requests = row.sensitive_requests + change['sensitive_requests']
+            if not 0 <= sensitive_requests <= max(requests, 0) or min(paths.values(), default=0) < 0:
+                raise WindowDrift(ip_address)
+            if requests == 0:
+                emptied.append(ip_address)
+                continue
+            row.requests = requests
+            row.sensitive_requests = sensitive_requests
+            row.sensitive_paths = {path: count for path, count in sorted(paths.items()) if count > 0}
+            rows.append(row)
+            changed[ip_address] = {
+                'requests': row.requests,
+                'sensitive_requests': row.sensitive_requests,
+                'sensitive_paths': set(row.sensitive_paths),
+            }
+        if emptied:
+            IPWindowAggregate.objects.filter(ip_address__in=emptied).delete()
+        IPWindowAggregate.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['ip_address'],
+            update_fields=['requests', 'sensitive_requests', 'sensitive_paths'],
+        )
+    return changed
+
+
+def stored_aggregates():
+    """Every stored aggregate, as the {ip: aggregates} dicts of ``merge_partials``."""
+    return {
+        ip_address: {'requests': requests, 'sensitive_requests': sensitive_requests}
+        for ip_address, requests, sensitive_requests in IPWindowAggregate.objects.values_list(
+            'ip_address', 'requests', 'sensitive_requests'
+        ).iterator()
+    }
+
+
+def interval_difference(start, end, other_start, other_end):
+    """The parts of [start, end) outside [other_start, other_end), as (start, end) pairs."""
+    parts = [(start, min(end, other_start)), (max(start, other_end), end)]
+    return [(part_start, part_end) for part_start, part_end in parts if part_start < part_end]
+
+
+def settled_id(logs, after):
+    """The last RequestLog id past ``after`` whose row, and every row before it, has committed."""
+    grace = timedelta(seconds=getattr(settings, 'DETECTION_COMMIT_GRACE_SECONDS', 30))
+    settled = logs.filter(id__gt=after, timestamp__lt=timezone.now() - grace).aggregate(last=Max('id'))
+    return settled['last'] or after
+
+
+def advance_window(window_end=None, window=timedelta(hours=1), rebuild=False):
+    """
+    Bring the stored aggregates to [window_end - window, window_end).
+    Returns (aggregates of the IPs that changed, stats).
+    """
+    window_end = window_end or timezone.now()
+    window_start = window_end - window
+    logs = RequestLog.objects.using(detection_database())
+    in_window = {'timestamp__gte': window_start, 'timestamp__lt': window_end}
+
+    with transaction.atomic(using=logs_database()):
+        watermark, _ = TaskWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        previous_start, previous_end, previous_id = watermark.window_start, watermark.window_end, watermark.position
+        # A table emptied since the last run starts over from its first row
+        if (logs.aggregate(last=Max('id'))['last'] or 0) < previous_id:
+            previous_id, rebuild = 0, True
+        last_id = settled_id(logs, previous_id)
+
+        rebuild = (
+            rebuild
+            or previous_end is None
+            or not (window_start < previous_end and previous_start < window_end)
+        )
+        changed = None
+        if not rebuild:
+            delta = {}
+            combine(delta, aggregate_rows(logs.filter(id__gt=previous_id, id__lte=last_id, **in_window)), 1)
+            for start, end in interval_difference(window_start, window_end, previous_start, previous_end):
+                combine(delta, aggregate_rows(logs.filter(
+                    id__lte=previous_id, timestamp__gte=start, timestamp__lt=end,
+                )), 1)
+            for start, end in interval_difference(previous_start, previous_end, window_start, window_end):
+                combine(delta, aggregate_rows(logs.filter(
+                    id__lte=previous_id, timestamp__gte=start, timestamp__lt=end,
+                )), -1)
+            try:
+                with transaction.atomic(using=logs_database()):
+                    changed = apply_delta(delta)
+            except WindowDrift as e:
+                logger.warning(f"Detection window drifted at {e}; rebuilding it")
+                rebuild = True
+        if rebuild:
+            IPWindowAggregate.objects.all().delete()
+            delta = {}
+            combine(delta, aggregate_rows(logs.filter(id__lte=last_id, **in_window)), 1)
+            changed = apply_delta(delta)
+
+        watermark.position = last_id
+        watermark.window_start = window_start
+        watermark.window_end = window_end
+        watermark.save(update_fields=['position', 'window_start', 'window_end', 'updated_at'])
+
+    return changed, {'rebuilt': rebuild, 'ips_changed': len(changed), 'last_id': last_id}
+
+
+def reset_window():
+    """Drop the stored aggregates so the next run recomputes them, e.g. after deleting RequestLog rows."""
+    with transaction.atomic(using=logs_database()):
+        TaskWatermark.objects.filter(name=WATERMARK).update(window_start=None, window_end=None)
+        IPWindowAggregate.objects.all().delete()
+
+
+def run_incremental_detection(window_end=None, window=timedelta(hours=1), rebuild=False):
+    """Advance the window, then flag IPs and networks. Returns the number of IPs flagged."""
+    from .tasks import (
+        evaluate_aggregates, evaluate_network_aggregates, flag_suspicious_ips, flag_suspicious_networks,
+    )
+
+    changed, stats = advance_window(window_end, window, rebuild)
+    logger.info(
+        f"Incremental detection: {stats['ips_changed']} IPs changed"
+        f"{' (window rebuilt)' if stats['rebuilt'] else ''}"
+    )
+    flag_suspicious_networks(evaluate_network_aggregates(stored_aggregates()))
+    return flag_suspicious_ips(evaluate_aggregates(changed))
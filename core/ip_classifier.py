@@ -0,0 +1,144 @@
+"""
+Shared IP address classifier.
+
+An address is parsed once into an integer and looked up with a binary search
+in a sorted, non-overlapping range table per IP version, compiled at import
+from the IANA special-purpose registries. Everything the table does not
+mark is ``public``. IPv4-mapped IPv6 addresses (::ffff:a.b.c.d) are
+classified by their IPv4 address. Results are memoized in a bounded LRU.
+"""
+import functools
+import ipaddress
+import socket
+from bisect import bisect_right
+
+from django.conf import settings
+
+PUBLIC = 'public'
+LOOPBACK = 'loopback'
+PRIVATE = 'private'
+LINK_LOCAL = 'link_local'
+CGNAT = 'cgnat'
+MULTICAST = 'multicast'
+DOCUMENTATION = 'documentation'
+BENCHMARK = 'benchmark'
+RESERVED = 'reserved'
+UNSPECIFIED = 'unspecified'
+INVALID = 'invalid'
+_IPV4_MAPPED = 'ipv4_mapped'
+
+IPV4_RANGES = [
+    ('0.0.0.0/8', RESERVED),
+    ('0.0.0.0/32', UNSPECIFIED),
+    ('10.0.0.0/8', PRIVATE),
+    ('100.64.0.0/10', CGNAT),
+    ('127.0.0.0/8', LOOPBACK),
+    ('169.254.0.0/16', LINK_LOCAL),
+    ('172.16.0.0/12', PRIVATE),
+    ('192.0.0.0/24', RESERVED),
+    ('192.0.2.0/24', DOCUMENTATION),
+    ('192.88.99.0/24', RESERVED),
+    ('192.168.0.0/16', PRIVATE),
+    ('198.18.0.0/15', BENCHMARK),
+    ('198.51.100.0/24', DOCUMENTATION),
+    ('203.0.113.0/24', DOCUMENTATION),
+    ('224.0.0.0/4', MULTICAST),
+    ('240.0.0.0/4', RESERVED),
+]
+
+IPV6_RANGES = [
+    # Only 2000::/3 is allocated as global unicast
+    ('::/0', RESERVED),
+    ('2000::/3', PUBLIC),
+    ('::/128', UNSPECIFIED),
+    ('::1/128', LOOPBACK),
+    ('::ffff:0:0/96', _IPV4_MAPPED),
+    ('64:ff9b::/96', PUBLIC),  # NAT64 well-known prefix: IPv4 hosts behind a translator
+    ('100::/64', RESERVED),
+    ('2001::/23', RESERVED),
+    ('2001::/32', PUBLIC),  # Teredo
+    ('2001:db8::/32', DOCUMENTATION),
+    ('2001:2::/48', BENCHMARK),
+    ('3fff::/20', DOCUMENTATION),
+    ('fc00::/7', PRIVATE),  # unique local
+    ('fe80::/10', LINK_LOCAL),
+    ('fec0::/10', PRIVATE),  # deprecated site-local
+    ('ff00::/8', MULTICAST),
+]
+
+
+def compile_ranges(ranges, bits):
+    """
+    Flatten possibly nested networks into (starts, categories) covering the
+    whole address space; the most specific network wins.
+    """
+    table = [(0, (1 << bits) - 1, PUBLIC)]
+    networks = sorted(
+        ((ipaddress.ip_network(cidr), category) for cidr, category in ranges),
+        key=lambda item: item[0].prefixlen,
+    )
+    for network, category in networks:
+        start, end = int(network.network_address), int(network.broadcast_address)
+        painted = []
+        for low, high, existing in table:
+            if high < start or low > end:
+                painted.append((low, high, existing))
+                continue
+            if low < start:
+                painted.append((low, start - 1, existing))
+            if low <= start:
+                painted.append((start, end, category))
+            if high > end:
+                painted.append((end + 1, high, existing))
+        table = painted
+
+    merged = []
+    for low, high, category in table:
+        if merged and merged[-1][2] == category:
+            merged[-1] = (merged[-1][0], high, category)
+        else:
+            merged.append((low, high, category))
+    return [low for low, _, _ in merged], [category for _, _, category in merged]
+
+
+def parse(ip_address):
+    """(version, integer) for a textual address, or None when it is not one."""
+    if not ip_address:
+        return None
+    try:
+        if ':' in ip_address:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_address.split('%', 1)[0]), 'big')
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big')
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+class IPClassifier:
+    def __init__(self, max_cache=65536):
+        self._tables = {
+            4: compile_ranges(IPV4_RANGES, 32),
+            6: compile_ranges(IPV6_RANGES, 128),
+        }
+        self.classify = functools.lru_cache(maxsize=max_cache)(self._classify)
+
+    def classify_int(self, version, value):
+        starts, categories = self._tables[version]
+        category = categories[bisect_right(starts, value) - 1]
+        if category == _IPV4_MAPPED:
+            return self.classify_int(4, value & 0xFFFFFFFF)
+        return category
+
+    def _classify(self, ip_address):
+        parsed = parse(ip_address)
+        if parsed is None:
+            return INVALID
+        return self.classify_int(*parsed)
+
+    def is_public(self, ip_address):
+        return self.classify(ip_address) == PUBLIC
+
+    def is_loopback(self, ip_address):
+        return self.classify(ip_address) == LOOPBACK
+
+
+ip_classifier = IPClassifier(max_cache=getattr(settings, 'IP_CLASSIFIER_CACHE_SIZE', 65536))
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedIPIndex:
+    """
+    In-process snapshot of an IP table (blocked IPs, suspicious IPs, ...).
+
+    The snapshot is rebuilt by ``loader`` only when the shared version key in the
+    cache changes. The version key itself is read at most once per
+    ``refresh_interval`` seconds, so lookups on the hot path never touch the DB
+    and only rarely touch the cache.
+    """
+
+    def __init__(self, name, loader, refresh_interval=5, max_age=300):
+        self.name = name
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.version_key = f"ip_index_version_{name}"
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def needs_refresh(self):
+        """True when the next ``get()`` may hit the cache or the DB."""
+        return (
+            self._data is None
+            or time.monotonic() - self._checked_at >= self.refresh_interval
+        )
+
+    def get(self):
+        """Return the current snapshot, reloading it if it is stale."""
+        now = time.monotonic()
+        if self._data is not None and now - self._checked_at < self.refresh_interval:
+            return self._data
+
+        with self._lock:
+            if self._data is not None and now - self._checked_at < self.refresh_interval:
+                return self._data
+            self._checked_at = now
+            try:
+                version = cache.get(self.version_key)
+            except Exception as e:
+                logger.error(f"Failed to read {self.version_key}: {e}")
+                version = self._version
+
+            expired = now - self._loaded_at >= self.max_age
+            if self._data is None or version != self._version or expired:
+                self._reload(version, now)
+            return self._data
+
+    def _reload(self, version, now):
+        try:
+            self._data = self.loader()
+            self._version = version
+            self._loaded_at = now
+            logger.info(f"Loaded {self.name} index with {len(self._data)} entries")
+        except Exception as e:
+            logger.error(f"Failed to load {self.name} index: {e}")
+            if self._data is None:
+                self._data = {}
+
+    def __contains__(self, ip_address):
+        return ip_address in self.get()
+
+    def invalidate(self):
+        """Drop the local snapshot and bump the shared version so other workers reload."""
+        with self._lock:
+            self._data = None
+            self._checked_at = 0.0
+        try:
+            cache.set(self.version_key, time.time_ns(), None)
+        except Exception as e:
+            logger.error(f"Failed to bump {self.version_key}: {e}")
+
+
+def _load_blocked_ips():
+    from core.expiry import unexpired
+    from core.models import BlockedIP
+
+    return frozenset(
+        BlockedIP.objects.filter(unexpired(), is_active=True)
+        .order_by()
+        .values_list("ip_address", flat=True)
+    )
+
+
+blocked_ips = CachedIPIndex(
+    "blocked_ips",
+    _load_blocked_ips,
+    refresh_interval=getattr(settings, "IP_INDEX_REFRESH_INTERVAL", 5),
+)
+
+
+def _load_suspicious_ips():
+    from core.expiry import unexpired
+    from core.models import SuspiciousIP
+
+    return dict(
+        SuspiciousIP.objects.filter(unexpired(), is_active=True)
+        .order_by()
+        .values_list("ip_address", "reason")
+    )
+
+
+suspicious_ips = CachedIPIndex(
+    "suspicious_ips",
+    _load_suspicious_ips,
+    refresh_interval=getattr(settings, "IP_INDEX_REFRESH_INTERVAL", 5),
+)
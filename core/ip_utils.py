@@ -0,0 +1,20 @@
+def get_client_ip(meta):
+    """
+    Get the client's IP address from a request META dict or a raw WSGI environ.
+    Uses the first X-Forwarded-For entry when present, like RequestLoggingMiddleware.
+    """
+    x_forwarded_for = meta.get("HTTP_X_FORWARDED_FOR")
+    if x_forwarded_for:
+        return x_forwarded_for.split(",")[0].strip()
+    return meta.get("REMOTE_ADDR")
+
+
+def get_client_ip_from_scope(scope):
+    """
+    Get the client's IP address from an ASGI scope before Django builds a request.
+    """
+    for name, value in scope.get("headers", ()):
+        if name == b"x-forwarded-for":
+            return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else None
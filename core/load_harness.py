@@ -0,0 +1,678 @@
+"""
+Traffic replay load harness.
+
+Requests come from recorded traffic (``result.txt`` access logs, CSV/NDJSON
+RequestLog exports) or generated attack profiles, and are sent with
+``concurrency`` workers to one of:
+
+* ``WSGITarget``: the project's WSGI application, in process
+* ``ASGITarget``: the project's ASGI application, in process
+* ``HTTPTarget``: a running server; the client IP goes in X-Forwarded-For
+
+Requests are sent as fast as possible, or paced at ``speed`` times their
+recorded rate. Meanwhile a watcher thread runs detection every
+``detect_interval`` seconds and notes when each client first shows up in
+SuspiciousIP or inside a SuspiciousNetwork. The report has p50/p95/p99
+latency, throughput, status codes, database queries per request (in
+process targets only; detection's own queries are excluded) and, per
+attacker, the time from its first request to being flagged.
+"""
+import asyncio
+import csv
+import gzip
+import ipaddress
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .log_analysis import TIMESTAMP_FORMAT, parse_line
+
+logger = logging.getLogger(__name__)
+
+LOGIN_BODY = urlencode({'username': 'replay', 'password': 'not-the-password'}).encode()
+STUB_COUNTRIES = [
+    ('DE', 'Berlin'), ('US', 'Ashburn'), ('BR', 'Sao Paulo'),
+    ('JP', 'Tokyo'), ('NL', 'Amsterdam'), ('IN', 'Mumbai'),
+]
+
+
+class ReplayRequest:
+    __slots__ = ('offset', 'ip_address', 'method', 'path', 'user_agent', 'attacker')
+
+    def __init__(self, offset, ip_address, method='GET', path='/', user_agent='', attacker=False):
+        self.offset = offset
+        self.ip_address = ip_address
+        self.method = method
+        self.path = path
+        self.user_agent = user_agent
+        self.attacker = attacker
+
+    def body(self):
+        return LOGIN_BODY if self.method == 'POST' else b''
+
+
+def _with_offsets(records):
+    """Turn (datetime, ReplayRequest args) pairs into requests timed from the first one."""
+    requests = []
+    first = None
+    for timestamp, args in records:
+        if first is None:
+            first = timestamp
+        requests.append(ReplayRequest((timestamp - first).total_seconds(), *args))
+    return requests
+
+
+def read_access_log(path):
+    """Requests from an access log written by RequestLoggingMiddleware (.gz allowed)."""
+    opener = gzip.open if path.endswith('.gz') else open
+    records = []
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            record = parse_line(line)
+            if record is None:
+                continue
+            try:
+                timestamp = datetime.strptime(record[0], TIMESTAMP_FORMAT)
+            except ValueError:
+                continue
+            records.append((timestamp, (record[1], record[5] or 'GET', record[4], record[6])))
+    return _with_offsets(records)
+
+
+def read_export(path):
+    """Requests from a CSV or NDJSON file written by export_request_logs."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.ndjson', '.jsonl', '.json')):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    records = []
+    for row in rows:
+        timestamp = parse_datetime(row['timestamp'])
+        if timestamp is None:
+            continue
+        records.append((timestamp, (
+            row['ip_address'], row.get('method') or 'GET', row['path'], row.get('user_agent') or '',
+        )))
+    records.sort(key=lambda record: record[0])
+    return _with_offsets(records)
+
+
+def _random_ip(rng, network):
+    network = ipaddress.ip_network(network)
+    return str(network.network_address + rng.randrange(1, network.num_addresses - 1))
+
+
+def _baseline(rng, duration, rate):
+    clients = [_random_ip(rng, '81.0.0.0/8') for _ in range(max(1, int(rate * 20)))]
+    pages = ['/', '/public/', '/api/', '/test-logging/', '/rate-limit-status/']
+    return [
+        ReplayRequest(rng.uniform(0, duration), rng.choice(clients), 'GET', rng.choice(pages), 'Mozilla/5.0')
+        for _ in range(int(duration * rate))
+    ]
+
+
+def _flood(rng, duration, rate):
+    ip_address = _random_ip(rng, '45.0.0.0/8')
+    return [
+        ReplayRequest(duration * i / (rate * 20), ip_address, 'GET', '/api/', 'python-requests/2.31', True)
+        for i in range(int(duration * rate * 20))
+    ]
+
+
+def _scanner(rng, duration, rate):
+    from .tasks import SENSITIVE_PATHS
+
+    paths = list(SENSITIVE_PATHS) + [f'/backup-{i}.zip' for i in range(50)] + ['/.git/config', '/wp-login.php']
+    requests = []
+    for _ in range(3):
+        ip_address = _random_ip(rng, '185.0.0.0/8')
+        start = rng.uniform(0, duration / 2)
+        for i, path in enumerate(paths):
+            requests.append(ReplayRequest(start + i * 0.05, ip_address, 'GET', path, 'zgrab/0.x', True))
+    return requests
+
+
+def _credential_stuffing(rng, duration, rate):
+    requests = []
+    for _ in range(50):
+        ip_address = _random_ip(rng, '103.0.0.0/8')
+        for _ in range(4):
+            requests.append(ReplayRequest(rng.uniform(0, duration), ip_address, 'POST', '/login/', 'curl/8.0', True))
+    return requests
+
+
+def _botnet(rng, duration, rate):
+    network = ipaddress.ip_network(f'{_random_ip(rng, "91.0.0.0/8")}/24', strict=False)
+    hosts = [str(network.network_address + host) for host in rng.sample(range(1, 255), 40)]
+    return [
+        ReplayRequest(rng.uniform(0, duration), rng.choice(hosts), 'GET', rng.choice(['/api/', '/public/']),
+                      'Mozilla/5.0', True)
+        for _ in range(int(duration * rate * 5))
+    ]
+
+
+PROFILES = {
+    'baseline': _baseline,
+    'flood': _flood,
+    'scanner': _scanner,
+    'credential_stuffing': _credential_stuffing,
+    'botnet': _botnet,
+}
+
+
+def generate_traffic(profiles, duration=60, rate=20, seed=42):
+    """Requests of the named PROFILES over ``duration`` seconds, baseline at ``rate`` req/s."""
+    rng = random.Random(seed)
+    requests = []
+    for name in profiles:
+        requests.extend(PROFILES[name](rng, duration, rate))
+    requests.sort(key=lambda request: request.offset)
+    return requests
+
+
+def stub_locations(requests, seed=42):
+    """A country/city per client IP for a StubProvider."""
+    rng = random.Random(seed)
+    return {request.ip_address: rng.choice(STUB_COUNTRIES) for request in requests}
+
+
+def default_host():
+    """A Host header ALLOWED_HOSTS accepts: its first entry, or 'testserver'."""
+    hosts = list(getattr(settings, 'ALLOWED_HOSTS', []))
+    if settings.DEBUG and not hosts:
+        # What Django allows in DEBUG with ALLOWED_HOSTS empty
+        hosts = ['localhost']
+    hosts = [host for host in hosts if host != '*']
+    return hosts[0].lstrip('.') if hosts else 'testserver'
+
+
+class WSGITarget:
+    name = 'wsgi'
+    counts_queries = True
+
+    def __init__(self, application=None, host=None):
+        if application is None:
+            from django.core.servers.basehttp import get_internal_wsgi_application
+
+            application = get_internal_wsgi_application()
+        self.application = application
+        self.host = host or default_host()
+
+    def send(self, request):
+        body = request.body()
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'PATH_INFO': request.path.split('?', 1)[0],
+            'QUERY_STRING': request.path.split('?', 1)[1] if '?' in request.path else '',
+            'REMOTE_ADDR': request.ip_address,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'HTTP_HOST': self.host,
+            'HTTP_USER_AGENT': request.user_agent,
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': BytesIO(),
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split(' ', 1)[0]))
+
+        result = self.application(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return status[0]
+
+
+class ASGITarget:
+    name = 'asgi'
+    counts_queries = True
+
+    def __init__(self, application=None, host=None):
+        if application is None:
+            from django.core.asgi import get_asgi_application
+
+            application = get_asgi_application()
+            if getattr(settings, 'IP_GATE_WRAP_APPLICATION', False):
+                from .middleware.ip_gate import EarlyRejectASGIApp
+
+                application = EarlyRejectASGIApp(application)
+        self.application = application
+        self.host = host or default_host()
+
+    async def send(self, request):
+        path, _, query = request.path.partition('?')
+        body = request.body()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': request.method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'headers': [
+                (b'host', self.host.encode()),
+                (b'user-agent', request.user_agent.encode('latin-1', 'replace')),
+                (b'content-type', b'application/x-www-form-urlencoded'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'client': (request.ip_address, 50000),
+            'server': (self.host, 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await self.application(scope, receive, send)
+        return status[0]
+
+
+class HTTPTarget:
+    name = 'http'
+    counts_queries = False
+
+    def __init__(self, base_url, timeout=30):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._requests = requests
+        self._local = threading.local()
+
+    def send(self, request):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(
+            request.method,
+            f"{self.base_url}{request.path}",
+            data=request.body() or None,
+            headers={
+                'X-Forwarded-For': request.ip_address,
+                'User-Agent': request.user_agent,
+                'Content-Type': 'application/x-www-form-urlencoded',
+            },
+            timeout=self.timeout,
+            allow_redirects=False,
+        )
+        return response.status_code
+
+
+def get_target(name, host=None):
+    """'wsgi', 'asgi' or the base URL of a running server; ``host`` is the in-process Host header."""
+    if name == 'wsgi':
+        return WSGITarget(host=host)
+    if name == 'asgi':
+        return ASGITarget(host=host)
+    if urlsplit(name).scheme in ('http', 'https'):
+        return HTTPTarget(name)
+    raise ValueError(f"Unknown target: {name}")
+
+
+class QueryCounter:
+    """Counts database queries per alias, except on threads marked as excluded."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def exclude_current_thread(self):
+        self._local.excluded = True
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.enabled and not getattr(self._local, 'excluded', False):
+            with self._lock:
+                self.counts[context['connection'].alias] += 1
+        return execute(sql, params, many, context)
+
+    def _install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextmanager
+    def installed(self):
+        connection_created.connect(self._install)
+        for connection in connections.all(initialized_only=True):
+            self._install(connection=connection)
+        self.enabled = True
+        try:
+            yield self
+        finally:
+            self.enabled = False
+            connection_created.disconnect(self._install)
+
+
+class DetectionWatcher(threading.Thread):
+    """Runs detection on an interval and records when each client is first flagged."""
+
+    def __init__(self, interval, query_counter=None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.query_counter = query_counter
+        self.flagged_at = {}
+        self.run_seconds = []
+        self._stop_event = threading.Event()
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def watch(self, ip_address):
+        with self._lock:
+            self._clients.add(ip_address)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        connections.close_all()
+
+    def run(self):
+        if self.query_counter:
+            self.query_counter.exclude_current_thread()
+        try:
+            while not self._stop_event.wait(self.interval):
+                self.check()
+            self.check()
+        finally:
+            connections.close_all()
+
+    def check(self):
+        from .models import SuspiciousIP, SuspiciousNetwork
+
+        started = time.perf_counter()
+        try:
+            run_detection()
+        except Exception as e:
+            logger.error(f"Detection run failed during replay: {e}")
+            return
+        finished = time.perf_counter()
+        self.run_seconds.append(finished - started)
+
+        with self._lock:
+            pending = self._clients - set(self.flagged_at)
+        if not pending:
+            return
+        flagged = set(
+            SuspiciousIP.objects
+            .filter(ip_address__in=list(pending), is_active=True)
+            .values_list('ip_address', flat=True)
+        )
+        networks = [
+            ipaddress.ip_network(network)
+            for network in SuspiciousNetwork.objects.filter(is_active=True).values_list('network', flat=True)
+        ]
+        for ip_address in pending - flagged:
+            address = ipaddress.ip_address(ip_address)
+            if any(address in network for network in networks):
+                flagged.add(ip_address)
+        for ip_address in flagged:
+            self.flagged_at[ip_address] = finished
+
+
+def run_detection():
+    """One detect_suspicious_ips pass over the last hour, in this process."""
+    from .tasks import detect_suspicious_ips, run_sharded_detection
+
+    if getattr(settings, 'DETECTION_ENGINE', 'sharded') == 'sharded' and not getattr(
+        settings, 'DETECTION_INCREMENTAL', True
+    ):
+        # The task would fan the shards out through the broker
+        window_end = timezone.now()
+        return run_sharded_detection(
+            window_end - timedelta(hours=1), window_end, shards=getattr(settings, 'DETECTION_SHARDS', 1),
+        )
+    return detect_suspicious_ips()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LoadHarness:
+    def __init__(self, target, requests, concurrency=8, speed=0, detect_interval=2.0):
+        self.target = target
+        self.requests = requests
+        self.concurrency = max(1, concurrency)
+        self.speed = speed
+        self.detect_interval = detect_interval
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.first_seen = {}
+        self._lock = threading.Lock()
+
+    def _due(self, request, started):
+        """Seconds to wait before sending ``request`` when pacing at ``speed``."""
+        if not self.speed:
+            return 0
+        return started + request.offset / self.speed - time.perf_counter()
+
+    def _record(self, request, sent, elapsed, status=None, error=None):
+        with self._lock:
+            self.first_seen.setdefault(request.ip_address, sent)
+            self.latencies.append(elapsed)
+            if error is None:
+                self.statuses[status] += 1
+            else:
+                self.errors[type(error).__name__] += 1
+
+    def _run_threads(self, started, watcher):
+        pending = queue.Queue()
+        for request in self.requests:
+            pending.put(request)
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        request = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    delay = self._due(request, started)
+                    if delay > 0:
+                        time.sleep(delay)
+                    if watcher:
+                        watcher.watch(request.ip_address)
+                    sent = time.perf_counter()
+                    try:
+                        status = self.target.send(request)
+                    except Exception as e:
+                        self._record(request, sent, time.perf_counter() - sent, error=e)
+                    else:
+                        self._record(request, sent, time.perf_counter() - sent, status)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    async def _run_async(self, started, watcher):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(request):
+            delay = self._due(request, started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with semaphore:
+                if watcher:
+                    watcher.watch(request.ip_address)
+                sent = time.perf_counter()
+                try:
+                    status = await self.target.send(request)
+                except Exception as e:
+                    self._record(request, sent, time.perf_counter() - sent, error=e)
+                else:
+                    self._record(request, sent, time.perf_counter() - sent, status)
+
+        await asyncio.gather(*(send(request) for request in self.requests))
+
+    def run(self):
+        query_counter = QueryCounter() if self.target.counts_queries else None
+        watcher = DetectionWatcher(self.detect_interval, query_counter) if self.detect_interval else None
+
+        with query_counter.installed() if query_counter else _nothing():
+            if watcher:
+                watcher.start()
+            started = time.perf_counter()
+            if asyncio.iscoroutinefunction(self.target.send):
+                asyncio.run(self._run_async(started, watcher))
+            else:
+                self._run_threads(started, watcher)
+            elapsed = time.perf_counter() - started
+        if watcher:
+            watcher.stop()
+        return self.report(elapsed, query_counter, watcher)
+
+    def report(self, elapsed, query_counter, watcher):
+        sent = len(self.latencies)
+        report = {
+            'target': self.target.name,
+            'requests': sent,
+            'concurrency': self.concurrency,
+            'seconds': round(elapsed, 3),
+            'throughput': round(sent / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                name: round(percentile(self.latencies, fraction) * 1000, 2) if self.latencies else None
+                for name, fraction in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)]
+            },
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'queries_per_request': None,
+        }
+        if query_counter and sent:
+            report['queries_per_request'] = {
+                alias: round(count / sent, 2) for alias, count in sorted(query_counter.counts.items())
+            }
+            report['queries_per_request']['total'] = round(sum(query_counter.counts.values()) / sent, 2)
+
+        if watcher:
+            attackers = {request.ip_address for request in self.requests if request.attacker}
+            delays = {
+                ip_address: flagged - self.first_seen[ip_address]
+                for ip_address, flagged in watcher.flagged_at.items()
+                if ip_address in self.first_seen
+            }
+            attacker_delays = [delay for ip_address, delay in delays.items() if ip_address in attackers]
+            report['detection'] = {
+                'runs': len(watcher.run_seconds),
+                'mean_run_seconds': (
+                    round(sum(watcher.run_seconds) / len(watcher.run_seconds), 3) if watcher.run_seconds else None
+                ),
+                'attackers': len(attackers),
+                'attackers_flagged': len(attacker_delays),
+                'other_clients_flagged': len(set(delays) - attackers),
+                'time_to_detect_seconds': {
+                    'p50': round(percentile(attacker_delays, 0.5), 3) if attacker_delays else None,
+                    'max': round(max(attacker_delays), 3) if attacker_delays else None,
+                },
+            }
+        return report
+
+
+@contextmanager
+def _nothing():
+    yield
+
+
+@contextmanager
+def replay_environment(cache=None, geolocation_latency=None, locations=None):
+    """
+    Run with a different default cache ('locmem', 'fakeredis' or a redis://
+    URL) and a StubProvider answering ``locations`` after
+    ``geolocation_latency`` seconds. Restores both afterwards.
+    """
+    from .cardinality import resolve_backend, unique_visitors
+    from .geolocation_providers import StubProvider, set_provider
+
+    overrides = {}
+    if cache == 'locmem':
+        overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    elif cache == 'fakeredis':
+        import fakeredis
+
+        overrides['CACHES'] = {'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': 'redis://fakeredis:6379/0',
+            'OPTIONS': {'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection}},
+        }}
+    elif cache:
+        overrides['CACHES'] = {'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': cache}}
+
+    previous_provider = set_provider(StubProvider(locations=locations or {}, latency=geolocation_latency or 0))
+    previous_backend = unique_visitors.backend
+    with override_settings(**overrides):
+        unique_visitors.backend = resolve_backend(
+            getattr(settings, 'CARDINALITY_BACKEND', 'auto'), unique_visitors.retention
+        )
+        try:
+            yield
+        finally:
+            set_provider(previous_provider)
+            unique_visitors.backend = previous_backend
+
+
+@contextmanager
+def discard_replay_data(ip_addresses):
+    """
+    Delete the rows a replay wrote (logs, detections, geolocations) afterwards,
+    and the incremental detection window that counted the deleted logs.
+    """
+    from .incremental_detection import reset_window
+    from .models import IPGeolocation, RequestLog, SuspiciousIP, SuspiciousNetwork
+
+    last_id = RequestLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    started = timezone.now()
+    try:
+        yield
+    finally:
+        ip_addresses = list(ip_addresses)
+        for offset in range(0, len(ip_addresses), 500):
+            batch = ip_addresses[offset:offset + 500]
+            RequestLog.objects.filter(id__gt=last_id, ip_address__in=batch).delete()
+            SuspiciousIP.objects.filter(ip_address__in=batch, detected_at__gte=started).delete()
+            IPGeolocation.objects.filter(ip_address__in=batch, resolved_at__gte=started).delete()
+        SuspiciousNetwork.objects.filter(detected_at__gte=started).delete()
+        reset_window()
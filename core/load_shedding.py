@@ -0,0 +1,177 @@
+"""
+Adaptive load shedding for request logging.
+
+RequestLoggingMiddleware reports how long each logging phase took and
+whether it failed. When the recent latency or error rate goes over budget
+the controller steps down one mode at a time:
+
+    full -> no_geolocation -> sampled (1 in N) -> counters only
+
+and steps back up once logging has been healthy for ``recovery_seconds``.
+Skipped geolocation is stored as 'Unknown' so the backfill task can fill it
+in later. In counters-only mode a single probe write is let through every
+``probe_interval`` seconds to notice the database recovering.
+
+Each transition is logged and counted in the cache under
+``request_logging_transitions_<mode>``; requests that were not written are
+counted under ``request_logging_shed_total``.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FULL = 'full'
+NO_GEOLOCATION = 'no_geolocation'
+SAMPLED = 'sampled'
+COUNTERS_ONLY = 'counters_only'
+MODES = [FULL, NO_GEOLOCATION, SAMPLED, COUNTERS_ONLY]
+
+SHED_COUNTER_KEY = 'request_logging_shed_total'
+
+
+def transition_counter_key(mode):
+    return f"request_logging_transitions_{mode}"
+
+
+class LoggingDegradationController:
+    def __init__(
+        self,
+        latency_budget=0.05,
+        error_rate=0.2,
+        window=50,
+        min_samples=10,
+        step_interval=1.0,
+        recovery_seconds=30.0,
+        sample_rate=10,
+        probe_interval=1.0,
+        flush_interval=10.0,
+        clock=time.monotonic,
+    ):
+        self.latency_budget = latency_budget
+        self.error_rate = error_rate
+        self.min_samples = min_samples
+        self.step_interval = step_interval
+        self.recovery_seconds = recovery_seconds
+        self.sample_rate = max(1, sample_rate)
+        self.probe_interval = probe_interval
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        self.level = 0
+        self.transitions = {mode: 0 for mode in MODES}
+        self.shed = 0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._last_change = clock()
+        self._healthy_since = None
+        self._last_probe = 0.0
+        self._pending_shed = 0
+        self._last_flush = clock()
+
+    @property
+    def mode(self):
+        return MODES[self.level]
+
+    def should_log(self):
+        """Whether this request gets a RequestLog row in the current mode."""
+        mode = self.mode
+        if mode in (FULL, NO_GEOLOCATION):
+            return True
+        with self._lock:
+            self._requests += 1
+            if mode == SAMPLED:
+                write = self._requests % self.sample_rate == 0
+            else:
+                now = self.clock()
+                write = now - self._last_probe >= self.probe_interval
+                if write:
+                    self._last_probe = now
+            if not write:
+                self.shed += 1
+                self._pending_shed += 1
+        self._maybe_flush()
+        return write
+
+    def use_geolocation(self):
+        return self.level == 0
+
+    def observe(self, elapsed, failed=False):
+        """Record one logging phase and step the mode down or up if due."""
+        with self._lock:
+            self._samples.append((elapsed, failed))
+            if len(self._samples) < self.min_samples and not (
+                failed or elapsed > self.latency_budget * 10
+            ):
+                return
+            now = self.clock()
+            if self._is_overloaded():
+                self._healthy_since = None
+                if self.level < len(MODES) - 1 and now - self._last_change >= self.step_interval:
+                    self._change(self.level + 1, now)
+            else:
+                if self._healthy_since is None:
+                    self._healthy_since = now
+                if self.level > 0 and now - max(self._healthy_since, self._last_change) >= self.recovery_seconds:
+                    self._change(self.level - 1, now)
+
+    def _is_overloaded(self):
+        latencies = sorted(elapsed for elapsed, _ in self._samples)
+        # 90th percentile, so a single slow write does not trip the controller
+        p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+        errors = sum(1 for _, failed in self._samples if failed)
+        return p90 > self.latency_budget or errors / len(self._samples) >= self.error_rate
+
+    def _change(self, level, now):
+        previous = self.mode
+        direction = 'degraded' if level > self.level else 'recovered'
+        self.level = level
+        self.transitions[self.mode] += 1
+        self._last_change = now
+        self._healthy_since = None
+        # Judge the new mode on its own samples
+        self._samples.clear()
+        logger.warning(f"Request logging {direction} from {previous} to {self.mode}")
+        try:
+            cache.add(transition_counter_key(self.mode), 0, None)
+            cache.incr(transition_counter_key(self.mode))
+        except Exception as e:
+            logger.error(f"Failed to record logging mode transition: {e}")
+
+    def _maybe_flush(self):
+        if self.clock() - self._last_flush < self.flush_interval:
+            return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending_shed = self._pending_shed, 0
+            self._last_flush = self.clock()
+        if not pending:
+            return
+        try:
+            cache.add(SHED_COUNTER_KEY, 0, None)
+            cache.incr(SHED_COUNTER_KEY, pending)
+        except Exception as e:
+            logger.error(f"Failed to flush shed request counter: {e}")
+
+    def metrics(self):
+        return {
+            'mode': self.mode,
+            'transitions': dict(self.transitions),
+            'shed': self.shed,
+        }
+
+
+logging_controller = LoggingDegradationController(
+    latency_budget=getattr(settings, 'REQUEST_LOGGING_LATENCY_BUDGET', 0.05),
+    error_rate=getattr(settings, 'REQUEST_LOGGING_ERROR_RATE', 0.2),
+    recovery_seconds=getattr(settings, 'REQUEST_LOGGING_RECOVERY_SECONDS', 30.0),
+    sample_rate=getattr(settings, 'REQUEST_LOGGING_SAMPLE_RATE', 10),
+)
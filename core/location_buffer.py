@@ -0,0 +1,136 @@
+"""
+Coalescing write buffer for Location pings.
+
+Each ping only replaces the pending position for its user in memory
+(last write wins). A background thread flushes every ``LOCATION_FLUSH_INTERVAL``
+seconds with one SELECT, one bulk UPDATE and one bulk INSERT, and drops
+positions that moved less than ``LOCATION_MIN_MOVE_METERS`` from the stored
+one. DB writes therefore follow the number of active users, not pings.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import geo
+from .models import Location
+
+logger = logging.getLogger(__name__)
+
+
+class LocationWriteBuffer:
+    def __init__(self, flush_interval=5.0, min_move_meters=25.0, batch_size=500):
+        self.flush_interval = flush_interval
+        self.min_move_meters = min_move_meters
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = None
+        self.stats = {'pings': 0, 'flushes': 0, 'updated': 0, 'created': 0, 'skipped': 0}
+
+    def add(self, user_id, latitude, longitude):
+        with self._lock:
+            self._pending[user_id] = (latitude, longitude)
+            self.stats['pings'] += 1
+        self._ensure_flusher()
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Location flush failed: {e}")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the latest pending position of every user. Returns rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            try:
+                written = self._write(pending)
+            except Exception:
+                # Put the positions back unless a newer ping arrived meanwhile
+                with self._lock:
+                    for user_id, position in pending.items():
+                        self._pending.setdefault(user_id, position)
+                raise
+            self.stats['flushes'] += 1
+            return written
+
+    def _write(self, pending):
+        existing = {
+            location.user_id: location
+            for location in Location.objects.filter(user_id__in=list(pending))
+            .only('id', 'user_id', 'latitude', 'longitude')
+        }
+        now = timezone.now()
+        to_update, to_create = [], []
+        for user_id, (latitude, longitude) in pending.items():
+            location = existing.get(user_id)
+            if location is None:
+                to_create.append(Location(
+                    user_id=user_id,
+                    latitude=latitude,
+                    longitude=longitude,
+                    geohash=geo.encode(latitude, longitude),
+                ))
+                continue
+
+            moved = geo.haversine_km(location.latitude, location.longitude, latitude, longitude) * 1000
+            if moved < self.min_move_meters:
+                self.stats['skipped'] += 1
+                continue
+            location.latitude = latitude
+            location.longitude = longitude
+            location.geohash = geo.encode(latitude, longitude)
+            location.updated_at = now
+            to_update.append(location)
+
+        if to_update:
+            Location.objects.bulk_update(
+                to_update, ['latitude', 'longitude', 'geohash', 'updated_at'],
+                batch_size=self.batch_size,
+            )
+        if to_create:
+            # A concurrent writer may have created the row since the SELECT
+            Location.objects.bulk_create(to_create, batch_size=self.batch_size, ignore_conflicts=True)
+
+        self.stats['updated'] += len(to_update)
+        self.stats['created'] += len(to_create)
+        return len(to_update) + len(to_create)
+
+
+location_buffer = LocationWriteBuffer(
+    flush_interval=getattr(settings, 'LOCATION_FLUSH_INTERVAL', 5.0),
+    min_move_meters=getattr(settings, 'LOCATION_MIN_MOVE_METERS', 25.0),
+)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        location_buffer.flush()
+    except Exception as e:
+        logger.error(f"Final location flush failed: {e}")
@@ -0,0 +1,183 @@
+"""
+Streaming analysis of the access logs written by RequestLoggingMiddleware
+(``result.txt`` and rotated ``.gz`` segments).
+
+Plain files are split into byte ranges aligned on line boundaries so several
+processes can read one large file at once; gzip segments are read as one
+stream each. Only aggregates are kept, never the lines themselves.
+"""
+import gzip
+import os
+from collections import Counter
+from datetime import datetime
+
+from django.utils import timezone
+
+FIELDS = ('timestamp', 'ip_address', 'country', 'city', 'path', 'method', 'user_agent', 'status')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_line(line):
+    """Split one log line into the FIELDS, or return None for headers and malformed lines."""
+    parts = line.rstrip('\r\n').split(',')
+    if len(parts) != len(FIELDS):
+        return None
+    record = [part.strip() for part in parts]
+    if record[0] == 'Timestamp':
+        return None
+    return record
+
+
+class LogSummary:
+    """Mergeable counters for a set of log lines."""
+
+    def __init__(self):
+        self.lines = 0
+        self.malformed = 0
+        self.loaded = 0
+        self.ips = Counter()
+        self.paths = Counter()
+        self.countries = Counter()
+        self.statuses = Counter()
+        self.per_minute = Counter()
+
+    def add(self, record):
+        self.ips[record[1]] += 1
+        self.paths[record[4]] += 1
+        self.countries[record[2]] += 1
+        self.statuses[record[7]] += 1
+        self.per_minute[record[0][:16]] += 1
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.malformed += other.malformed
+        self.loaded += other.loaded
+        self.ips.update(other.ips)
+        self.paths.update(other.paths)
+        self.countries.update(other.countries)
+        self.statuses.update(other.statuses)
+        self.per_minute.update(other.per_minute)
+        return self
+
+    def report(self, top=10):
+        minutes = len(self.per_minute)
+        requests = sum(self.per_minute.values())
+        return {
+            'lines': self.lines,
+            'malformed': self.malformed,
+            'loaded': self.loaded,
+            'top_ips': self.ips.most_common(top),
+            'top_paths': self.paths.most_common(top),
+            'top_countries': self.countries.most_common(top),
+            'statuses': dict(self.statuses),
+            'busiest_minutes': self.per_minute.most_common(top),
+            'average_per_minute': round(requests / minutes, 2) if minutes else 0,
+            'per_minute': dict(sorted(self.per_minute.items())),
+        }
+
+
+def plan_segments(paths, chunk_size):
+    """Yield (path, start, end) work units; gzip files are never split."""
+    for path in paths:
+        if path.endswith('.gz'):
+            yield (path, 0, None)
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            yield (path, start, min(start + chunk_size, size))
+
+
+def iter_segment_lines(path, start, end):
+    """
+    Yield the lines whose first byte falls in [start, end).
+    A line crossing ``end`` belongs to this segment; a line crossing
+    ``start`` belongs to the previous one.
+    """
+    if end is None:
+        with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as f:
+            yield from f
+        return
+
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            if f.read(1) != b'\n':
+                f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8', errors='replace')
+
+
+def analyze_segment(segment, load=False, batch_size=1000):
+    """Summarize one work unit, optionally bulk-loading its rows into RequestLog."""
+    summary = LogSummary()
+    batch = []
+    for line in iter_segment_lines(*segment):
+        summary.lines += 1
+        record = parse_line(line)
+        if record is None:
+            summary.malformed += 1
+            continue
+        summary.add(record)
+        if load and record[7] != 'BLOCKED':
+            batch.append(record)
+            if len(batch) >= batch_size:
+                summary.loaded += load_records(batch)
+                batch = []
+    if batch:
+        summary.loaded += load_records(batch)
+    return summary
+
+
+def load_records(records):
+    from core.models import RequestLog
+
+    rows = []
+    for record in records:
+        try:
+            timestamp = timezone.make_aware(datetime.strptime(record[0], TIMESTAMP_FORMAT))
+        except ValueError:
+            continue
+        rows.append(RequestLog(
+            timestamp=timestamp,
+            ip_address=record[1],
+            country=record[2],
+            city=record[3],
+            path=record[4],
+            method=record[5][:10],
+            user_agent=record[6],
+        ))
+    RequestLog.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _analyze_in_worker(args):
+    from django.db import connections
+
+    try:
+        return analyze_segment(*args)
+    finally:
+        connections.close_all()
+
+
+def analyze_logs(paths, workers=1, chunk_size=64 * 1024 * 1024, load=False, batch_size=1000):
+    """Analyze ``paths`` on ``workers`` processes and return the merged summary."""
+    segments = [(segment, load, batch_size) for segment in plan_segments(paths, chunk_size)]
+    summary = LogSummary()
+
+    if workers > 1 and len(segments) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from django.db import connections
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial in pool.map(_analyze_in_worker, segments):
+                summary.merge(partial)
+    else:
+        for args in segments:
+            summary.merge(analyze_segment(*args))
+    return summary
@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import time
+
+from core.log_analysis import analyze_logs
+
+
+class Command(BaseCommand):
+    help = 'Stream access logs (result.txt and rotated .gz segments) and summarize them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            default=['result.txt'],
+            help='Log files to analyze (.gz files are decompressed on the fly)'
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes'
+        )
+
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=64,
+            help='Size in MB of the byte ranges plain files are split into'
+        )
+
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Number of entries to show per ranking'
+        )
+
+        parser.add_argument(
+            '--load',
+            action='store_true',
+            help='Bulk-load the parsed requests into RequestLog'
+        )
+
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the full report, including per-minute rates, as JSON'
+        )
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        for path in paths:
+            if not os.path.exists(path):
+                raise CommandError(f"Log file not found: {path}")
+
+        started = time.perf_counter()
+        summary = analyze_logs(
+            paths,
+            workers=options['workers'],
+            chunk_size=options['chunk_size'] * 1024 * 1024,
+            load=options['load'],
+        )
+        elapsed = time.perf_counter() - started
+        report = summary.report(top=options['top'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Analyzed {report['lines']} lines in {elapsed:.2f}s "
+                f"({report['lines'] / max(elapsed, 1e-9):.0f} lines/s, "
+                f"{report['malformed']} skipped, {report['loaded']} loaded)"
+            )
+        )
+        for title, key in [
+            ('Top IPs', 'top_ips'),
+            ('Top paths', 'top_paths'),
+            ('Top countries', 'top_countries'),
+            ('Busiest minutes', 'busiest_minutes'),
+        ]:
+            self.stdout.write(f"\n{title}:")
+            for value, count in report[key]:
+                self.stdout.write(f"  {count:>10}  {value}")
+
+        self.stdout.write("\nStatuses:")
+        for status, count in sorted(report['statuses'].items()):
+            self.stdout.write(f"  {count:>10}  {status}")
+        self.stdout.write(f"\nAverage requests per active minute: {report['average_per_minute']}")
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from core.archive import archive_request_logs
+
+
+class Command(BaseCommand):
+    help = 'Move request logs older than the retention window into compressed per-day archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=None,
+            help='Archive rows older than this many full days (defaults to REQUEST_LOG_RETENTION_DAYS)'
+        )
+
+        parser.add_argument(
+            '--directory',
+            type=str,
+            default=None,
+            help='Archive directory (defaults to REQUEST_LOG_ARCHIVE_DIR)'
+        )
+
+        parser.add_argument(
+            '--delete-batch-size',
+            type=int,
+            default=None,
+            help='Rows removed from the database per DELETE'
+        )
+
+    def handle(self, *args, **options):
+        stats = archive_request_logs(
+            older_than_days=options['older_than_days'],
+            directory=options['directory'],
+            delete_batch_size=options['delete_batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {stats['rows']} request logs from {stats['days']} days, "
+            f"pruned {stats['pruned']} expired segments"
+        ))
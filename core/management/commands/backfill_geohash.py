@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from core import geo
+from core.models import Location
+
+
+class Command(BaseCommand):
+    help = 'Fill in Location.geohash for rows saved before it existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows updated per bulk_update'
+        )
+
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every row, not only rows without a geohash'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        locations = Location.objects.order_by('pk')
+        if not options['all']:
+            locations = locations.filter(geohash='')
+
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                locations.filter(pk__gt=last_pk)
+                .only('pk', 'latitude', 'longitude')[:batch_size]
+            )
+            if not batch:
+                break
+            for location in batch:
+                location.geohash = geo.encode(location.latitude, location.longitude)
+            Location.objects.bulk_update(batch, ['geohash'])
+            updated += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled geohash for {updated} locations"))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.geolocation import backfill_request_logs
+
+
+class Command(BaseCommand):
+    help = 'Resolve request logs stored without a location (Unknown/Error/blank), resumable'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'GEOLOCATION_BACKFILL_BATCH_SIZE', 1000),
+            help='Request log rows per batch'
+        )
+
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=None,
+            help='Stop after this many batches (the next run resumes from there)'
+        )
+
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the saved watermark and start from the first row'
+        )
+
+    def handle(self, *args, **options):
+        stats = backfill_request_logs(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            restart=options['restart'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {stats['rows_updated']} request logs for {stats['resolved']} IPs "
+            f"in {stats['batches']} batches"
+        ))
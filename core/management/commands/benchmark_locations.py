@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import random
+import time
+
+from core import geo
+from core.models import Location, User
+
+
+class Command(BaseCommand):
+    help = 'Benchmark geohash-prefiltered proximity queries against a full scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=1000000,
+            help='Number of synthetic locations to insert (rolled back afterwards)'
+        )
+
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=100,
+            help='Number of random radius queries'
+        )
+
+        parser.add_argument(
+            '--radius',
+            type=float,
+            default=25.0,
+            help='Query radius in km'
+        )
+
+        parser.add_argument(
+            '--scan-queries',
+            type=int,
+            default=3,
+            help='Number of queries also answered by a full scan for comparison'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        with transaction.atomic():
+            self.populate(options['count'], rng)
+
+            points = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(options['queries'])]
+            radius = options['radius']
+
+            started = time.perf_counter()
+            found = sum(len(Location.objects.near(lat, lon, radius)) for lat, lon in points)
+            indexed = (time.perf_counter() - started) / len(points)
+
+            scan_points = points[:options['scan_queries']]
+            started = time.perf_counter()
+            scanned = 0
+            for lat, lon in scan_points:
+                scanned += sum(
+                    1 for p_lat, p_lon in Location.objects.values_list('latitude', 'longitude').iterator()
+                    if geo.haversine_km(lat, lon, p_lat, p_lon) <= radius
+                )
+            full_scan = (time.perf_counter() - started) / max(len(scan_points), 1)
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{options['count']} locations, radius {radius} km: "
+                f"geohash {indexed * 1000:.2f} ms/query ({found} hits), "
+                f"full scan {full_scan * 1000:.2f} ms/query"
+            ))
+            transaction.set_rollback(True)
+
+    def populate(self, count, rng, batch_size=5000):
+        started = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            users = User.objects.bulk_create([
+                User(username=f'geo-bench-{offset + i}', password='!') for i in range(size)
+            ])
+            locations = []
+            for user in users:
+                latitude = round(rng.uniform(-60, 60), 6)
+                longitude = round(rng.uniform(-180, 180), 6)
+                locations.append(Location(
+                    user=user,
+                    latitude=latitude,
+                    longitude=longitude,
+                    geohash=geo.encode(latitude, longitude),
+                ))
+            Location.objects.bulk_create(locations)
+        self.stdout.write(f"Inserted {count} locations in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+LOG_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS request_logs ("
+    "id INTEGER PRIMARY KEY, ip_address TEXT, path TEXT, timestamp REAL)"
+)
+USER_SCHEMA = "CREATE TABLE IF NOT EXISTS core_user (id INTEGER PRIMARY KEY, last_login REAL)"
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark login writes while request logs are being written, with the logs '
+        'sharing the default SQLite file versus a separate WAL-mode logs file'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=5.0,
+            help='How long to run each layout'
+        )
+
+        parser.add_argument(
+            '--log-writers',
+            type=int,
+            default=4,
+            help='Threads inserting request logs, one row per transaction'
+        )
+
+        parser.add_argument(
+            '--seed-rows',
+            type=int,
+            default=200000,
+            help='Request log rows present before the run, scanned by the detection reader'
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            for layout in ['shared', 'split']:
+                result = self.run_layout(layout, directory, options)
+                latencies = sorted(result['login_latencies'])
+                p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+                self.stdout.write(self.style.SUCCESS(
+                    f"{layout:>6}: login writes {len(latencies)} "
+                    f"(p50 {statistics.median(latencies) * 1000 if latencies else 0:.1f} ms, "
+                    f"p95 {p95 * 1000:.1f} ms, max {max(latencies, default=0) * 1000:.1f} ms), "
+                    f"log inserts {result['log_writes'] / options['seconds']:.0f}/s, "
+                    f"detection scans {result['scans']}"
+                ))
+
+    def run_layout(self, layout, directory, options):
+        default_path = os.path.join(directory, f'{layout}-default.sqlite3')
+        if layout == 'shared':
+            # Today's setup: one file, rollback journal
+            logs_path = default_path
+            logs_pragmas = []
+        else:
+            logs_path = os.path.join(directory, f'{layout}-logs.sqlite3')
+            logs_pragmas = ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL']
+
+        def connect(path, pragmas=()):
+            connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+            for pragma in pragmas:
+                connection.execute(pragma)
+            return connection
+
+        setup = connect(default_path)
+        setup.execute(USER_SCHEMA)
+        setup.executemany("INSERT INTO core_user (id, last_login) VALUES (?, 0)", [(i,) for i in range(1, 101)])
+        setup.close()
+        setup = connect(logs_path, logs_pragmas)
+        setup.execute(LOG_SCHEMA)
+        setup.execute("BEGIN")
+        setup.executemany(
+            "INSERT INTO request_logs (ip_address, path, timestamp) VALUES (?, '/', 0)",
+            ((f'10.0.{i % 250}.{i % 200}',) for i in range(options['seed_rows'])),
+        )
+        setup.execute("COMMIT")
+        setup.close()
+
+        stop = threading.Event()
+        result = {'login_latencies': [], 'log_writes': 0, 'scans': 0}
+        lock = threading.Lock()
+
+        def log_writer(number):
+            connection = connect(logs_path, logs_pragmas)
+            written = 0
+            while not stop.is_set():
+                connection.execute(
+                    "INSERT INTO request_logs (ip_address, path, timestamp) VALUES (?, '/api/', ?)",
+                    (f'192.0.2.{number}', time.time()),
+                )
+                written += 1
+            connection.close()
+            with lock:
+                result['log_writes'] += written
+
+        def detection_reader():
+            connection = connect(logs_path, logs_pragmas)
+            while not stop.is_set():
+                connection.execute(
+                    "SELECT ip_address, COUNT(*) FROM request_logs GROUP BY ip_address"
+                ).fetchall()
+                result['scans'] += 1
+            connection.close()
+
+        def login_writer():
+            connection = connect(default_path)
+            user_id = 0
+            while not stop.is_set():
+                user_id = user_id % 100 + 1
+                started = time.perf_counter()
+                connection.execute("UPDATE core_user SET last_login = ? WHERE id = ?", (time.time(), user_id))
+                result['login_latencies'].append(time.perf_counter() - started)
+                time.sleep(0.005)
+            connection.close()
+
+        threads = [threading.Thread(target=log_writer, args=(i,)) for i in range(options['log_writers'])]
+        threads += [threading.Thread(target=detection_reader), threading.Thread(target=login_writer)]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return result
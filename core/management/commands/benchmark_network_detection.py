@@ -0,0 +1,131 @@
+import ipaddress
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.detection import NetworkAggregator, WindowFrame
+from core.tasks import SENSITIVE_PATHS
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark network-prefix aggregation over a synthetic detection window: '
+        'vectorized integer masking versus a per-IP ipaddress loop'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=10000000,
+            help='Request log rows in the synthetic window'
+        )
+
+        parser.add_argument(
+            '--ips',
+            type=int,
+            default=500000,
+            help='Distinct client addresses'
+        )
+
+        parser.add_argument(
+            '--ipv6-share',
+            type=float,
+            default=0.3,
+            help='Fraction of the addresses that are IPv6'
+        )
+
+        parser.add_argument(
+            '--skip-loop',
+            action='store_true',
+            help='Only time the vectorized aggregation'
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(42)
+        started = time.perf_counter()
+        frame = self.build_frame(rng, options['rows'], options['ips'], options['ipv6_share'])
+        self.stdout.write(
+            f"Built {len(frame)} rows over {frame.n_ips} IPs in {time.perf_counter() - started:.1f}s "
+            f"(address parsing included)"
+        )
+
+        aggregator = NetworkAggregator()
+        started = time.perf_counter()
+        requests = frame.requests_per_ip()
+        sensitive = frame.sensitive_requests_per_ip()
+        counted = time.perf_counter() - started
+        started = time.perf_counter()
+        findings = aggregator.evaluate_frame(frame)
+        vectorized = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"vectorized: per-IP counts {counted * 1000:.0f} ms, "
+            f"{len(aggregator.rules)} prefix rules {vectorized * 1000:.0f} ms, "
+            f"flagged {len(findings)} networks"
+        ))
+
+        if options['skip_loop']:
+            return
+        started = time.perf_counter()
+        looped = self.loop_networks(aggregator.rules, frame.ips, requests, sensitive)
+        loop = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"per-IP loop: {loop * 1000:.0f} ms, flagged {len(looped)} networks "
+            f"(x{loop / max(vectorized, 1e-9):.0f} slower, "
+            f"{'same' if looped == set(findings) else 'DIFFERENT'} networks)"
+        ))
+
+    def build_frame(self, rng, rows, n_ips, ipv6_share):
+        n_ipv6 = int(n_ips * ipv6_share)
+        ipv4 = rng.integers(1 << 24, 223 << 24, n_ips - n_ipv6, dtype=np.uint64)
+        ipv6_hi = (np.uint64(0x2001_0db8) << np.uint64(32)) | rng.integers(0, 1 << 16, n_ipv6, dtype=np.uint64)
+        ipv6_lo = rng.integers(0, 1 << 63, n_ipv6, dtype=np.uint64)
+        ips = [str(ipaddress.IPv4Address(int(value))) for value in ipv4]
+        ips += [
+            str(ipaddress.IPv6Address((int(hi) << 64) | int(lo)))
+            for hi, lo in zip(ipv6_hi, ipv6_lo)
+        ]
+        # Make a few botnets: /24s and /64s whose addresses each stay under
+        # the per-IP threshold but add up past the network ones
+        for botnet in range(20):
+            ips += [f'198.18.{botnet}.{host}' for host in range(1, 41)]
+            ips += [f'2001:db8:ffff:{botnet:x}::{host:x}' for host in range(1, 41)]
+        paths = [f'/api/items/{i}/' for i in range(1000)] + list(SENSITIVE_PATHS)
+
+        # Zipf-like client popularity, as in real traffic
+        weights = 1.0 / np.arange(1, len(ips) + 1) ** 0.8
+        ip_codes = rng.choice(len(ips), size=rows, p=weights / weights.sum())
+        bot_rows = rng.integers(n_ips, len(ips), rows // 100)
+        ip_codes[:len(bot_rows)] = bot_rows
+        path_codes = rng.integers(0, 1000, rows)
+        path_codes[:len(bot_rows) // 4] = rng.integers(1000, len(paths), len(bot_rows) // 4)
+        return WindowFrame(
+            ips=ips,
+            paths=paths,
+            ip_codes=ip_codes.astype(np.int64),
+            path_codes=path_codes.astype(np.int64),
+            timestamps=np.zeros(rows, dtype=np.int64),
+            status_codes=np.zeros(rows, dtype=np.int16),
+        )
+
+    @staticmethod
+    def loop_networks(rules, ips, requests, sensitive):
+        flagged = set()
+        for rule in rules:
+            totals = defaultdict(lambda: [0, 0, 0])
+            for code, ip in enumerate(ips):
+                address = ipaddress.ip_address(ip)
+                if address.version != rule['version']:
+                    continue
+                entry = totals[ipaddress.ip_network((address, rule['prefix_length']), strict=False)]
+                entry[0] += int(requests[code])
+                entry[1] += int(sensitive[code])
+                entry[2] += 1
+            for network, (request_count, sensitive_count, ip_count) in totals.items():
+                if ip_count >= rule['min_ips'] and (
+                    request_count >= rule['requests'] or sensitive_count >= rule['sensitive_requests']
+                ):
+                    flagged.add(str(network))
+        return flagged
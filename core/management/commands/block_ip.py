@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from core.models import BlockedIP
-import ipaddress
+from core.ip_sets import blocked_ips
+from core.ip_classifier import INVALID, PUBLIC, ip_classifier
 
 class Command(BaseCommand):
     help = 'Add IP addresses to the blocking blacklist'
@@ -24,24 +25,50 @@ class Command(BaseCommand):
             action='store_true',
             help='Deactivate instead of blocking (unblock)'
         )
+
+        parser.add_argument(
+            '--ttl',
+            type=int,
+            help='Seconds until the block expires (default BLOCKED_IP_TTL, 0 never expires)'
+        )
+
+        parser.add_argument(
+            '--allow-non-public',
+            action='store_true',
+            help='Also block loopback, private, link-local and other non-public addresses'
+        )
     
     def handle(self, *args, **options):
         ip_addresses = options['ip_addresses']
         reason = options['reason']
         deactivate = options['deactivate']
+        if options['ttl'] is not None and options['ttl'] < 0:
+            raise CommandError('--ttl must be 0 (never expires) or a positive number of seconds')
         
         action = "deactivated" if deactivate else "blocked"
         
         for ip_str in ip_addresses:
             try:
                 # Validate IP address
-                ipaddress.ip_address(ip_str)
-                
+                category = ip_classifier.classify(ip_str)
+                if category == INVALID:
+                    raise ValueError(ip_str)
+
+                if not deactivate and category != PUBLIC and not options['allow_non_public']:
+                    # Blocking these usually locks out proxies, health checks or ourselves
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"Skipping {category} IP: {ip_str} (use --allow-non-public to block it)"
+                        )
+                    )
+                    continue
+
                 if deactivate:
                     # Deactivate (unblock) the IP
-                    blocked_ips = BlockedIP.objects.filter(ip_address=ip_str)
-                    if blocked_ips.exists():
-                        blocked_ips.update(is_active=False)
+                    matches = BlockedIP.objects.filter(ip_address=ip_str)
+                    if matches.exists():
+                        matches.update(is_active=False)
+                        blocked_ips.invalidate()
                         self.stdout.write(
                             self.style.SUCCESS(
                                 f"Successfully deactivated IP: {ip_str}"
@@ -54,15 +81,10 @@ class Command(BaseCommand):
                             )
                         )
                 else:
-                    # Block the IP (create or update)
-                    blocked_ip, created = BlockedIP.objects.update_or_create(
-                        ip_address=ip_str,
-                        defaults={
-                            'reason': reason,
-                            'is_active': True
-                        }
-                    )
-                    
+                    # Block the IP (create or update); repeat blocks last longer
+                    created = not BlockedIP.objects.filter(ip_address=ip_str).exists()
+                    BlockedIP.block_many([ip_str], reason=reason, ttl=options['ttl'])
+
                     if created:
                         self.stdout.write(
                             self.style.SUCCESS(
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import RENDERERS, filter_request_logs, iter_request_logs, parse_export_time
+
+
+class Command(BaseCommand):
+    help = 'Stream RequestLog rows to a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=sorted(RENDERERS),
+            default='csv',
+            help='Output format'
+        )
+
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='File to write to (defaults to stdout)'
+        )
+
+        parser.add_argument('--ip', type=str, help='Only rows from this IP address or CIDR network')
+        parser.add_argument('--path-prefix', type=str, help='Only paths starting with this prefix')
+        parser.add_argument('--country', type=str, help='Only rows from this country')
+        parser.add_argument('--since', type=str, help='Start of the time range (ISO 8601, inclusive)')
+        parser.add_argument('--until', type=str, help='End of the time range (ISO 8601, exclusive)')
+
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=5000,
+            help='Rows fetched per keyset page'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            logs = filter_request_logs(
+                ip_address=options['ip'],
+                path_prefix=options['path_prefix'],
+                country=options['country'],
+                since=parse_export_time(options['since']),
+                until=parse_export_time(options['until']),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        render, _ = RENDERERS[options['format']]
+        lines = render(iter_request_logs(logs, page_size=options['page_size']))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(lines)
+            self.stdout.write(self.style.SUCCESS(f"Exported request logs to {options['output']}"))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
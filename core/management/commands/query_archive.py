@@ -0,0 +1,65 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive import iter_archived_logs
+from core.exports import RENDERERS, parse_export_time
+
+
+class Command(BaseCommand):
+    help = 'Scan archived request logs without loading them back into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=sorted(RENDERERS),
+            default='csv',
+            help='Output format'
+        )
+
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='File to write to (defaults to stdout)'
+        )
+
+        parser.add_argument('--ip', type=str, help='Only rows from this IP address')
+        parser.add_argument('--path-prefix', type=str, help='Only paths starting with this prefix')
+        parser.add_argument('--since', type=str, help='Start of the time range (ISO 8601, inclusive)')
+        parser.add_argument('--until', type=str, help='End of the time range (ISO 8601, exclusive)')
+        parser.add_argument('--limit', type=int, help='Stop after this many rows')
+
+        parser.add_argument(
+            '--directory',
+            type=str,
+            default=None,
+            help='Archive directory (defaults to REQUEST_LOG_ARCHIVE_DIR)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_export_time(options['since'])
+            until = parse_export_time(options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        rows = iter_archived_logs(
+            start=since,
+            end=until,
+            ip_address=options['ip'],
+            path_prefix=options['path_prefix'],
+            directory=options['directory'],
+        )
+        if options['limit'] is not None:
+            rows = islice(rows, options['limit'])
+
+        render, _ = RENDERERS[options['format']]
+        lines = render(rows)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(lines)
+            self.stdout.write(self.style.SUCCESS(f"Wrote archived request logs to {options['output']}"))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,206 @@
+import ipaddress
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.load_harness import (
+    PROFILES, LoadHarness, discard_replay_data, generate_traffic, get_target,
+    read_access_log, read_export, replay_environment, stub_locations,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay recorded or generated traffic through the full middleware stack and report '
+        'latency percentiles, throughput, queries per request and time to detect attackers'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            action='append',
+            default=[],
+            help='Access log (result.txt, .gz allowed) or CSV/NDJSON export to replay; repeatable'
+        )
+
+        parser.add_argument(
+            '--profile',
+            action='append',
+            choices=sorted(PROFILES),
+            default=[],
+            help='Generated traffic profile to add; repeatable'
+        )
+
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=60,
+            help='Seconds of generated traffic'
+        )
+
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=20,
+            help='Baseline requests per second of generated traffic'
+        )
+
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for generated traffic and stub locations'
+        )
+
+        parser.add_argument(
+            '--target',
+            default='wsgi',
+            help="'wsgi', 'asgi' (in process) or the base URL of a running server"
+        )
+
+        parser.add_argument(
+            '--host',
+            help='Host header of in-process requests; defaults to the first ALLOWED_HOSTS entry'
+        )
+
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Requests in flight at once'
+        )
+
+        parser.add_argument(
+            '--speed',
+            type=float,
+            default=0,
+            help='Replay at this multiple of the recorded rate; 0 sends as fast as possible'
+        )
+
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Replay at most this many requests'
+        )
+
+        parser.add_argument(
+            '--geo-latency',
+            type=float,
+            default=0.05,
+            help='Seconds each stubbed geolocation lookup takes'
+        )
+
+        parser.add_argument(
+            '--cache',
+            help="Default cache during the run: 'locmem', 'fakeredis' or a redis:// URL"
+        )
+
+        parser.add_argument(
+            '--detect-interval',
+            type=float,
+            default=2.0,
+            help='Seconds between detection runs; 0 disables detection'
+        )
+
+        parser.add_argument(
+            '--attacker',
+            action='append',
+            default=[],
+            help='CIDR whose clients count as attackers in replayed sources; repeatable'
+        )
+
+        parser.add_argument(
+            '--keep-data',
+            action='store_true',
+            help='Keep the request logs, detections and geolocations the replay wrote'
+        )
+
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON'
+        )
+
+    def handle(self, *args, **options):
+        if not options['source'] and not options['profile']:
+            raise CommandError('Give at least one --source or --profile')
+        try:
+            attackers = [ipaddress.ip_network(network, strict=False) for network in options['attacker']]
+            target = get_target(options['target'], host=options['host'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        requests = []
+        for source in options['source']:
+            try:
+                if source.endswith(('.csv', '.ndjson', '.jsonl', '.json')):
+                    requests.extend(read_export(source))
+                else:
+                    requests.extend(read_access_log(source))
+            except (OSError, KeyError, ValueError) as e:
+                raise CommandError(f"Cannot read {source}: {e}")
+        for request in requests:
+            try:
+                address = ipaddress.ip_address(request.ip_address)
+            except ValueError:
+                continue
+            request.attacker = any(address in network for network in attackers)
+        requests.extend(generate_traffic(
+            options['profile'], duration=options['duration'], rate=options['rate'], seed=options['seed'],
+        ))
+        requests.sort(key=lambda request: request.offset)
+        if options['limit']:
+            requests = requests[:options['limit']]
+        if not requests:
+            raise CommandError('No requests to replay')
+
+        if options['cache'] == 'fakeredis':
+            try:
+                import fakeredis  # noqa: F401
+            except ImportError:
+                raise CommandError("--cache fakeredis needs the fakeredis package")
+        if options['cache'] and target.name == 'http':
+            self.stderr.write('--cache only applies to in-process targets; the server keeps its own cache')
+
+        self.stdout.write(
+            f"Replaying {len(requests)} requests from {len({r.ip_address for r in requests})} clients "
+            f"against {options['target']} with concurrency {options['concurrency']}"
+        )
+        harness = LoadHarness(
+            target, requests,
+            concurrency=options['concurrency'],
+            speed=options['speed'],
+            detect_interval=options['detect_interval'],
+        )
+        with replay_environment(
+            cache=options['cache'],
+            geolocation_latency=options['geo_latency'],
+            locations=stub_locations(requests, seed=options['seed']),
+        ):
+            if options['keep_data']:
+                report = harness.run()
+            else:
+                with discard_replay_data({request.ip_address for request in requests}):
+                    report = harness.run()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        latency = report['latency_ms']
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['requests']} requests in {report['seconds']}s ({report['throughput']} req/s); "
+            f"latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, "
+            f"p99 {latency['p99']} ms, max {latency['max']} ms"
+        ))
+        self.stdout.write(f"Statuses: {report['statuses']}  Errors: {report['errors'] or 'none'}")
+        if report['queries_per_request']:
+            self.stdout.write(f"Queries per request: {report['queries_per_request']}")
+        detection = report.get('detection')
+        if detection:
+            ttd = detection['time_to_detect_seconds']
+            self.stdout.write(self.style.SUCCESS(
+                f"Detection: {detection['runs']} runs ({detection['mean_run_seconds']}s each); "
+                f"{detection['attackers_flagged']}/{detection['attackers']} attackers flagged, "
+                f"time to detect p50 {ttd['p50']}s, max {ttd['max']}s; "
+                f"{detection['other_clients_flagged']} other clients flagged"
+            ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.expiry import backfill_expiry, sweep_expired_ips
+
+
+class Command(BaseCommand):
+    help = 'Deactivate expired SuspiciousIP and BlockedIP entries and delete long-expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows per UPDATE/DELETE (default IP_SWEEP_BATCH_SIZE)'
+        )
+
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='First give entries without an expiry one from their creation time and default TTL'
+        )
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            updated = backfill_expiry(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Set an expiry on {updated} entries"))
+
+        result = sweep_expired_ips(batch_size=options['batch_size'])
+        for name, (deactivated, deleted) in result.items():
+            self.stdout.write(self.style.SUCCESS(f"{name}: deactivated {deactivated}, deleted {deleted}"))
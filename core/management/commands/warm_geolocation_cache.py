@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.geolocation import warm_geolocations
+
+
+class Command(BaseCommand):
+    help = 'Preload the busiest recent IPs into the geolocation cache (run at deploy time)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=1000,
+            help='Number of busiest IPs to preload'
+        )
+
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='How many days of request logs to rank IPs by'
+        )
+
+    def handle(self, *args, **options):
+        cached = warm_geolocations(limit=options['limit'], days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Preloaded geolocation for {cached} IPs"))
@@ -0,0 +1,160 @@
+"""
+Early rejection gate for blocked IPs.
+
+Blocked clients are turned away before sessions, CSRF, auth or request logging
+run. The gate can be used in two ways:
+
+* as the first entry of ``MIDDLEWARE``
+  (``core.middleware.ip_gate.EarlyRejectMiddleware``), or
+* as a raw WSGI/ASGI wrapper around the Django application
+  (``EarlyRejectWSGIApp`` / ``EarlyRejectASGIApp``), which rejects the
+  request before Django even builds an ``HttpRequest``. Enable it with
+  ``IP_GATE_WRAP_APPLICATION = True``.
+
+Blocked hits are never logged one by one: they are aggregated into counters,
+flushed to the cache every ``IP_GATE_FLUSH_INTERVAL`` seconds, and only one in
+``IP_GATE_LOG_SAMPLE_RATE`` hits produces a log line.
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from core.ip_sets import blocked_ips
+from core.ip_utils import get_client_ip, get_client_ip_from_scope
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_BODY = b"Access denied. Your IP address has been blocked."
+BLOCKED_STATUS = 403
+BLOCKED_HEADERS = [
+    ("Content-Type", "text/plain; charset=utf-8"),
+    ("Content-Length", str(len(BLOCKED_BODY))),
+    ("Cache-Control", "no-store"),
+]
+BLOCKED_COUNTER_KEY = "ip_gate_blocked_total"
+
+
+class GateStats:
+    """
+    Per-process blocked-request counters, flushed to the cache in aggregate.
+    """
+
+    def __init__(self, flush_interval=10, sample_rate=100):
+        self.flush_interval = flush_interval
+        self.sample_rate = max(1, sample_rate)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.total = 0
+        self._last_flush = time.monotonic()
+
+    def record(self, ip_address):
+        with self._lock:
+            self._pending += 1
+            self.total += 1
+            total = self.total
+            should_flush = time.monotonic() - self._last_flush >= self.flush_interval
+
+        if total % self.sample_rate == 1 or self.sample_rate == 1:
+            logger.warning(
+                f"Gate rejected blocked IP {ip_address} "
+                f"(sampled 1/{self.sample_rate}, {total} rejected by this worker)"
+            )
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            cache.add(BLOCKED_COUNTER_KEY, 0, None)
+            cache.incr(BLOCKED_COUNTER_KEY, pending)
+        except Exception as e:
+            logger.error(f"Failed to flush gate counters: {e}")
+
+
+gate_stats = GateStats(
+    flush_interval=getattr(settings, "IP_GATE_FLUSH_INTERVAL", 10),
+    sample_rate=getattr(settings, "IP_GATE_LOG_SAMPLE_RATE", 100),
+)
+
+
+def is_blocked(ip_address):
+    return bool(ip_address) and ip_address in blocked_ips
+
+
+class EarlyRejectMiddleware:
+    """
+    Reject blocked IPs before any other middleware runs.
+    Must be the first entry in MIDDLEWARE to save the session/auth/logging work.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        ip_address = get_client_ip(request.META)
+        if is_blocked(ip_address):
+            gate_stats.record(ip_address)
+            response = HttpResponse(BLOCKED_BODY, status=BLOCKED_STATUS)
+            for header, value in BLOCKED_HEADERS:
+                response.headers[header] = value
+            return response
+        return self.get_response(request)
+
+
+class EarlyRejectWSGIApp:
+    """
+    WSGI wrapper that answers blocked IPs with prebuilt bytes.
+    """
+
+    status_line = f"{BLOCKED_STATUS} Forbidden"
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        ip_address = get_client_ip(environ)
+        if is_blocked(ip_address):
+            gate_stats.record(ip_address)
+            start_response(self.status_line, list(BLOCKED_HEADERS))
+            return [BLOCKED_BODY]
+        return self.application(environ, start_response)
+
+
+class EarlyRejectASGIApp:
+    """
+    ASGI wrapper that answers blocked IPs with prebuilt bytes.
+    """
+
+    start_message = {
+        "type": "http.response.start",
+        "status": BLOCKED_STATUS,
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in BLOCKED_HEADERS
+        ],
+    }
+    body_message = {"type": "http.response.body", "body": BLOCKED_BODY}
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            if blocked_ips.needs_refresh():
+                await sync_to_async(blocked_ips.get)()
+            ip_address = get_client_ip_from_scope(scope)
+            if is_blocked(ip_address):
+                gate_stats.record(ip_address)
+                await send(self.start_message)
+                await send(self.body_message)
+                return
+        await self.application(scope, receive, send)
@@ -1,8 +1,13 @@
-from core.models import RequestLog, BlockedIP
+from core.models import RequestLog
+from core.ip_sets import blocked_ips
+from core.geolocation import geolocation_store
+from core.geolocation_providers import get_provider
+from core.ip_classifier import INVALID, LOOPBACK, PUBLIC, UNSPECIFIED, ip_classifier
+from core.load_shedding import logging_controller
+from core.heavy_hitters import heavy_hitters
+from core.cardinality import unique_visitors
 import logging 
-from django.core.cache import cache 
 from django.http import HttpResponse
-import requests
 import os
 from datetime import datetime
 import time  
@@ -46,9 +51,13 @@ class RequestLoggingMiddleware:
                 status=403
             )
         
-        self._log_request_with_geolocation(request, ip_address)
-
         response = self.get_response(request)
+
+        if ip_address:
+            # Constant-time sketch updates; kept even when logging is shed
+            heavy_hitters.record(ip_address, request.path)
+            unique_visitors.record(ip_address, path=request.path)
+        self._log_request_with_geolocation(request, ip_address, response.status_code)
         return response
 
     def _get_client_ip(self, request):
@@ -92,18 +101,15 @@ class RequestLoggingMiddleware:
     def is_ip_blocked(self, ip_address):
         """
         Check if the IP address is in the blocked list and active.
-        Uses database query to check for blocked IPs.
+        Uses the shared in-process blocklist snapshot instead of a query per request.
         """
         try:
-            return BlockedIP.objects.filter(
-                ip_address=ip_address,
-                is_active=True
-            ).exists()
+            return ip_address in blocked_ips
         except Exception as e:
             logger.error(f"Error checking blocked IPs: {e}")
             return False
 
-    def _log_request_with_geolocation(self, request, ip_address):
+    def _log_request_with_geolocation(self, request, ip_address, status_code=None):
         """"
         Log the request with geolocation data.
         uses caching to avoid repeated API calls for the same IP.
@@ -114,9 +120,21 @@ class RequestLoggingMiddleware:
         if not ip_address:
             return
 
+        # Under load the controller drops geolocation, then most rows, then all
+        if not logging_controller.should_log():
+            return
+
+        started = time.monotonic()
+        failed = False
         user_agent = request.META.get('HTTP_USER_AGENT', '')
-        
-        country, city = self._get_cached_geolocation(ip_address)
+
+        if logging_controller.use_geolocation():
+            country, city = self._get_cached_geolocation(ip_address)
+            if country not in ('Local', 'Private', 'Unknown', 'Error'):
+                unique_visitors.record_country(ip_address, country)
+        else:
+            # Left for the geolocation backfill task
+            country, city = 'Unknown', 'Unknown'
 
         try:
             RequestLog.objects.create(
@@ -125,7 +143,8 @@ class RequestLoggingMiddleware:
                 method=request.method,
                 user_agent=user_agent[:500],
                 country=country,
-                city=city
+                city=city,
+                status_code=status_code
             )
             self._log_to_file(ip_address, f"{country}, {city}", request.path, 
                             request.method, user_agent, 'ALLOWED')
@@ -133,95 +152,47 @@ class RequestLoggingMiddleware:
             logger.debug(f"Logged request from {ip_address} - {country}, {city}")
             
         except Exception as e:
+            failed = True
             logger.error(f"Failed to log request: {e}")
             self._log_to_file(ip_address, "Error,Error", request.path, 
                             request.method, user_agent, 'DB_ERROR')
+        finally:
+            logging_controller.observe(time.monotonic() - started, failed)
 
     def _get_cached_geolocation(self, ip_address):
         """
-        Get geolocation data for an IP address with 24-hour caching.
+        Get geolocation data for an IP address from the Redis cache (24 hours),
+        then the durable IPGeolocation table, then the provider.
         """
-        if not ip_address or ip_address in ['127.0.0.1', 'localhost', '::1']:
+        category = ip_classifier.classify(ip_address)
+        if category in (LOOPBACK, UNSPECIFIED, INVALID):
             return 'Local', 'Local'
-        
-        # FIX: Correct method name
-        if self._is_private_ip(ip_address):
+
+        # Private, link-local, CGNAT, documentation, reserved...: nothing to look up
+        if category != PUBLIC:
             return 'Private', 'Private'
         
-        cache_key = f"geolocation_{ip_address}"
-        cached_data = cache.get(cache_key)
+        cached_data = geolocation_store.get(ip_address)
 
         if cached_data:
             logger.debug(f"Using cached geolocation for {ip_address}")
-            logger.info(f"IP {ip_address}: USING CACHED DATA - Country: {cached_data.get('country')}, City: {cached_data.get('city')}")
+            logger.info(f"IP {ip_address}: USING CACHED DATA - Country: {cached_data[0]}, City: {cached_data[1]}")
             self.cache_stats['hits'] += 1  
             logger.info(f"CACHE HIT for {ip_address}. Stats: {self.cache_stats}")
-            return cached_data.get('country', 'Unknown'), cached_data.get('city', 'Unknown')
+            return cached_data
         else:
             self.cache_stats['misses'] += 1  # Track cache miss
             logger.info(f"CACHE MISS for {ip_address}. Stats: {self.cache_stats}")
 
         country, city = self._fetch_geolocation_ipinfo(ip_address)
 
-        cache.set(cache_key, {'country': country, 'city': city}, 86400)
+        geolocation_store.put(ip_address, country, city)
 
         return country, city 
     
-    def _is_private_ip(self, ip_address):
-        """
-        Check if the IP address is in a private range.
-        """
-        private_ranges = [
-            '10.', '192.168.', '172.16.', '172.17.', '172.18.', '172.19.',
-            '172.20.', '172.21.', '172.22.', '172.23.', '172.24.', '172.25.',
-            '172.26.', '172.27.', '172.28.', '172.29.', '172.30.', '172.31.'
-        ]
-        return any(ip_address.startswith(prefix) for prefix in private_ranges)
-    
     def _fetch_geolocation_ipinfo(self, ip_address):
-        """Fetch geolocation data using ipinfo.io API"""
-        try:
-            api_key = os.environ.get('IPINFO_API_KEY')
-            if api_key:
-                url = f"https://ipinfo.io/{ip_address}/json?token={api_key}"
-            else:
-                url = f"https://ipinfo.io/{ip_address}/json"
-                
-            response = requests.get(url, timeout=3)
-            response.raise_for_status()
-            data = response.json()
-
-            country = data.get('country', 'Unknown')
-            city = data.get('city', 'Unknown')
-
-            country = self._get_country_name(country)
-
-            logger.info(f"Fetched geolocation for {ip_address}: {country}, {city}")
-
-            return country, city
-        
-        except requests.exceptions.Timeout:
-            logger.warning(f"Geolocation API timeout for IP: {ip_address}")
-            return 'Unknown', 'Unknown'
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Geolocation API error for IP {ip_address}: {e}")
-            return 'Unknown', 'Unknown'
-        except Exception as e:
-            logger.error(f"Unexpected error fetching geolocation for {ip_address}: {e}")
-            return 'Unknown', 'Unknown'
-
-    def _get_country_name(self, country_code):
-        """
-        Convert country code to full country name.
-        You can expand this dictionary as needed.
-        """
-        country_map = {
-            'US': 'United States', 'GB': 'United Kingdom', 'CA': 'Canada',
-            'AU': 'Australia', 'DE': 'Germany', 'FR': 'France', 'JP': 'Japan',
-            'CN': 'China', 'IN': 'India', 'BR': 'Brazil', 'RU': 'Russia',
-            'NG': 'Nigeria', 'ZA': 'South Africa', 'EG': 'Egypt', 'KE': 'Kenya',
-        }
-        return country_map.get(country_code, country_code)
+        """Fetch geolocation data from the configured provider (ipinfo.io by default)"""
+        return get_provider().lookup(ip_address)
 
     def _log_to_file(self, ip_address, location, path, method, user_agent, status):
         """
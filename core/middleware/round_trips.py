@@ -0,0 +1,43 @@
+"""
+Counts each request's database queries and cache calls and checks them
+against ``ROUND_TRIP_BUDGETS``; see ``core.round_trips``. Goes right after
+EarlyRejectMiddleware, so the rest of the stack's round trips are counted
+while requests it turns away skip the counting altogether.
+"""
+import logging
+
+from django.conf import settings
+
+from core.round_trips import RoundTripBudgetExceeded, RoundTripBudgets, counting, round_trip_stats
+
+logger = logging.getLogger(__name__)
+
+UNRESOLVED = '<unresolved>'
+
+
+class RoundTripBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budgets = RoundTripBudgets(getattr(settings, 'ROUND_TRIP_BUDGETS', {}))
+        self.mode = getattr(settings, 'ROUND_TRIP_BUDGET_MODE', 'log')
+        self.sample_rate = max(1, getattr(settings, 'ROUND_TRIP_LOG_SAMPLE_RATE', 100))
+
+    def __call__(self, request):
+        with counting() as tally:
+            request.round_trips = tally
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name if match else None) or UNRESOLVED
+        violations = self.budgets.violations(route, tally)
+        over_budget = round_trip_stats.observe(route, tally, bool(violations))
+        if violations:
+            message = (
+                f"{request.method} {request.path} ({route}) went over its round-trip budget: "
+                f"{', '.join(violations)}; {tally.as_dict()}"
+            )
+            if self.mode == 'raise':
+                raise RoundTripBudgetExceeded(message)
+            if self.mode == 'log' and over_budget % self.sample_rate == 1 % self.sample_rate:
+                logger.warning(f"{message} [{over_budget} over budget so far]")
+        return response
@@ -0,0 +1,145 @@
+"""
+Graduated throttling for IPs flagged in ``SuspiciousIP``.
+
+The active suspicious set is held in an in-process snapshot (see
+``core.ip_sets.suspicious_ips``), so unflagged clients cost one dict lookup and
+no queries. Flagged clients get the policy for their ``reason`` from
+``SUSPICIOUS_IP_POLICIES``, or ``SUSPICIOUS_IP_DEFAULT_POLICY`` for a reason
+it does not list::
+
+    SUSPICIOUS_IP_POLICIES = {
+        'high_volume': {'rate': '30/m'},
+        'sensitive_paths': {'rate': '10/m', 'delay': 0.5},
+        'multiple_reasons': {'rate': '5/m', 'challenge': True},
+    }
+    SUSPICIOUS_IP_DEFAULT_POLICY = {'rate': '30/m'}
+
+* ``rate``: tighter per-IP limit, answered with 429 when exceeded
+* ``delay``: seconds to slow the client down by. Served async (ASGI with an
+  async stack below), the request is stalled with ``asyncio.sleep``. A sync
+  worker is never put to sleep: the client may send one request per
+  ``delay`` seconds (rounded up) and gets 429 with Retry-After in between.
+* ``challenge``: require a signed cookie; clients that do not keep cookies
+  never get past the challenge response
+"""
+import asyncio
+import logging
+import math
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.http import JsonResponse
+from django_ratelimit.core import get_usage
+
+from core.ip_sets import suspicious_ips
+from core.ip_utils import get_client_ip
+
+logger = logging.getLogger(__name__)
+
+CHALLENGE_COOKIE = "ip_challenge"
+CHALLENGE_SALT = "core.suspicious_throttle"
+MAX_DELAY = 5.0
+
+
+class SuspiciousIPThrottleMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.policies = getattr(settings, "SUSPICIOUS_IP_POLICIES", {})
+        self.default_policy = getattr(settings, "SUSPICIOUS_IP_DEFAULT_POLICY", None)
+        self.challenge_max_age = getattr(settings, "SUSPICIOUS_IP_CHALLENGE_MAX_AGE", 3600)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response, delay = self._apply_policy(request)
+        if response is None and delay > 0:
+            response = self._pace(request, delay)
+        if response is not None:
+            return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # The snapshot may reload from the database, so the checks run sync
+        response, delay = await sync_to_async(self._apply_policy)(request)
+        if response is not None:
+            return response
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await self.get_response(request)
+
+    def _apply_policy(self, request):
+        """(response to send instead, or None; seconds to delay the request by)."""
+        ip_address = get_client_ip(request.META)
+        reason = suspicious_ips.get().get(ip_address) if ip_address else None
+        policy = self.policies.get(reason, self.default_policy) if reason else None
+        if not policy:
+            return None, 0
+
+        if policy.get("challenge") and not self._passed_challenge(request, ip_address):
+            return self._challenge_response(ip_address), 0
+
+        rate = policy.get("rate")
+        if rate:
+            usage = get_usage(
+                request,
+                group=f"suspicious:{reason}",
+                key=lambda group, request: ip_address,
+                rate=rate,
+                increment=True,
+            )
+            if usage and usage["should_limit"]:
+                logger.info(f"Throttled suspicious IP {ip_address} ({reason})")
+                response = JsonResponse({
+                    'error': 'Too many requests',
+                    'message': 'You have exceeded the allowed number of requests.'
+                }, status=429)
+                response["Retry-After"] = str(max(usage["time_left"], 1))
+                return response, 0
+
+        return None, min(float(policy.get("delay", 0)), MAX_DELAY)
+
+    def _pace(self, request, delay):
+        """Let one request per ``delay`` seconds through; 429 for the rest."""
+        ip_address = get_client_ip(request.META)
+        spacing = math.ceil(delay)
+        if cache.add(f"suspicious_delay:{ip_address}", 1, spacing):
+            return None
+        response = JsonResponse({
+            'error': 'Too many requests',
+            'message': f'Wait {spacing}s between requests.'
+        }, status=429)
+        response["Retry-After"] = str(spacing)
+        return response
+
+    def _passed_challenge(self, request, ip_address):
+        token = request.COOKIES.get(CHALLENGE_COOKIE)
+        if not token:
+            return False
+        try:
+            value = signing.loads(token, salt=CHALLENGE_SALT, max_age=self.challenge_max_age)
+        except signing.BadSignature:
+            return False
+        return value == ip_address
+
+    def _challenge_response(self, ip_address):
+        response = JsonResponse({
+            'error': 'Challenge required',
+            'message': 'Retry the request with the cookie set by this response.'
+        }, status=429)
+        response["Retry-After"] = "1"
+        response.set_cookie(
+            CHALLENGE_COOKIE,
+            signing.dumps(ip_address, salt=CHALLENGE_SALT),
+            max_age=self.challenge_max_age,
+            httponly=True,
+            samesite="Lax",
+        )
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_alter_requestlog_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="requestlog",
+            index=models.Index(
+                fields=["timestamp", "id"], name="request_log_timesta_e35c9a_idx"
+            ),
+        ),
+    ]
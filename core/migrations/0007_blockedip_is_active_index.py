@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_requestlog_timestamp_id_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="blockedip",
+            index=models.Index(
+                fields=["is_active"], name="blocked_ips_is_acti_5aeb6c_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_blockedip_is_active_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="geohash",
+            field=models.CharField(blank=True, db_index=True, max_length=9),
+        ),
+    ]
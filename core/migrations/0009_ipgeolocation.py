@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_location_geohash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IPGeolocation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ip_address", models.GenericIPAddressField(unique=True)),
+                ("country", models.CharField(blank=True, max_length=255)),
+                ("city", models.CharField(blank=True, max_length=255)),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("provider", "Geolocation provider"),
+                            ("request_log", "Recovered from request logs"),
+                        ],
+                        default="provider",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "resolved_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "verbose_name": "IP geolocation",
+                "verbose_name_plural": "IP geolocations",
+                "db_table": "ip_geolocations",
+                "indexes": [
+                    models.Index(
+                        fields=["resolved_at"], name="ip_geolocat_resolve_ba3c1c_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_taskwatermark"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestPath",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("digest", models.BigIntegerField(unique=True)),
+                ("value", models.CharField(max_length=255)),
+            ],
+            options={
+                "db_table": "request_paths",
+            },
+        ),
+        migrations.CreateModel(
+            name="UserAgent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("digest", models.BigIntegerField(unique=True)),
+                ("value", models.TextField()),
+            ],
+            options={
+                "db_table": "user_agents",
+            },
+        ),
+        migrations.AddField(
+            model_name="requestlog",
+            name="path_ref",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="core.requestpath",
+            ),
+        ),
+        migrations.AddField(
+            model_name="requestlog",
+            name="user_agent_ref",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="core.useragent",
+            ),
+        ),
+    ]
@@ -0,0 +1,94 @@
+import hashlib
+import re
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 5000
+
+# Frozen copies of core.dimensions.digest and normalize_path as of this
+# migration, so later changes to those helpers cannot change what it writes
+_NUMERIC = re.compile(r"^\d+$")
+_OPAQUE_ID = re.compile(
+    r"^(?:[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}"
+    r"|[0-9a-fA-F]{16,})$"
+)
+ID_PLACEHOLDER = ":id"
+
+
+def digest(value):
+    """Signed 64-bit BLAKE2 digest of ``value``, the lookup key of a dimension row."""
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big", signed=True
+    )
+
+
+def normalize_path(path):
+    """Route of a request path: query string dropped, id segments replaced with ':id'."""
+    path = (path or "").split("?", 1)[0].split("#", 1)[0]
+    segments = [
+        ID_PLACEHOLDER if _NUMERIC.match(segment) or _OPAQUE_ID.match(segment) else segment
+        for segment in path.split("/")
+    ]
+    return "/".join(segments)[:255]
+
+
+def intern(manager, values):
+    """{value: id} for ``values``, inserting the rows that are missing."""
+    by_digest = {digest(value): value for value in values}
+    manager.bulk_create(
+        [manager.model(digest=key, value=value) for key, value in by_digest.items()],
+        ignore_conflicts=True,
+    )
+    rows = manager.filter(digest__in=list(by_digest)).values_list("id", "digest", "value")
+    return {value: pk for pk, key, value in rows if by_digest.get(key) == value}
+
+
+def backfill(apps, schema_editor):
+    """
+    Point every RequestLog row at its UserAgent and RequestPath, one id
+    range of BATCH_SIZE rows per transaction.
+    """
+    alias = schema_editor.connection.alias
+    RequestLog = apps.get_model("core", "RequestLog")
+    agents = apps.get_model("core", "UserAgent").objects.using(alias)
+    paths = apps.get_model("core", "RequestPath").objects.using(alias)
+    logs = RequestLog.objects.using(alias)
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=alias):
+            rows = list(
+                logs.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "path", "user_agent")[:BATCH_SIZE]
+            )
+            if not rows:
+                return
+            agent_ids = intern(agents, {agent or "" for _, _, agent in rows})
+            path_ids = intern(paths, {normalize_path(path) for _, path, _ in rows})
+            # One UPDATE per distinct value; each touches only its own rows
+            by_agent, by_path = {}, {}
+            for pk, path, agent in rows:
+                by_agent.setdefault(agent_ids.get(agent or ""), []).append(pk)
+                by_path.setdefault(path_ids.get(normalize_path(path)), []).append(pk)
+            for agent_id, ids in by_agent.items():
+                logs.filter(id__in=ids).update(user_agent_ref_id=agent_id)
+            for path_id, ids in by_path.items():
+                logs.filter(id__in=ids).update(path_ref_id=path_id)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("core", "0011_request_dimensions"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill,
+            migrations.RunPython.noop,
+            hints={"model_name": "requestlog"},
+        ),
+    ]
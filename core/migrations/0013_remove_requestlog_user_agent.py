@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_backfill_request_dimensions"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="requestlog",
+            name="request_log_path_5a9834_idx",
+        ),
+        migrations.RemoveField(
+            model_name="requestlog",
+            name="user_agent",
+        ),
+    ]
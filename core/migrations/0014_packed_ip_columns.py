@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:05
+
+import core.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_remove_requestlog_user_agent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockedip",
+            name="ip",
+            field=core.fields.PackedIPField(null=True, source="ip_address"),
+        ),
+        migrations.AddField(
+            model_name="blockedip",
+            name="ip_version",
+            field=core.fields.IPVersionField(null=True, source="ip_address"),
+        ),
+        migrations.AddField(
+            model_name="requestlog",
+            name="ip",
+            field=core.fields.PackedIPField(null=True, source="ip_address"),
+        ),
+        migrations.AddField(
+            model_name="requestlog",
+            name="ip_version",
+            field=core.fields.IPVersionField(null=True, source="ip_address"),
+        ),
+        migrations.AddField(
+            model_name="suspiciousip",
+            name="ip",
+            field=core.fields.PackedIPField(null=True, source="ip_address"),
+        ),
+        migrations.AddField(
+            model_name="suspiciousip",
+            name="ip_version",
+            field=core.fields.IPVersionField(null=True, source="ip_address"),
+        ),
+    ]
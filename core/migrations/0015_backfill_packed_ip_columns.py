@@ -0,0 +1,101 @@
+import socket
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 5000
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+
+
+# Frozen copies of core.ip_classifier.parse and core.fields.pack_ip as of this
+# migration, so later changes to those helpers cannot change what it writes
+
+
+def parse_ip(ip_address):
+    """(version, integer) for a textual address, or None when it is not one."""
+    if not ip_address:
+        return None
+    try:
+        if ":" in ip_address:
+            return 6, int.from_bytes(
+                socket.inet_pton(socket.AF_INET6, ip_address.split("%", 1)[0]), "big"
+            )
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), "big")
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def pack_ip(ip_address):
+    """16-byte sortable form of ``ip_address``, or None when it is not an address."""
+    parsed = parse_ip(ip_address)
+    if parsed is None:
+        return None
+    version, value = parsed
+    if version == 4:
+        value |= IPV4_MAPPED_PREFIX
+    return value.to_bytes(16, "big")
+
+
+def backfill_model(model_name):
+    def backfill(apps, schema_editor):
+        """Fill ip/ip_version one id range of BATCH_SIZE rows per transaction."""
+        alias = schema_editor.connection.alias
+        rows = apps.get_model("core", model_name).objects.using(alias)
+
+        last_id = 0
+        while True:
+            with transaction.atomic(using=alias):
+                batch = list(
+                    rows.filter(id__gt=last_id, ip__isnull=True)
+                    .order_by("id")
+                    .values_list("id", "ip_address")[:BATCH_SIZE]
+                )
+                if not batch:
+                    return
+                # One UPDATE per distinct address in the batch
+                by_address = {}
+                for pk, ip_address in batch:
+                    by_address.setdefault(ip_address, []).append(pk)
+                for ip_address, ids in by_address.items():
+                    parsed = parse_ip(ip_address)
+                    rows.filter(id__in=ids).update(
+                        ip=pack_ip(ip_address), ip_version=parsed[0] if parsed else None
+                    )
+            last_id = batch[-1][0]
+
+    return backfill
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("core", "0014_packed_ip_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_model(model_name),
+            migrations.RunPython.noop,
+            hints={"model_name": model_name.lower()},
+        )
+        for model_name in ["RequestLog", "BlockedIP", "SuspiciousIP"]
+    ] + [
+        migrations.AddIndex(
+            model_name="blockedip",
+            index=models.Index(
+                fields=["ip", "created_at"], name="blocked_ips_ip_b38074_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="requestlog",
+            index=models.Index(
+                fields=["ip", "timestamp"], name="request_log_ip_5d4fc0_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="suspiciousip",
+            index=models.Index(
+                fields=["ip", "detected_at"], name="suspicious__ip_339843_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:08
+
+import core.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0015_backfill_packed_ip_columns"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SuspiciousNetwork",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("network", models.CharField(max_length=43, unique=True)),
+                ("network_address", models.GenericIPAddressField()),
+                ("prefix_length", models.PositiveSmallIntegerField()),
+                ("ip", core.fields.PackedIPField(null=True, source="network_address")),
+                (
+                    "ip_version",
+                    core.fields.IPVersionField(null=True, source="network_address"),
+                ),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            (
+                                "network_volume",
+                                "High request volume across the network",
+                            ),
+                            (
+                                "network_sensitive_paths",
+                                "Sensitive paths probed across the network",
+                            ),
+                            ("multiple_reasons", "Multiple suspicious activities"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                ("detected_at", models.DateTimeField(auto_now_add=True)),
+                ("is_active", models.BooleanField(default=True)),
+                ("details", models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                "verbose_name": "Suspicious network",
+                "verbose_name_plural": "Suspicious networks",
+                "db_table": "suspicious_networks",
+                "ordering": ["-detected_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["detected_at"], name="suspicious__detecte_dcc526_idx"
+                    ),
+                    models.Index(
+                        fields=["ip", "prefix_length"], name="suspicious__ip_724cbe_idx"
+                    ),
+                    models.Index(
+                        fields=["is_active"], name="suspicious__is_acti_ae38bd_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0016_suspicious_network"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="suspiciousip",
+            name="reason",
+            field=models.CharField(
+                choices=[
+                    ("high_volume", "High request volume (>100/hour)"),
+                    ("sensitive_paths", "Accessing sensitive paths"),
+                    ("path_diversity", "Requesting many distinct paths"),
+                    ("error_ratio", "High ratio of 4xx responses"),
+                    ("burst", "Request bursts"),
+                    ("path_scan", "Failing requests to a widely scanned route"),
+                    ("multiple_reasons", "Multiple suspicious activities"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
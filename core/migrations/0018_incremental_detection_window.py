@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0017_path_scan_reason"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IPWindowAggregate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ip_address", models.GenericIPAddressField(unique=True)),
+                ("requests", models.PositiveIntegerField(default=0)),
+                ("sensitive_requests", models.PositiveIntegerField(default=0)),
+                ("sensitive_paths", models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                "db_table": "ip_window_aggregates",
+            },
+        ),
+        migrations.AddField(
+            model_name="taskwatermark",
+            name="window_end",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="taskwatermark",
+            name="window_start",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
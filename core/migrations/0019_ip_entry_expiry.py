@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0018_incremental_detection_window"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockedip",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="blockedip",
+            name="offense_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="suspiciousip",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="suspiciousip",
+            name="offense_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name="blockedip",
+            index=models.Index(
+                fields=["is_active", "expires_at"],
+                name="blocked_ips_is_acti_f78f89_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="suspiciousip",
+            index=models.Index(
+                fields=["is_active", "expires_at"],
+                name="suspicious__is_acti_503285_idx",
+            ),
+        ),
+    ]
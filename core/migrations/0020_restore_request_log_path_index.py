@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0019_ip_entry_expiry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="requestlog",
+            index=models.Index(fields=["path"], name="request_log_path_5a9834_idx"),
+        ),
+    ]
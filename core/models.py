@@ -1,69 +1,246 @@
+import ipaddress
+
 from django.db import models
+from django.utils import timezone
+
+from . import expiry, geo
+from .fields import IPVersionField, PackedIPField
+from .ip_sets import blocked_ips
 from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     pass 
 
+class LocationQuerySet(models.QuerySet):
+    def within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Locations inside the box. The geohash prefixes narrow the search to a
+        few index ranges before the exact latitude/longitude comparison.
+        """
+        cells = geo.covering_cells(min_lat, min_lon, max_lat, max_lon)
+        queryset = self
+        if cells:
+            # Prefix match written as a range so every backend uses the index
+            # ('{' sorts right after 'z', the last geohash character)
+            prefixes = models.Q()
+            for cell in cells:
+                prefixes |= models.Q(geohash__gte=cell, geohash__lt=cell + '{')
+            queryset = queryset.filter(prefixes)
+
+        queryset = queryset.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+        if min_lon <= max_lon:
+            return queryset.filter(longitude__gte=min_lon, longitude__lte=max_lon)
+        return queryset.filter(models.Q(longitude__gte=min_lon) | models.Q(longitude__lte=max_lon))
+
+    def near(self, latitude, longitude, radius_km):
+        """
+        Locations within ``radius_km`` of the point, closest first, each with
+        a ``distance_km`` attribute.
+        """
+        candidates = self.within_bbox(*geo.radius_bbox(latitude, longitude, radius_km))
+        results = []
+        for location in candidates:
+            distance = geo.haversine_km(latitude, longitude, location.latitude, location.longitude)
+            if distance <= radius_km:
+                location.distance_km = distance
+                results.append(location)
+        results.sort(key=lambda location: location.distance_km)
+        return results
+
+
 class Location(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE,related_name='location')
     latitude = models.DecimalField(max_digits=12, decimal_places=6)
     longitude = models.DecimalField(max_digits=12,decimal_places=6)
+    geohash = models.CharField(max_length=geo.GEOHASH_PRECISION, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = LocationQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.username}'s location "
+
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
     
 
+class UserAgent(models.Model):
+    """Distinct User-Agent header value, referenced by RequestLog."""
+    digest = models.BigIntegerField(unique=True)
+    value = models.TextField()
+
+    class Meta:
+        db_table = 'user_agents'
+
+    def __str__(self):
+        return self.value
+
+
+class RequestPath(models.Model):
+    """Normalized route (ids replaced with ':id'), referenced by RequestLog."""
+    digest = models.BigIntegerField(unique=True)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        db_table = 'request_paths'
+
+    def __str__(self):
+        return self.value
+
+
+class RequestLogQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        from .dimensions import intern_request_logs
+
+        objs = list(objs)
+        intern_request_logs(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class RequestLog(models.Model):
     ip_address = models.GenericIPAddressField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    ip = PackedIPField(null=True)
+    ip_version = IPVersionField(null=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # The path as requested. path_ref is its normalized route, which folds
+    # ids into ':id': path_diversity needs the exact paths to see id
+    # enumeration, and exports and archives keep them for forensics.
     path = models.CharField(max_length=255)
+    path_ref = models.ForeignKey(
+        RequestPath, on_delete=models.PROTECT, null=True, blank=True, related_name='+'
+    )
     method = models.CharField(max_length=10,default='GET')
-    user_agent = models.TextField(blank=True, null=True)
+    user_agent_ref = models.ForeignKey(
+        UserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='+', db_index=False
+    )
     country = models.CharField(max_length=255, blank=True)
     city = models.CharField(max_length=255, blank=True)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    objects = RequestLogQuerySet.as_manager()
+
+    # Set through ``user_agent``; turned into user_agent_ref when saved
+    pending_user_agent = None
+
     class Meta:
         db_table = 'request_logs'
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['ip_address']),
-            models.Index(fields=['timestamp']),
             models.Index(fields=['path']),
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['timestamp', 'id']),
+            models.Index(fields=['ip', 'timestamp']),
         ]
 
     def __str__(self):
         return f"{self.ip_address} - {self.path} - {self.timestamp}"
+
+    @property
+    def user_agent(self):
+        # A query per row unless user_agent_ref was selected with it: lists
+        # use select_related('user_agent_ref') or values('user_agent_ref__value')
+        if self.pending_user_agent is not None:
+            return self.pending_user_agent
+        return self.user_agent_ref.value if self.user_agent_ref_id else ''
+
+    @user_agent.setter
+    def user_agent(self, value):
+        self.pending_user_agent = value
+        self.user_agent_ref = None
+
+    def save(self, *args, **kwargs):
+        from .dimensions import intern_request_logs
+
+        intern_request_logs([self])
+        super().save(*args, **kwargs)
     
 class BlockedIP(models.Model):
     ip_address = models.GenericIPAddressField(unique=True)
+    ip = PackedIPField(null=True)
+    ip_version = IPVersionField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     reason = models.TextField(blank=True, null=True)
 
     is_active = models.BooleanField(default=True)  
+    expires_at = models.DateTimeField(null=True, blank=True)
+    offense_count = models.PositiveIntegerField(default=1)
 
     class Meta:
         db_table = 'blocked_ips'
         verbose_name = 'Blocked IP'
         verbose_name_plural = 'Blocked IPs'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active']),
+            models.Index(fields=['ip', 'created_at']),
+            models.Index(fields=['is_active', 'expires_at']),
+        ]
 
     def __str__(self): 
          
         status = "Active" if self.is_active else "Inactive"
         return f"{self.ip_address} - {status} - {self.created_at}"
+
+    @classmethod
+    def block_many(cls, ip_addresses, reason=None, ttl=None):
+        """
+        Block (or re-activate) many IPs with one upsert. ``ttl`` is in
+        seconds, None for ``BLOCKED_IP_TTL`` and 0 to never expire; IPs that
+        were blocked before get it escalated (see ``core.expiry``).
+        """
+        ip_addresses = set(ip_addresses)
+        ttl = expiry.blocked_ip_ttl() if ttl is None else ttl or None
+        existing = expiry.existing_entries(cls, ip_addresses)
+        now = timezone.now()
+        rows = []
+        for ip in ip_addresses:
+            offense_count, expires_at = expiry.next_expiry(existing.get(ip), ttl, now)
+            rows.append(cls(
+                ip_address=ip, reason=reason, is_active=True,
+                expires_at=expires_at, offense_count=offense_count,
+            ))
+        cls.objects.bulk_create(
+            rows,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['ip_address'],
+            update_fields=['is_active', 'reason', 'expires_at', 'offense_count'],
+        )
+        blocked_ips.invalidate()
+        return len(rows)
+
+    @classmethod
+    def unblock_many(cls, ip_addresses):
+        """Deactivate many IPs with one UPDATE."""
+        updated = cls.objects.filter(ip_address__in=list(set(ip_addresses)), is_active=True).update(is_active=False)
+        blocked_ips.invalidate()
+        return updated
 class SuspiciousIP(models.Model):
     REASON_CHOICES = [
         ('high_volume', 'High request volume (>100/hour)'),
         ('sensitive_paths', 'Accessing sensitive paths'),
+        ('path_diversity', 'Requesting many distinct paths'),
+        ('error_ratio', 'High ratio of 4xx responses'),
+        ('burst', 'Request bursts'),
+        ('path_scan', 'Failing requests to a widely scanned route'),
         ('multiple_reasons', 'Multiple suspicious activities'),
     ]
     
     ip_address = models.GenericIPAddressField(unique=True)
+    ip = PackedIPField(null=True)
+    ip_version = IPVersionField(null=True)
     reason = models.CharField(max_length=20, choices=REASON_CHOICES)
     detected_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     details = models.JSONField(default=dict, blank=True) 
+    expires_at = models.DateTimeField(null=True, blank=True)
+    offense_count = models.PositiveIntegerField(default=1)
     
     class Meta:
         db_table = 'suspicious_ips'
@@ -73,7 +250,9 @@ class SuspiciousIP(models.Model):
         indexes = [
             models.Index(fields=['ip_address']),
             models.Index(fields=['detected_at']),
+            models.Index(fields=['ip', 'detected_at']),
             models.Index(fields=['is_active']),
+            models.Index(fields=['is_active', 'expires_at']),
         ]
         
     def __str__(self):
@@ -83,5 +262,122 @@ class SuspiciousIP(models.Model):
     @classmethod
     def is_suspicious(cls, ip_address):
         """Check if an IP is currently flagged as suspicious"""
-        return cls.objects.filter(ip_address=ip_address, is_active=True).exists()
-    
\ No newline at end of file
+        return cls.objects.filter(expiry.unexpired(), ip_address=ip_address, is_active=True).exists()
+    
+
+class SuspiciousNetwork(models.Model):
+    """
+    A whole IPv4/IPv6 network flagged by a network detection rule, e.g. a
+    botnet spread over a /24 or rotating addresses inside one /64.
+    """
+    REASON_CHOICES = [
+        ('network_volume', 'High request volume across the network'),
+        ('network_sensitive_paths', 'Sensitive paths probed across the network'),
+        ('multiple_reasons', 'Multiple suspicious activities'),
+    ]
+
+    network = models.CharField(max_length=43, unique=True)
+    network_address = models.GenericIPAddressField()
+    prefix_length = models.PositiveSmallIntegerField()
+    ip = PackedIPField(source='network_address', null=True)
+    ip_version = IPVersionField(source='network_address', null=True)
+    reason = models.CharField(max_length=30, choices=REASON_CHOICES)
+    detected_at = models.DateTimeField(auto_now_add=True)
+    is_active = models.BooleanField(default=True)
+    details = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        db_table = 'suspicious_networks'
+        verbose_name = 'Suspicious network'
+        verbose_name_plural = 'Suspicious networks'
+        ordering = ['-detected_at']
+        indexes = [
+            models.Index(fields=['detected_at']),
+            models.Index(fields=['ip', 'prefix_length']),
+            models.Index(fields=['is_active']),
+        ]
+
+    def __str__(self):
+        status = "Active" if self.is_active else "Inactive"
+        return f"{self.network} - {self.get_reason_display()} - {status}"
+
+    @staticmethod
+    def networks_of(ip_address):
+        """Every network (one per prefix length) that contains ``ip_address``."""
+        address = ipaddress.ip_address(ip_address)
+        return [
+            str(ipaddress.ip_network((address, prefix_length), strict=False))
+            for prefix_length in range(address.max_prefixlen + 1)
+        ]
+
+    @classmethod
+    def containing(cls, ip_address):
+        """Active flagged networks that contain ``ip_address``, one indexed lookup."""
+        return cls.objects.filter(network__in=cls.networks_of(ip_address), is_active=True)
+
+
+class IPGeolocation(models.Model):
+    """
+    Durable tier of the geolocation cache: resolved locations outlive
+    Redis flushes and restarts.
+    """
+    SOURCE_CHOICES = [
+        ('provider', 'Geolocation provider'),
+        ('request_log', 'Recovered from request logs'),
+    ]
+
+    ip_address = models.GenericIPAddressField(unique=True)
+    country = models.CharField(max_length=255, blank=True)
+    city = models.CharField(max_length=255, blank=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='provider')
+    resolved_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'ip_geolocations'
+        verbose_name = 'IP geolocation'
+        verbose_name_plural = 'IP geolocations'
+        indexes = [
+            models.Index(fields=['resolved_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.ip_address} - {self.country}, {self.city}"
+
+
+class TaskWatermark(models.Model):
+    """
+    Resume point of a batched background job: the last RequestLog id it has
+    fully processed. Lets an interrupted run continue where it stopped.
+    Jobs that keep state over a sliding time window also record the window
+    that state covers.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    window_start = models.DateTimeField(null=True, blank=True)
+    window_end = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'task_watermarks'
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class IPWindowAggregate(models.Model):
+    """
+    Per-IP detection aggregates over the current detection window, kept up
+    to date incrementally by ``core.incremental_detection``.
+    ``sensitive_paths`` maps each sensitive path to its request count, so
+    requests leaving the window can be subtracted.
+    """
+    ip_address = models.GenericIPAddressField(unique=True)
+    requests = models.PositiveIntegerField(default=0)
+    sensitive_requests = models.PositiveIntegerField(default=0)
+    sensitive_paths = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        db_table = 'ip_window_aggregates'
+
+    def __str__(self):
+        return f"{self.ip_address}: {self.requests} requests"
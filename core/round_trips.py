@@ -0,0 +1,194 @@
+"""
+Per-request database and cache round trips, checked against budgets.
+
+RoundTripBudgetMiddleware opens a ``RoundTrips`` tally for each request in
+a context variable and exposes it as ``request.round_trips``. Two hooks
+add to whichever tally is open:
+
+* an execute wrapper on every database connection: one per query, by alias
+* wrappers on every cache instance's operations (get, set, incr, ...): one
+  per call, by operation; calls a backend makes internally (get_many
+  looping over get) count once
+
+Raw Redis clients from ``get_redis_connection`` are not counted.
+
+``ROUND_TRIP_BUDGETS`` maps URL names ('*' for any other route) to the
+most queries and cache operations a request may make. A request over
+budget:
+
+* ``ROUND_TRIP_BUDGET_MODE = 'raise'`` raises RoundTripBudgetExceeded, so
+  the test client fails the test that made it
+* ``'log'`` logs a warning for 1 in ``ROUND_TRIP_LOG_SAMPLE_RATE`` of them
+* ``'off'`` only counts it
+
+Per-route totals, maxima and over-budget counts are kept in process by
+``round_trip_stats`` and served at /round-trips/ to staff.
+"""
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+CACHE_OPERATIONS = [
+    'add', 'get', 'set', 'touch', 'delete', 'get_many', 'get_or_set', 'has_key',
+    'incr', 'decr', 'set_many', 'delete_many', 'clear',
+]
+
+_current = ContextVar('round_trips', default=None)
+_in_cache_call = ContextVar('round_trips_in_cache_call', default=False)
+
+
+class RoundTripBudgetExceeded(Exception):
+    pass
+
+
+class RoundTrips:
+    """Queries by database alias and cache calls by operation for one request."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.cache = Counter()
+
+    @property
+    def total_queries(self):
+        return sum(self.queries.values())
+
+    @property
+    def total_cache(self):
+        return sum(self.cache.values())
+
+    def as_dict(self):
+        return {
+            'queries': self.total_queries,
+            'cache': self.total_cache,
+            'queries_by_alias': dict(self.queries),
+            'cache_by_operation': dict(self.cache),
+        }
+
+
+def count_query(execute, sql, params, many, context):
+    tally = _current.get()
+    if tally is not None:
+        tally.queries[context['connection'].alias] += 1
+    return execute(sql, params, many, context)
+
+
+def _counted(operation, method):
+    def wrapper(*args, **kwargs):
+        tally = _current.get()
+        if tally is None or _in_cache_call.get():
+            return method(*args, **kwargs)
+        tally.cache[operation] += 1
+        token = _in_cache_call.set(True)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _in_cache_call.reset(token)
+
+    return wrapper
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install_cache_counter(backend):
+    if getattr(backend, '_round_trips_counted', False):
+        return
+    for operation in CACHE_OPERATIONS:
+        setattr(backend, operation, _counted(operation, getattr(backend, operation)))
+    backend._round_trips_counted = True
+
+
+def install():
+    """Hook the connections and caches of the current thread; cheap to repeat."""
+    for connection in connections.all(initialized_only=True):
+        install_query_counter(connection=connection)
+    for alias in caches.settings:
+        install_cache_counter(caches[alias])
+
+
+connection_created.connect(install_query_counter)
+
+
+class counting:
+    """Context manager: tally the round trips made inside it. Yields the RoundTrips."""
+
+    def __enter__(self):
+        install()
+        self.tally = RoundTrips()
+        self._token = _current.set(self.tally)
+        return self.tally
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+
+class RoundTripBudgets:
+    def __init__(self, budgets=None):
+        self.budgets = budgets or {}
+
+    def budget_for(self, route):
+        return self.budgets.get(route, self.budgets.get('*'))
+
+    def violations(self, route, tally):
+        """['queries 5 > 3', ...] for each limit of ``route``'s budget that ``tally`` went over."""
+        budget = self.budget_for(route)
+        if not budget:
+            return []
+        used = {'queries': tally.total_queries, 'cache': tally.total_cache}
+        return [
+            f"{kind} {used[kind]} > {budget[kind]}"
+            for kind in ('queries', 'cache')
+            if kind in budget and used[kind] > budget[kind]
+        ]
+
+
+class RoundTripStats:
+    """Per-route totals for /round-trips/."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+
+    def observe(self, route, tally, over_budget):
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {
+                    'requests': 0, 'queries': 0, 'cache': 0,
+                    'max_queries': 0, 'max_cache': 0, 'over_budget': 0,
+                }
+            queries, cache_calls = tally.total_queries, tally.total_cache
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['cache'] += cache_calls
+            stats['max_queries'] = max(stats['max_queries'], queries)
+            stats['max_cache'] = max(stats['max_cache'], cache_calls)
+            stats['over_budget'] += over_budget
+            return stats['over_budget']
+
+    def metrics(self):
+        with self._lock:
+            return {
+                route: {
+                    **stats,
+                    'queries_per_request': round(stats['queries'] / stats['requests'], 2),
+                    'cache_per_request': round(stats['cache'] / stats['requests'], 2),
+                }
+                for route, stats in sorted(self.routes.items())
+            }
+
+
+round_trip_stats = RoundTripStats()
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .ip_sets import blocked_ips, suspicious_ips
+from .models import BlockedIP, SuspiciousIP
+
+
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+def refresh_blocked_ips(sender, **kwargs):
+    """Make every worker reload its blocked IP snapshot."""
+    blocked_ips.invalidate()
+
+
+@receiver(post_save, sender=SuspiciousIP)
+@receiver(post_delete, sender=SuspiciousIP)
+def refresh_suspicious_ips(sender, **kwargs):
+    """Make every worker reload its suspicious IP snapshot."""
+    suspicious_ips.invalidate()
@@ -1,154 +1,357 @@
-from .models import RequestLog, SuspiciousIP, BlockedIP
+from .models import RequestLog, SuspiciousIP, SuspiciousNetwork, BlockedIP
+from .ip_sets import suspicious_ips
+from .db_routers import detection_database
+from .ip_classifier import ip_classifier
+from .expiry import existing_entries, next_expiry, suspicious_ip_ttl, unexpired
+from django.conf import settings
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.db.models import Count, Q
 import logging
 
 logger = logging.getLogger(__name__)
-from celery import shared_task
+from celery import shared_task, chord, group
+
+HIGH_VOLUME_THRESHOLD = 100
+
+SENSITIVE_PATHS = [
+    '/admin/', '/login/', '/wp-admin/', '/phpmyadmin/',
+    '/.env', '/config/', '/api/auth/', '/api/login/',
+    '/user/login/', '/account/login/', '/signin/',
+    '/administrator/', '/backend/', '/dashboard/'
+]
+
+
+def sensitive_path_query():
+    query = Q()
+    for path in SENSITIVE_PATHS:
+        query |= Q(path__startswith=path)
+    return query
+
+
+def detection_window_end(now=None):
+    """
+    The last ``DETECTION_INTERVAL_MINUTES`` boundary (counted from midnight
+    UTC) at or before ``now``: where a scheduled detection window ends.
+    """
+    now = now or timezone.now()
+    interval = timedelta(minutes=getattr(settings, 'DETECTION_INTERVAL_MINUTES', 60))
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + (now - midnight) // interval * interval
 
 
 @shared_task
-def detect_suspicious_ips():
+def detect_suspicious_ips(shards=None, rebuild=False, scheduled=False):
     """
     Celery task to detect suspicious IPs based on:
     - IPs with >100 requests in the last hour
     - IPs accessing sensitive paths (/admin, /login, etc.)
+
+    The hour is split into ``shards`` time slices that are aggregated in parallel
+    by ``detect_suspicious_ips_shard``; ``merge_detection_shards`` merges the
+    partial aggregates and upserts SuspiciousIP in bulk.
+
+    With ``DETECTION_ENGINE = 'columnar'`` the window is loaded once into the
+    columnar engine instead and every rule in ``DETECTION_RULES`` is applied.
+
+    With ``DETECTION_INCREMENTAL`` (the default) the sharded engine folds only
+    the rows since the last run into the stored window aggregates instead of
+    rescanning the hour; see ``core.incremental_detection``. ``rebuild``
+    recomputes those aggregates from scratch. The time-slice fan-out is then
+    opt-in: set ``DETECTION_INCREMENTAL = False`` to use it for every run
+    (with ``DETECTION_SHARDS`` slices), or pass ``shards`` for this one.
+
+    Either way the per-IP counts are also rolled up into the networks of
+    ``NETWORK_DETECTION_RULES`` and flagged as SuspiciousNetwork.
+
+    The hour ends now, or for ``scheduled`` (beat) runs at the last
+    ``DETECTION_INTERVAL_MINUTES`` boundary, so the windows of consecutive
+    runs are whole intervals apart whatever the beat's jitter.
     """
 
     logger.info("Starting suspicious IP detection task")
 
-    one_hour_ago = timezone.now() - timedelta(hours = 1)
-    high_volume_ips = detect_high_volume_ips(one_hour_ago)
-    sensitive_path_ips = detect_sensitive_path_access(one_hour_ago)
-    logger.info(f"High volume IPs flagged: {high_volume_ips}")
-    logger.info(f"Sensitive path IPs flagged: {sensitive_path_ips}")
+    window_end = detection_window_end() if scheduled else timezone.now()
+    window_start = window_end - timedelta(hours=1)
+
+    if getattr(settings, 'DETECTION_ENGINE', 'sharded') == 'columnar':
+        from .detection import DetectionEngine
+
+        findings, network_findings = DetectionEngine().run_with_networks(window_start, window_end)
+        flag_suspicious_networks(network_findings)
+        return flag_suspicious_ips(findings)
+
+    if getattr(settings, 'DETECTION_INCREMENTAL', True) and not shards:
+        from .incremental_detection import run_incremental_detection
+
+        return run_incremental_detection(window_end, rebuild=rebuild)
+
+    shards = shards or getattr(settings, 'DETECTION_SHARDS', 1)
+
+    header = group(
+        detect_suspicious_ips_shard.s(start.isoformat(), end.isoformat())
+        for start, end in time_slices(window_start, window_end, shards)
+    )
+    return chord(header)(merge_detection_shards.s()).id
+
+
+@shared_task
+def detect_suspicious_ips_shard(start, end):
+    """Compute partial per-IP aggregates for one time slice."""
+    return aggregate_time_slice(datetime.fromisoformat(start), datetime.fromisoformat(end))
+
+
+@shared_task
+def merge_detection_shards(partials):
+    """Merge shard aggregates and flag suspicious IPs."""
+    merged = merge_partials(partials)
+    flagged = flag_suspicious_ips(evaluate_aggregates(merged))
+    networks = flag_suspicious_networks(evaluate_network_aggregates(merged))
+    logger.info(f"Detection merged {len(partials)} shards, flagged {flagged} IPs and {networks} networks")
+    return flagged
+
+
+@shared_task
+def warm_geolocation_cache(limit=1000, days=7):
+    """Preload the busiest recent IPs into the geolocation cache tiers."""
+    from .geolocation import warm_geolocations
+
+    return warm_geolocations(limit=limit, days=days)
+
+
+@shared_task
+def backfill_geolocation(batch_size=None, max_batches=None, restart=False):
+    """Resolve RequestLog rows stored as Unknown/Error, resuming from the last watermark."""
+    from .geolocation import backfill_request_logs
+
+    return backfill_request_logs(
+        batch_size=batch_size or getattr(settings, 'GEOLOCATION_BACKFILL_BATCH_SIZE', 1000),
+        max_batches=max_batches,
+        restart=restart,
+    )
+
+
+@shared_task
+def sweep_expired_ips(batch_size=None):
+    """Deactivate expired SuspiciousIP/BlockedIP entries and delete long-expired ones."""
+    from .expiry import sweep_expired_ips as sweep
+
+    return sweep(batch_size=batch_size)
+
+
+@shared_task
+def archive_request_logs(older_than_days=None):
+    """Move request logs past the retention window into the cold archive."""
+    from .archive import archive_request_logs as archive
+
+    return archive(older_than_days=older_than_days)
 
 
-def detect_high_volume_ips(one_hour_ago):
+def time_slices(start, end, shards):
+    """Split [start, end) into ``shards`` contiguous, non-overlapping slices."""
+    shards = max(1, int(shards))
+    step = (end - start) / shards
+    bounds = [start + step * i for i in range(shards)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def aggregate_time_slice(start, end):
     """
-    Detect IPs with more than 100 requests in the last hour
+    Partial aggregates for requests in [start, end), keyed by IP:
+    total requests, sensitive-path requests and the distinct sensitive paths.
+    The partials of disjoint slices can be merged with ``merge_partials``.
     """
-    try:
-        high_volume_ips = (
-            RequestLog.objects
-            .filter(timestamp__gte=one_hour_ago)
-            .values('ip_address')
-            .annotate(request_count=Count('id'))
-            .filter(request_count__gt=100)
-            .order_by('-request_count')
+    window = (
+        RequestLog.objects.using(detection_database())
+        .filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by()
+    )
+    sensitive = sensitive_path_query()
+
+    partial = {}
+    counts = (
+        window
+        .values('ip_address')
+        .annotate(
+            requests=Count('id'),
+            sensitive_requests=Count('id', filter=sensitive),
         )
+    )
+    for row in counts.iterator():
+        partial[row['ip_address']] = {
+            'requests': row['requests'],
+            'sensitive_requests': row['sensitive_requests'],
+            'sensitive_paths': [],
+        }
+
+    sensitive_paths = (
+        window.filter(sensitive)
+        .values_list('ip_address', 'path')
+        .distinct()
+    )
+    for ip_address, path in sensitive_paths.iterator():
+        partial[ip_address]['sensitive_paths'].append(path)
+
+    return partial
 
-        created_count = 0
-        updated_count = 0
-
-        for ip_data in high_volume_ips:
-            if BlockedIP.objects.filter(ip_address=ip_data['ip_address'], is_active=True).exists():
-                logger.info(f"Skipping {ip_data['ip_address']} - already blocked")
-                continue
-
-            try:
-                suspicious_ip, created = SuspiciousIP.objects.update_or_create(
-                    ip_address=ip_data['ip_address'],
-                    reason='high_volume',
-                    defaults={
-                        'reason': 'high_volume',
-                        'is_active': True,
-                        'details': {'request_count': ip_data['request_count']}
-                    }
-                )
-                if created:
-                    created_count += 1
-                    logger.info(f"Flagged new suspicious IP (high volume): {ip_data['ip_address']} with {ip_data['request_count']} requests")
-                else:
-                    updated_count += 1
-
-            except Exception as e:
-                logger.error(f"Error flagging suspicious IP {ip_data['ip_address']}: {e}")
-
-        return created_count + updated_count
 
+def merge_partials(partials):
+    merged = {}
+    for partial in partials:
+        for ip_address, data in partial.items():
+            entry = merged.get(ip_address)
+            if entry is None:
+                merged[ip_address] = {
+                    'requests': data['requests'],
+                    'sensitive_requests': data['sensitive_requests'],
+                    'sensitive_paths': set(data['sensitive_paths']),
+                }
+            else:
+                entry['requests'] += data['requests']
+                entry['sensitive_requests'] += data['sensitive_requests']
+                entry['sensitive_paths'].update(data['sensitive_paths'])
+    return merged
+
+
+def evaluate_aggregates(merged):
+    """
+    Apply the detection rules to merged aggregates.
+    Returns {ip: (reason, details)} for every IP that should be flagged.
+    """
+    findings = {}
+    for ip_address, data in merged.items():
+        reasons = []
+        details = {'request_count': data['requests']}
+
+        if data['requests'] > HIGH_VOLUME_THRESHOLD:
+            reasons.append('high_volume')
+
+        if data['sensitive_requests'] and not ip_classifier.is_loopback(ip_address):
+            reasons.append('sensitive_paths')
+            details.update({
+                'sensitive_paths_accessed': sorted(data['sensitive_paths']),
+                'total_sensitive_requests': data['sensitive_requests'],
+                'unique_sensitive_paths': len(data['sensitive_paths']),
+            })
+
+        if reasons:
+            reason = reasons[0] if len(reasons) == 1 else 'multiple_reasons'
+            details['reasons'] = reasons
+            findings[ip_address] = (reason, details)
+    return findings
+
+
+def evaluate_network_aggregates(merged):
+    """Apply the network rules to merged per-IP aggregates: {network: (reason, details)}."""
+    from .detection import NetworkAggregator
+
+    return NetworkAggregator().evaluate_aggregates(merged)
+
+
+def flag_suspicious_ips(findings):
+    """
+    Upsert SuspiciousIP rows for ``findings`` in bulk, skipping blocked IPs.
+    Each row expires after its reason's TTL, escalated for repeat offenders.
+    """
+    if not findings:
+        return 0
+
+    now = timezone.now()
+    already_blocked = set(
+        BlockedIP.objects
+        .filter(unexpired(now), ip_address__in=list(findings), is_active=True)
+        .values_list('ip_address', flat=True)
+    )
+    existing = existing_entries(SuspiciousIP, findings)
+    detection_time = now.isoformat()
+    rows = []
+    for ip_address, (reason, details) in findings.items():
+        if ip_address in already_blocked:
+            continue
+        offense_count, expires_at = next_expiry(existing.get(ip_address), suspicious_ip_ttl(reason), now)
+        rows.append(SuspiciousIP(
+            ip_address=ip_address,
+            reason=reason,
+            is_active=True,
+            details={**details, 'detection_time': detection_time},
+            expires_at=expires_at,
+            offense_count=offense_count,
+        ))
+    if already_blocked:
+        logger.info(f"Skipping {len(already_blocked)} IPs - already blocked")
+
+    try:
+        SuspiciousIP.objects.bulk_create(
+            rows,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['ip_address'],
+            update_fields=['reason', 'is_active', 'details', 'expires_at', 'offense_count'],
+        )
     except Exception as e:
-        logger.error(f"Error detecting high volume IPs: {e}")
+        logger.error(f"Error flagging suspicious IPs: {e}")
+        return 0
+
+    suspicious_ips.invalidate()
+    return len(rows)
+
+
+def flag_suspicious_networks(findings):
+    """Upsert SuspiciousNetwork rows for ``findings`` in bulk."""
+    if not findings:
         return 0
 
-def detect_sensitive_path_access(one_hour_ago):
+    detection_time = timezone.now().isoformat()
+    rows = [
+        SuspiciousNetwork(
+            network=network,
+            network_address=network.split('/')[0],
+            prefix_length=details['prefix_length'],
+            reason=reason,
+            is_active=True,
+            details={**details, 'detection_time': detection_time},
+        )
+        for network, (reason, details) in findings.items()
+    ]
     try:
-        sensitive_paths = [
-            '/admin/', '/login/', '/wp-admin/', '/phpmyadmin/',
-            '/.env', '/config/', '/api/auth/', '/api/login/',
-            '/user/login/', '/account/login/', '/signin/',
-            '/administrator/', '/backend/', '/dashboard/'
-        ]
-        
-        sensitive_path_query = Q()
-        for path in sensitive_paths:
-            sensitive_path_query |= Q(path__startswith=path)
-        
-        sensitive_access_ips = (
-            RequestLog.objects
-            .filter(timestamp__gte=one_hour_ago)
-            .filter(sensitive_path_query)
-            .exclude(ip_address__in=['127.0.0.1', 'localhost', '::1'])
-            .values('ip_address')
-            .annotate(
-                request_count=Count('id'),
-                sensitive_paths_count=Count('path', distinct=True)
-            )
-            .filter(request_count__gt=0)
-            .order_by('-request_count')
+        SuspiciousNetwork.objects.bulk_create(
+            rows,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['network'],
+            update_fields=['reason', 'is_active', 'details'],
         )
-        
-        total_sensitive_requests = 0
-        processed_ips = 0
-        
-        for ip_data in sensitive_access_ips:
-            if BlockedIP.objects.filter(ip_address=ip_data['ip_address'], is_active=True).exists():
-                logger.info(f"Skipping {ip_data['ip_address']} - already blocked")
-                continue
-            
-            accessed_paths = (
-                RequestLog.objects
-                .filter(
-                    timestamp__gte=one_hour_ago,
-                    ip_address=ip_data['ip_address']
-                )
-                .filter(sensitive_path_query)
-                .values_list('path', flat=True)
-                .distinct()
-            )
-            
-            try:
-                suspicious_ip, created = SuspiciousIP.objects.update_or_create(
-                    ip_address=ip_data['ip_address'],
-                    reason='sensitive_paths',
-                    defaults={
-                        'request_count': ip_data['request_count'],
-                        'details': {
-                            'sensitive_paths_accessed': list(accessed_paths),
-                            'total_sensitive_requests': ip_data['request_count'],
-                            'unique_sensitive_paths': ip_data['sensitive_paths_count'],
-                            'detection_method': 'sensitive_paths_only',
-                            'detection_time': timezone.now().isoformat()
-                        },
-                        'is_active': True
-                    }
-                )
-                
-                total_sensitive_requests += ip_data['request_count']
-                processed_ips += 1
-                
-                if created:
-                    logger.warning(f"SENSITIVE PATHS - Created SuspiciousIP: {ip_data['ip_address']} - {ip_data['request_count']} requests across {len(accessed_paths)} sensitive paths")
-                else:
-                    logger.info(f"SENSITIVE PATHS - Updated SuspiciousIP: {ip_data['ip_address']} - {ip_data['request_count']} requests across {len(accessed_paths)} sensitive paths")
-                    
-            except Exception as e:
-                logger.error(f"Error creating sensitive paths SuspiciousIP for {ip_data['ip_address']}: {e}")
-        
-        logger.info(f"Sensitive paths detection: processed {processed_ips} IPs with {total_sensitive_requests} total sensitive requests")
-        return total_sensitive_requests
-        
     except Exception as e:
-        logger.error(f"Error in sensitive paths detection: {e}")
-        return 0
\ No newline at end of file
+        logger.error(f"Error flagging suspicious networks: {e}")
+        return 0
+    return len(rows)
+
+
+def run_sharded_detection(window_start, window_end, shards=1, workers=1):
+    """
+    Run the sharded detection locally, without a Celery broker.
+    ``workers > 1`` aggregates the shards in a process pool.
+    """
+    slices = time_slices(window_start, window_end, shards)
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from django.db import connections
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(_aggregate_slice_in_worker, slices))
+    else:
+        partials = [aggregate_time_slice(start, end) for start, end in slices]
+
+    merged = merge_partials(partials)
+    flag_suspicious_networks(evaluate_network_aggregates(merged))
+    return flag_suspicious_ips(evaluate_aggregates(merged))
+
+
+def _aggregate_slice_in_worker(bounds):
+    from django.db import connections
+
+    try:
+        return aggregate_time_slice(*bounds)
+    finally:
+        connections.close_all()
@@ -1,9 +1,68 @@
-from django.test import TestCase,override_settings
-from django.test import Client
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from http import HTTPStatus
+import gzip
+from collections import defaultdict
+from io import StringIO
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.utils import timezone
+
+from core.ip_sets import blocked_ips, suspicious_ips
+from core.middleware.ip_gate import EarlyRejectWSGIApp
+from core.middleware.suspicious_throttle import SuspiciousIPThrottleMiddleware
+from core.models import BlockedIP, RequestLog, SuspiciousIP, SuspiciousNetwork
+from core.tasks import evaluate_aggregates, merge_partials, aggregate_time_slice, run_sharded_detection
+from core.tasks import detect_suspicious_ips, detection_window_end, evaluate_network_aggregates
+from core.detection import DetectionEngine
+from django_mw.celery import app as celery_app
+from core.log_analysis import analyze_logs
+from core.exports import filter_request_logs, iter_request_logs
+from core.models import Location, User
+from core import geo
+from core.location_buffer import LocationWriteBuffer, location_buffer
+from core.geolocation import GeolocationStore, backfill_request_logs, cache_key, warm_geolocations
+from core.geolocation_providers import LOOKUP_FAILED, CircuitBreaker, IPInfoProvider, StubProvider
+from core.models import IPGeolocation, TaskWatermark
+from core import load_shedding
+from core.load_shedding import LoggingDegradationController
+from django.core.cache import cache
+from django.db import connections, transaction
+from core.db_routers import detection_database
+from core.dimensions import normalize_path, request_paths, user_agents
+from core.models import RequestPath, UserAgent
+from core.ip_classifier import IPClassifier
+from core.fields import pack_ip, unpack_ip
+from core.heavy_hitters import HeavyHitterTracker, SpaceSaving
+from core.cardinality import OTHER_ROUTES, RedisCardinalityBackend, UniqueVisitorCounter, unique_visitors
+from core.load_harness import (
+    LoadHarness, WSGITarget, discard_replay_data, generate_traffic, read_export, replay_environment,
+)
+from core.heavy_hitters import heavy_hitters
+from core.round_trips import RoundTripBudgetExceeded, counting, round_trip_stats
+from core.incremental_detection import advance_window, run_incremental_detection
+from core.models import IPWindowAggregate
+from core.expiry import sweep_expired_ips
+from core.tasks import flag_suspicious_ips
+from core.archive import ArchiveSegment, archive_request_logs, iter_archived_logs, list_segments
 
 
 class IPBlacklistMiddlewareTest(TestCase):
+    databases = {'default', 'logs'}
+
     def setUp(self):
         self.client = Client()
     @override_settings(BANNED_IPS=None)
@@ -20,6 +79,1503 @@ class IPBlacklistMiddlewareTest(TestCase):
     def test_request_failed_with_blacklisted_ips(self):
         response = self.client.get("/",REMOTE_ADDR='192.168.1.2')
         self.assertEqual(response.status_code,HTTPStatus.FORBIDDEN)
-    
 
 
+class EarlyRejectGateTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        blocked_ips.invalidate()
+
+    def test_blocked_ip_rejected_before_logging(self):
+        BlockedIP.objects.create(ip_address='203.0.113.9')
+        response = self.client.get("/public/", REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        self.assertFalse(RequestLog.objects.filter(ip_address='203.0.113.9').exists())
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_unblocking_refreshes_snapshot(self):
+        blocked = BlockedIP.objects.create(ip_address='203.0.113.10')
+        self.assertIn('203.0.113.10', blocked_ips)
+        blocked.is_active = False
+        blocked.save()
+        self.assertNotIn('203.0.113.10', blocked_ips)
+
+    def test_wsgi_wrapper_uses_prebuilt_response(self):
+        BlockedIP.objects.create(ip_address='203.0.113.11')
+        calls = []
+        app = EarlyRejectWSGIApp(lambda environ, start_response: calls.append(environ))
+        statuses = []
+        body = app({'REMOTE_ADDR': '203.0.113.11'}, lambda status, headers: statuses.append(status))
+        self.assertEqual(statuses, ['403 Forbidden'])
+        self.assertEqual(b''.join(body), b"Access denied. Your IP address has been blocked.")
+        self.assertEqual(calls, [])
+
+
+@override_settings(SUSPICIOUS_IP_POLICIES={
+    'high_volume': {'rate': '2/m'},
+    'sensitive_paths': {'delay': 0.2},
+    'multiple_reasons': {'challenge': True},
+})
+class SuspiciousIPThrottleMiddlewareTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        suspicious_ips.invalidate()
+
+    def test_unflagged_ip_is_not_throttled(self):
+        for _ in range(3):
+            response = self.client.get("/public/", REMOTE_ADDR='198.51.100.1')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_flagged_ip_gets_tighter_rate_limit(self):
+        SuspiciousIP.objects.create(ip_address='198.51.100.2', reason='high_volume')
+        statuses = [
+            self.client.get("/public/", REMOTE_ADDR='198.51.100.2').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [HTTPStatus.OK, HTTPStatus.OK, HTTPStatus.TOO_MANY_REQUESTS])
+
+    def test_challenge_passes_once_cookie_is_returned(self):
+        SuspiciousIP.objects.create(ip_address='198.51.100.3', reason='multiple_reasons')
+        response = self.client.get("/public/", REMOTE_ADDR='198.51.100.3')
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertIn('ip_challenge', response.cookies)
+        response = self.client.get("/public/", REMOTE_ADDR='198.51.100.3')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_delay_paces_sync_requests_without_sleeping(self):
+        SuspiciousIP.objects.create(ip_address='198.51.100.4', reason='sensitive_paths')
+        started = time.monotonic()
+        first = self.client.get("/public/", REMOTE_ADDR='198.51.100.4')
+        second = self.client.get("/public/", REMOTE_ADDR='198.51.100.4')
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertEqual(first.status_code, HTTPStatus.OK)
+        self.assertEqual(second.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(second['Retry-After'], '1')
+
+    def test_delay_stalls_async_requests(self):
+        SuspiciousIP.objects.create(ip_address='198.51.100.5', reason='sensitive_paths')
+
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = SuspiciousIPThrottleMiddleware(view)
+        request = RequestFactory().get('/public/', REMOTE_ADDR='198.51.100.5')
+        started = time.monotonic()
+        for _ in range(2):
+            self.assertEqual(async_to_sync(middleware)(request).status_code, HTTPStatus.OK)
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+
+    @override_settings(SUSPICIOUS_IP_DEFAULT_POLICY={'rate': '1/m'})
+    def test_reasons_without_a_policy_get_the_default(self):
+        SuspiciousIP.objects.create(ip_address='198.51.100.6', reason='path_scan')
+        statuses = [
+            self.client.get("/public/", REMOTE_ADDR='198.51.100.6').status_code
+            for _ in range(2)
+        ]
+        self.assertEqual(statuses, [HTTPStatus.OK, HTTPStatus.TOO_MANY_REQUESTS])
+
+
+class SuspiciousIPPolicySettingsTest(SimpleTestCase):
+    def test_every_reason_has_a_policy(self):
+        reasons = {reason for reason, _ in SuspiciousIP.REASON_CHOICES}
+        self.assertEqual(reasons - set(settings.SUSPICIOUS_IP_POLICIES), set())
+        self.assertTrue(settings.SUSPICIOUS_IP_DEFAULT_POLICY)
+
+
+class ShardedDetectionTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        now = timezone.now()
+        self.window = (now - timedelta(hours=1), now + timedelta(seconds=1))
+        logs = [RequestLog(ip_address='203.0.113.20', path='/public/') for _ in range(101)]
+        logs += [RequestLog(ip_address='203.0.113.21', path='/wp-admin/setup.php') for _ in range(3)]
+        logs += [RequestLog(ip_address='203.0.113.22', path='/admin/') for _ in range(120)]
+        logs += [RequestLog(ip_address='203.0.113.23', path='/public/') for _ in range(10)]
+        RequestLog.objects.bulk_create(logs)
+        # Spread the rows over the window so they land in different shards
+        for minutes, log_id in enumerate(RequestLog.objects.values_list('id', flat=True)):
+            RequestLog.objects.filter(id=log_id).update(
+                timestamp=now - timedelta(minutes=minutes % 59)
+            )
+
+    def flagged(self):
+        return dict(SuspiciousIP.objects.values_list('ip_address', 'reason'))
+
+    def test_shards_flag_by_reason(self):
+        run_sharded_detection(*self.window, shards=4)
+        self.assertEqual(self.flagged(), {
+            '203.0.113.20': 'high_volume',
+            '203.0.113.21': 'sensitive_paths',
+            '203.0.113.22': 'multiple_reasons',
+        })
+        details = SuspiciousIP.objects.get(ip_address='203.0.113.20').details
+        self.assertEqual(details['request_count'], 101)
+
+    def test_task_fans_out_over_shards_when_opted_in(self):
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+        expected = {
+            '203.0.113.20': 'high_volume',
+            '203.0.113.21': 'sensitive_paths',
+            '203.0.113.22': 'multiple_reasons',
+        }
+
+        detect_suspicious_ips.delay(shards=3)
+        self.assertEqual(self.flagged(), expected)
+
+        SuspiciousIP.objects.all().delete()
+        with override_settings(DETECTION_INCREMENTAL=False):
+            detect_suspicious_ips.delay()
+        self.assertEqual(self.flagged(), expected)
+        # The incremental window was never touched
+        self.assertFalse(IPWindowAggregate.objects.exists())
+        self.assertFalse(TaskWatermark.objects.filter(name='detection_window').exists())
+
+    def test_sharded_result_matches_single_shard(self):
+        run_sharded_detection(*self.window, shards=1)
+        single = {
+            ip: details for ip, details in
+            SuspiciousIP.objects.values_list('ip_address', 'details')
+        }
+        SuspiciousIP.objects.all().delete()
+        run_sharded_detection(*self.window, shards=7)
+        for ip, details in SuspiciousIP.objects.values_list('ip_address', 'details'):
+            details.pop('detection_time')
+            single[ip].pop('detection_time')
+            self.assertEqual(details, single[ip])
+
+
+class ColumnarDetectionEngineTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        now = timezone.now()
+        self.window = (now - timedelta(hours=1), now + timedelta(seconds=1))
+        logs = [RequestLog(ip_address='203.0.113.30', path=f'/probe/{i}/') for i in range(60)]
+        logs += [RequestLog(ip_address='203.0.113.31', path='/api/', status_code=404) for _ in range(25)]
+        logs += [RequestLog(ip_address='2001:db8::1', path='/login/') for _ in range(120)]
+        logs += [RequestLog(ip_address='203.0.113.32', path='/public/', status_code=200) for _ in range(10)]
+        RequestLog.objects.bulk_create(logs)
+
+    def test_all_rules_share_one_load(self):
+        engine = DetectionEngine(rules={
+            'volume': {'threshold': 100},
+            'sensitive_paths': {},
+            'path_diversity': {'min_distinct_paths': 50},
+            'error_ratio': {'min_requests': 20, 'ratio': 0.5},
+            'burst': {'per_bucket': 200},
+        })
+        with self.assertNumQueries(1, using='logs'):
+            findings = engine.run(*self.window)
+        self.assertEqual({ip: reason for ip, (reason, _) in findings.items()}, {
+            '203.0.113.30': 'path_diversity',
+            '203.0.113.31': 'error_ratio',
+            '2001:db8::1': 'multiple_reasons',
+        })
+        self.assertEqual(findings['2001:db8::1'][1]['reasons'], ['high_volume', 'sensitive_paths'])
+
+    def test_matches_orm_aggregation_rules(self):
+        engine = DetectionEngine(rules={'volume': {}, 'sensitive_paths': {}})
+        columnar = engine.run(*self.window)
+        orm = evaluate_aggregates(merge_partials([aggregate_time_slice(*self.window)]))
+        self.assertEqual(columnar, orm)
+
+    def test_middleware_records_status_code(self):
+        Client().get("/public/", REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(
+            RequestLog.objects.filter(ip_address='127.0.0.1').get().status_code,
+            HTTPStatus.OK,
+        )
+
+
+class AccessLogAnalysisTest(TestCase):
+    databases = {'default', 'logs'}
+
+    LINES = [
+        "Timestamp,IP Address,Country,City,Path,Method,User Agent,Status\n",
+        "2025-11-13 00:12:21,8.8.8.8   ,United States, Mountain View,/test-google/,GET       ,curl/8.0,ALLOWED   \n",
+        "2025-11-13 00:12:59,8.8.8.8   ,United States, Mountain View,/login/,POST      ,curl/8.0,ALLOWED   \n",
+        "2025-11-13 00:13:05,5.9.118.1 ,Blocked,Blocked,/admin/,GET       ,curl/8.0,BLOCKED   \n",
+        "not a log line\n",
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.plain = os.path.join(self.tmpdir.name, 'result.txt')
+        with open(self.plain, 'w') as f:
+            f.writelines(self.LINES * 50)
+        self.rotated = os.path.join(self.tmpdir.name, 'result.txt.1.gz')
+        with gzip.open(self.rotated, 'wt') as f:
+            f.writelines(self.LINES)
+
+    def test_byte_range_segments_match_single_pass(self):
+        whole = analyze_logs([self.plain, self.rotated]).report()
+        split = analyze_logs([self.plain, self.rotated], chunk_size=97).report()
+        self.assertEqual(split, whole)
+        self.assertEqual(whole['lines'], 255)
+        self.assertEqual(whole['malformed'], 102)
+        self.assertEqual(whole['top_ips'][0], ('8.8.8.8', 102))
+        self.assertEqual(whole['statuses'], {'ALLOWED': 102, 'BLOCKED': 51})
+        self.assertEqual(whole['per_minute']['2025-11-13 00:12'], 102)
+
+    def test_load_keeps_logged_timestamps(self):
+        summary = analyze_logs([self.rotated], load=True)
+        self.assertEqual(summary.loaded, 2)
+        log = RequestLog.objects.get(path='/login/')
+        self.assertEqual((log.ip_address, log.country, log.city), ('8.8.8.8', 'United States', 'Mountain View'))
+        self.assertEqual(log.timestamp.strftime('%Y-%m-%d %H:%M:%S'), '2025-11-13 00:12:59')
+
+
+class RequestLogExportTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        now = timezone.now()
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.40', path=f'/api/{i}/', country='Kenya',
+                       timestamp=now - timedelta(seconds=i // 3))
+            for i in range(10)
+        ] + [RequestLog(ip_address='203.0.113.41', path='/public/', country='Japan')])
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+
+    def test_keyset_pages_cover_ties_exactly_once(self):
+        ids = [row['id'] for row in iter_request_logs(filter_request_logs(), page_size=2)]
+        self.assertEqual(sorted(ids), sorted(RequestLog.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_staff_can_stream_filtered_ndjson(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            '/export/request-logs/',
+            {'format': 'ndjson', 'country': 'Kenya', 'path_prefix': '/api/'},
+            REMOTE_ADDR='127.0.0.1',
+        )
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertIn('"ip_address": "203.0.113.40"', lines[0])
+
+    def test_anonymous_users_are_redirected(self):
+        response = self.client.get('/export/request-logs/', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+
+class LargeTableAdminTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address=f'198.51.100.{i}', path='/public/') for i in range(150)
+        ])
+        self.admin_user = User.objects.create_superuser('root', password='pw')
+        self.client.force_login(self.admin_user)
+        blocked_ips.invalidate()
+
+    def test_changelist_pages_with_cursor(self):
+        url = '/admin/core/requestlog/'
+        first = self.client.get(url, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(first.status_code, HTTPStatus.OK)
+        cl = first.context['cl']
+        self.assertEqual(len(cl.result_list), 100)
+        self.assertIsNotNone(cl.next_page_url)
+
+        second = self.client.get(url + cl.next_page_url, REMOTE_ADDR='127.0.0.1')
+        rest = second.context['cl'].result_list
+        self.assertEqual(len(rest), 50)
+        self.assertIsNone(second.context['cl'].next_page_url)
+        seen = {log.pk for log in cl.result_list} | {log.pk for log in rest}
+        self.assertEqual(len(seen), 150)
+
+    def test_changelist_reads_user_agents_without_a_query_per_row(self):
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='198.51.100.200', path='/', user_agent=f'agent/{i}') for i in range(100)
+        ])
+        with CaptureQueriesContext(connections['logs']) as queries:
+            response = self.client.get('/admin/core/requestlog/', REMOTE_ADDR='127.0.0.1')
+        self.assertContains(response, 'agent/99')
+        self.assertLess(len(queries), 10)
+
+    def test_block_action_blocks_distinct_ips(self):
+        ids = list(RequestLog.objects.filter(ip_address__in=['198.51.100.1', '198.51.100.2'])
+                   .values_list('id', flat=True))
+        self.client.post('/admin/core/requestlog/', {
+            'action': 'block_selected_ips',
+            '_selected_action': ids,
+        }, REMOTE_ADDR='127.0.0.1')
+        self.assertIn('198.51.100.1', blocked_ips)
+        self.assertEqual(BlockedIP.objects.filter(is_active=True).count(), 2)
+
+
+class LocationProximityTest(TestCase):
+    databases = {'default', 'logs'}
+
+    POINTS = {
+        'nairobi': (-1.286389, 36.817223),
+        'thika': (-1.033333, 37.069444),
+        'mombasa': (-4.043477, 39.668206),
+        'fiji_west': (-17.7, 179.9),
+        'fiji_east': (-17.7, -179.9),
+    }
+
+    def setUp(self):
+        for name, (lat, lon) in self.POINTS.items():
+            user = User.objects.create_user(name)
+            Location.objects.create(user=user, latitude=lat, longitude=lon)
+
+    def test_geohash_maintained_on_save(self):
+        location = Location.objects.get(user__username='nairobi')
+        self.assertEqual(location.geohash, geo.encode(-1.286389, 36.817223))
+        self.assertTrue(location.geohash.startswith('kzf0'))
+        location.latitude, location.longitude = -4.043477, 39.668206
+        location.save(update_fields=['latitude', 'longitude'])
+        location.refresh_from_db()
+        self.assertEqual(location.geohash, geo.encode(-4.043477, 39.668206))
+
+    def test_near_refines_to_exact_radius(self):
+        results = Location.objects.near(-1.286389, 36.817223, 50)
+        self.assertEqual([loc.user.username for loc in results], ['nairobi', 'thika'])
+        self.assertAlmostEqual(results[1].distance_km, 39.0, delta=2)
+
+    def test_bbox_across_antimeridian(self):
+        names = set(
+            Location.objects.within_bbox(-18, 179, -17, -179)
+            .values_list('user__username', flat=True)
+        )
+        self.assertEqual(names, {'fiji_west', 'fiji_east'})
+
+
+class LocationWriteBufferTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.buffer = LocationWriteBuffer(flush_interval=3600, min_move_meters=25)
+        self.users = [User.objects.create_user(f'mobile{i}') for i in range(3)]
+
+    def test_pings_coalesce_to_one_write_per_user(self):
+        for step in range(20):
+            for user in self.users:
+                self.buffer.add(user.pk, Decimal('-1.28') + Decimal(step) / 100, Decimal('36.81'))
+        self.assertEqual(self.buffer.pending_count(), 3)
+        with self.assertNumQueries(2):  # one SELECT, one INSERT
+            self.assertEqual(self.buffer.flush(), 3)
+        location = Location.objects.get(user=self.users[0])
+        self.assertEqual(location.latitude, Decimal('-1.090000'))
+        self.assertEqual(location.geohash, geo.encode(location.latitude, location.longitude))
+
+    def test_small_moves_are_skipped(self):
+        user = self.users[0]
+        self.buffer.add(user.pk, Decimal('-1.280000'), Decimal('36.810000'))
+        self.buffer.flush()
+        self.buffer.add(user.pk, Decimal('-1.280100'), Decimal('36.810000'))  # ~11 m
+        self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.add(user.pk, Decimal('-1.290000'), Decimal('36.810000'))  # ~1.1 km
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Location.objects.get(user=user).latitude, Decimal('-1.290000'))
+
+    def test_ingest_endpoint_requires_login(self):
+        response = self.client.post('/location/', {'latitude': '1', 'longitude': '2'}, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_ingest_endpoint_rejects_non_finite_coordinates(self):
+        self.client.force_login(self.users[0])
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf'):
+            response = self.client.post('/location/', {'latitude': value, 'longitude': '2'}, REMOTE_ADDR='127.0.0.1')
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_ingest_endpoint_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.users[0])
+        ping = {'latitude': '1', 'longitude': '2'}
+        pending = location_buffer.pending_count()
+        response = client.post('/location/', ping, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        self.assertEqual(location_buffer.pending_count(), pending)
+
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        response = client.post('/location/', ping, REMOTE_ADDR='127.0.0.1', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+
+
+class GeolocationStoreTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        cache.clear()
+        self.store = GeolocationStore(write_batch_size=2, write_interval=3600)
+
+    def test_durable_tier_survives_cache_flush(self):
+        self.store.put('8.8.8.8', 'United States', 'Mountain View')
+        self.store.put('1.1.1.1', 'Australia', 'Sydney')  # fills the write batch
+        self.assertEqual(IPGeolocation.objects.count(), 2)
+
+        cache.clear()
+        with self.assertNumQueries(1, using='logs'):
+            found = self.store.get_many(['8.8.8.8', '1.1.1.1', '9.9.9.9'])
+        self.assertEqual(found, {
+            '8.8.8.8': ('United States', 'Mountain View'),
+            '1.1.1.1': ('Australia', 'Sydney'),
+        })
+        with self.assertNumQueries(0, using='logs'):
+            self.assertEqual(self.store.get('8.8.8.8'), ('United States', 'Mountain View'))
+
+    def test_failed_lookups_are_not_persisted(self):
+        self.store.put('9.9.9.9', *LOOKUP_FAILED)
+        self.store.flush()
+        self.assertFalse(IPGeolocation.objects.exists())
+        # Only cached for the short negative TTL, or not at all
+        self.assertEqual(self.store.get('9.9.9.9'), LOOKUP_FAILED)
+        with override_settings(GEOLOCATION_NEGATIVE_CACHE_TTL=0):
+            self.store.put('9.9.9.8', *LOOKUP_FAILED)
+        self.assertIsNone(self.store.get('9.9.9.8'))
+
+    def test_partial_answers_are_persisted(self):
+        self.store.put('5.9.118.1', 'Germany', 'Unknown')
+        self.store.put('9.9.9.9', 'Unknown', 'Unknown')
+        self.assertEqual(
+            dict(IPGeolocation.objects.values_list('ip_address', 'city')),
+            {'5.9.118.1': 'Unknown', '9.9.9.9': 'Unknown'},
+        )
+
+    def test_warm_up_recovers_hottest_ips_from_request_logs(self):
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address='5.9.118.1', path='/', country='Germany', city='Falkenstein')] * 3
+            + [RequestLog(ip_address='5.9.118.1', path='/', country='Unknown', city='Unknown')]
+            + [RequestLog(ip_address='200.160.1.1', path='/', country='Brazil', city='Sao Paulo')]
+        )
+        self.assertEqual(warm_geolocations(limit=1), 1)
+        self.assertEqual(cache.get(cache_key('5.9.118.1')), {'country': 'Germany', 'city': 'Falkenstein'})
+        self.assertIsNone(cache.get(cache_key('200.160.1.1')))
+        self.assertEqual(IPGeolocation.objects.get().source, 'request_log')
+
+
+class GeolocationBackfillTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        cache.clear()
+        self.provider = StubProvider(locations={
+            '8.8.8.8': ('United States', 'Mountain View'),
+            '5.9.118.1': ('Germany', 'Falkenstein'),
+            '9.9.9.9': LOOKUP_FAILED,
+        })
+
+    def test_backfill_resolves_each_ip_once_and_resumes(self):
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address='8.8.8.8', path='/', country='Unknown', city='Unknown')] * 3
+            + [RequestLog(ip_address='5.9.118.1', path='/', country='Error', city='Error')] * 2
+            + [RequestLog(ip_address='9.9.9.9', path='/', country='Unknown', city='Unknown')]
+            + [RequestLog(ip_address='192.168.1.5', path='/', country='', city='')]
+        )
+        stats = backfill_request_logs(provider=self.provider, batch_size=2, max_batches=1)
+        self.assertEqual(stats['rows_updated'], 3)
+        self.assertEqual(self.provider.calls, ['8.8.8.8'])
+
+        stats = backfill_request_logs(provider=self.provider, batch_size=2)
+        self.assertEqual(stats['rows_updated'], 2)
+        self.assertEqual(sorted(self.provider.calls), ['5.9.118.1', '8.8.8.8', '9.9.9.9'])
+        self.assertEqual(RequestLog.objects.filter(country='Germany', city='Falkenstein').count(), 2)
+        self.assertEqual(RequestLog.objects.filter(country='Unknown').count(), 1)
+        self.assertEqual(IPGeolocation.objects.count(), 2)
+        # The watermark stays before the IP the provider failed to answer
+        unresolved = RequestLog.objects.get(ip_address='9.9.9.9').id
+        self.assertEqual(TaskWatermark.objects.get(name='geolocation_backfill').position, unresolved - 1)
+
+        self.provider.locations['9.9.9.9'] = ('Switzerland', 'Zurich')
+        stats = backfill_request_logs(provider=self.provider, batch_size=2)
+        self.assertEqual(stats['rows_updated'], 1)
+        self.assertEqual(
+            TaskWatermark.objects.get(name='geolocation_backfill').position,
+            RequestLog.objects.latest('id').id,
+        )
+
+    def test_country_only_answers_move_the_watermark(self):
+        self.provider.locations['5.9.118.1'] = ('Germany', 'Unknown')
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address='5.9.118.1', path='/', country='Error', city='Error')] * 2
+            + [RequestLog(ip_address='8.8.8.8', path='/', country='Unknown', city='Unknown')]
+        )
+        backfill_request_logs(provider=self.provider, batch_size=2)
+        last = RequestLog.objects.latest('id').id
+        self.assertEqual(TaskWatermark.objects.get(name='geolocation_backfill').position, last)
+        self.assertEqual(RequestLog.objects.filter(country='Germany', city='Unknown').count(), 2)
+        self.assertEqual(IPGeolocation.objects.get(ip_address='5.9.118.1').city, 'Unknown')
+
+        RequestLog.objects.create(ip_address='5.9.118.1', path='/', country='Unknown', city='Unknown')
+        stats = backfill_request_logs(provider=self.provider, batch_size=2)
+        self.assertEqual(sorted(self.provider.calls), ['5.9.118.1', '8.8.8.8'])
+        self.assertEqual(stats['rows_updated'], 1)
+        self.assertEqual(stats['unresolved'], 0)
+        self.assertEqual(
+            TaskWatermark.objects.get(name='geolocation_backfill').position,
+            RequestLog.objects.latest('id').id,
+        )
+
+    def test_backfill_uses_known_locations_before_the_provider(self):
+        IPGeolocation.objects.create(ip_address='1.1.1.1', country='Australia', city='Sydney')
+        RequestLog.objects.create(ip_address='1.1.1.1', path='/', country='Unknown', city='Unknown')
+        backfill_request_logs(provider=self.provider)
+        self.assertEqual(self.provider.calls, [])
+        self.assertEqual(RequestLog.objects.get().city, 'Sydney')
+
+
+class StubGeolocationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        server.connections.add(self.client_address)
+        time.sleep(server.delay)
+        if server.status != 200:
+            body = b'{}'
+        else:
+            body = json.dumps({'ip': self.path.split('/')[1], 'country': 'US', 'city': 'Mountain View'}).encode()
+        try:
+            self.send_response(server.status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            step = 8 if server.drip else len(body)
+            for offset in range(0, len(body), step):
+                self.wfile.write(body[offset:offset + step])
+                self.wfile.flush()
+                time.sleep(server.drip)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up after its timeout
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GeolocationProviderClientTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeolocationHandler)
+        self.server.daemon_threads = True
+        self.server.requests = 0
+        self.server.connections = set()
+        self.server.delay = 0
+        self.server.drip = 0
+        self.server.status = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.provider = IPInfoProvider(
+            concurrency=1,
+            api_key='',
+            base_url=f'http://127.0.0.1:{self.server.server_address[1]}',
+            timeout=0.2,
+            breaker=CircuitBreaker(min_calls=3, cooldown=0.3),
+        )
+        self.addCleanup(self.provider.session.close)
+
+    def test_lookups_reuse_one_keep_alive_connection(self):
+        for ip in ['8.8.8.8', '8.8.4.4', '1.1.1.1']:
+            self.assertEqual(self.provider.lookup(ip), ('United States', 'Mountain View'))
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_slow_provider_trips_breaker_then_recovers(self):
+        self.server.delay = 0.5
+        for _ in range(3):
+            self.assertEqual(self.provider.lookup('8.8.8.8'), LOOKUP_FAILED)
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.OPEN)
+
+        started = time.monotonic()
+        self.assertEqual(self.provider.lookup('8.8.8.8'), LOOKUP_FAILED)
+        self.assertLess(time.monotonic() - started, 0.05)
+        self.assertEqual(self.server.requests, 3)
+
+        self.server.delay = 0
+        time.sleep(0.35)
+        self.assertEqual(self.provider.lookup('8.8.8.8'), ('United States', 'Mountain View'))
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_timeout_bounds_the_whole_call(self):
+        # Every read gets a few bytes well within the timeout; the body takes ~0.5s
+        self.server.drip = 0.05
+        started = time.monotonic()
+        self.assertEqual(self.provider.lookup('8.8.8.8'), LOOKUP_FAILED)
+        self.assertLess(time.monotonic() - started, 0.35)
+
+    def test_server_errors_open_the_circuit_but_client_errors_do_not(self):
+        self.server.status = 404
+        for _ in range(3):
+            self.provider.lookup('8.8.8.8')
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.CLOSED)
+
+        self.server.status = 503
+        for _ in range(3):
+            self.provider.lookup('8.8.8.8')
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.OPEN)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingRedis:
+    """Just enough of a redis client for RedisCardinalityBackend.add_many: {key: IPs added}."""
+
+    def __init__(self):
+        self.keys = defaultdict(set)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def pfadd(self, key, *values):
+        self.keys[key].update(values)
+
+    def expire(self, key, seconds):
+        pass
+
+    def execute(self):
+        return []
+
+
+class LoggingLoadSheddingTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+        self.controller = LoggingDegradationController(
+            latency_budget=0.05, min_samples=5, step_interval=1, recovery_seconds=10,
+            sample_rate=4, probe_interval=5, clock=self.clock,
+        )
+
+    def feed(self, elapsed, count=5, failed=False):
+        for _ in range(count):
+            self.controller.observe(elapsed, failed)
+
+    def test_steps_down_one_mode_at_a_time_and_recovers(self):
+        seen = []
+        for _ in range(3):
+            self.clock.now += 1
+            self.feed(0.5)
+            seen.append(self.controller.mode)
+        self.assertEqual(seen, ['no_geolocation', 'sampled', 'counters_only'])
+        self.assertEqual(cache.get('request_logging_transitions_counters_only'), 1)
+
+        self.feed(0.005)
+        self.clock.now += 11
+        self.feed(0.005)
+        self.assertEqual(self.controller.mode, 'sampled')
+        self.assertEqual(self.controller.metrics()['transitions']['sampled'], 2)
+
+    def test_errors_shed_load_even_when_fast(self):
+        self.clock.now += 1
+        self.feed(0.001, count=2, failed=True)
+        self.assertEqual(self.controller.mode, 'no_geolocation')
+        self.assertFalse(self.controller.use_geolocation())
+
+    def test_sampled_and_counters_only_modes_skip_writes(self):
+        self.controller.level = 2
+        self.assertEqual(sum(self.controller.should_log() for _ in range(20)), 5)
+        self.controller.level = 3
+        self.assertEqual(sum(self.controller.should_log() for _ in range(20)), 1)
+        self.controller.flush()
+        self.assertEqual(cache.get('request_logging_shed_total'), 34)
+
+    def test_middleware_writes_no_rows_in_counters_only_mode(self):
+        controller = load_shedding.logging_controller
+        self.addCleanup(setattr, controller, 'level', controller.level)
+        controller.level = 3
+        controller._last_probe = time.monotonic()
+        response = self.client.get('/', REMOTE_ADDR='8.8.8.8')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(RequestLog.objects.exists())
+
+
+class LogDatabaseRouterTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def test_log_tables_live_only_in_the_logs_database(self):
+        log = RequestLog.objects.create(ip_address='8.8.8.8', path='/')
+        user = User.objects.create(username='router')
+        self.assertEqual(log._state.db, 'logs')
+        self.assertEqual(user._state.db, 'default')
+
+        default_tables = set(connections['default'].introspection.table_names())
+        logs_tables = set(connections['logs'].introspection.table_names())
+        for table in ['request_logs', 'blocked_ips', 'suspicious_ips', 'ip_geolocations']:
+            self.assertIn(table, logs_tables)
+            self.assertNotIn(table, default_tables)
+        self.assertIn('core_user', default_tables)
+        self.assertNotIn('core_user', logs_tables)
+
+    def test_detection_reads_fall_back_to_logs_without_a_replica(self):
+        self.assertEqual(detection_database(), 'logs')
+        with override_settings(DETECTION_READ_DATABASE='logs_replica'):
+            self.assertEqual(detection_database(), 'logs')
+
+
+class RequestLogArchiveTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.now = timezone.now()
+        self.old = old = (self.now - timedelta(days=40)).replace(hour=12, minute=0)
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address='8.8.8.8', path='/api/items/', method='GET', status_code=200,
+                        user_agent='curl/8', country='United States', city='Mountain View',
+                        timestamp=old + timedelta(minutes=i)) for i in range(5)]
+            + [RequestLog(ip_address='5.9.118.1', path='/admin/', method='POST',
+                          timestamp=old - timedelta(days=1))]
+            + [RequestLog(ip_address='8.8.8.8', path='/recent/', timestamp=self.now)]
+        )
+
+    def tearDown(self):
+        for path in list_segments(self.directory):
+            os.remove(path)
+        os.rmdir(self.directory)
+
+    def test_archives_old_rows_per_day_and_deletes_them(self):
+        stats = archive_request_logs(older_than_days=30, directory=self.directory, delete_batch_size=2)
+        self.assertEqual(stats['rows'], 6)
+        self.assertEqual(list(RequestLog.objects.values_list('path', flat=True)), ['/recent/'])
+        self.assertEqual(len(list_segments(self.directory)), 2)
+
+        rows = list(iter_archived_logs(directory=self.directory))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['path'], '/admin/')
+        self.assertIsNone(rows[0]['status_code'])
+        self.assertEqual(rows[-1]['user_agent'], 'curl/8')
+
+        # A rerun is a no-op
+        self.assertEqual(archive_request_logs(older_than_days=30, directory=self.directory)['rows'], 0)
+
+    def test_late_rows_are_merged_into_the_day_segment(self):
+        archive_request_logs(older_than_days=30, directory=self.directory)
+        RequestLog.objects.create(
+            ip_address='9.9.9.9', path='/late/', method='PUT', timestamp=self.old + timedelta(seconds=30)
+        )
+        self.assertEqual(archive_request_logs(older_than_days=30, directory=self.directory)['rows'], 1)
+        with ArchiveSegment(list_segments(self.directory)[-1]) as segment:
+            rows = list(segment.rows())
+        self.assertEqual([row['path'] for row in rows], ['/api/items/', '/late/'] + ['/api/items/'] * 4)
+        self.assertEqual(rows[1]['method'], 'PUT')
+        self.assertEqual(rows[0]['user_agent'], 'curl/8')
+
+    def test_scan_pushes_predicates_down(self):
+        archive_request_logs(older_than_days=30, directory=self.directory)
+        self.assertEqual(len(list(iter_archived_logs(ip_address='8.8.8.8', directory=self.directory))), 5)
+        self.assertEqual(
+            [row['method'] for row in iter_archived_logs(path_prefix='/admin', directory=self.directory)],
+            ['POST'],
+        )
+        self.assertEqual(list(iter_archived_logs(ip_address='9.9.9.9', directory=self.directory)), [])
+
+        start = self.old + timedelta(minutes=1)
+        rows = list(iter_archived_logs(start=start, end=start + timedelta(minutes=2), directory=self.directory))
+        self.assertEqual(len(rows), 2)
+
+        with ArchiveSegment(list_segments(self.directory)[-1]) as segment:
+            self.assertEqual(segment.dictionary('ip_address'), ['8.8.8.8'])
+
+
+class RequestDimensionTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        user_agents.clear()
+        request_paths.clear()
+
+    def test_bulk_create_interns_repeated_values(self):
+        logs = [
+            RequestLog(ip_address='8.8.8.8', path=f'/api/orders/{i}/', user_agent='curl/8' if i % 2 else 'Mozilla/5.0')
+            for i in range(50)
+        ]
+        # One SELECT + one INSERT + one SELECT per dimension, then the rows
+        with self.assertNumQueries(7, using='logs'):
+            RequestLog.objects.bulk_create(logs)
+        self.assertEqual(UserAgent.objects.count(), 2)
+        self.assertEqual(list(RequestPath.objects.values_list('value', flat=True)), ['/api/orders/:id/'])
+        self.assertEqual(RequestLog.objects.get(id=logs[1].id).user_agent, 'curl/8')
+
+    def test_committed_ids_are_served_from_memory(self):
+        with self.captureOnCommitCallbacks(execute=True, using='logs'):
+            RequestLog.objects.create(ip_address='8.8.8.8', path='/health/', user_agent='kube-probe/1.29')
+        with self.assertNumQueries(1, using='logs'):
+            log = RequestLog.objects.create(ip_address='8.8.4.4', path='/health/', user_agent='kube-probe/1.29')
+        self.assertEqual(log.path_ref.value, '/health/')
+
+    def test_normalize_path_replaces_ids(self):
+        self.assertEqual(normalize_path('/users/42/avatar?size=2'), '/users/:id/avatar')
+        self.assertEqual(
+            normalize_path('/files/3f2b8c1e-9d4a-4b7e-8f1a-2c3d4e5f6a7b/'), '/files/:id/'
+        )
+        self.assertEqual(normalize_path('/admin/login/'), '/admin/login/')
+
+
+class IPClassifierTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def test_classifies_ipv4_and_ipv6_special_ranges(self):
+        classifier = IPClassifier(max_cache=16)
+        expected = {
+            '8.8.8.8': 'public',
+            '127.0.0.53': 'loopback',
+            '10.1.2.3': 'private',
+            '172.31.255.255': 'private',
+            '172.32.0.1': 'public',
+            '100.64.1.1': 'cgnat',
+            '169.254.169.254': 'link_local',
+            '198.51.100.7': 'documentation',
+            '224.0.0.251': 'multicast',
+            '255.255.255.255': 'reserved',
+            '0.0.0.0': 'unspecified',
+            '2606:4700:4700::1111': 'public',
+            '::1': 'loopback',
+            '::': 'unspecified',
+            'fd12:3456::1': 'private',
+            'fe80::1%eth0': 'link_local',
+            '2001:db8::1': 'documentation',
+            '::ffff:192.168.1.1': 'private',
+            '::ffff:8.8.8.8': 'public',
+            '64:ff9b::808:808': 'public',
+            '4000::1': 'reserved',
+            'localhost': 'invalid',
+            '999.1.1.1': 'invalid',
+        }
+        for ip, category in expected.items():
+            with self.subTest(ip=ip):
+                self.assertEqual(classifier.classify(ip), category)
+        self.assertLessEqual(classifier.classify.cache_info().currsize, 16)
+
+    def test_middleware_does_not_look_up_non_public_addresses(self):
+        self.client.get('/', REMOTE_ADDR='100.64.3.4')
+        self.client.get('/', HTTP_X_FORWARDED_FOR='fd00::5')
+        self.assertEqual(
+            sorted(RequestLog.objects.values_list('country', flat=True)), ['Private', 'Private']
+        )
+
+    def test_block_ip_skips_non_public_addresses(self):
+        out = StringIO()
+        call_command('block_ip', '192.168.1.10', '8.8.4.4', stdout=out)
+        self.assertIn('Skipping private IP: 192.168.1.10', out.getvalue())
+        self.assertEqual(list(BlockedIP.objects.values_list('ip_address', flat=True)), ['8.8.4.4'])
+
+
+class PackedIPColumnTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address=ip, path='/')
+            for ip in ['203.0.113.5', '203.0.113.250', '203.0.114.1', '2001:db8:1::7', '2001:db8:2::7']
+        ])
+        RequestLog.objects.create(ip_address='203.0.113.77', path='/')
+
+    def test_packed_columns_are_filled_at_write_time(self):
+        log = RequestLog.objects.get(ip_address='203.0.113.77')
+        self.assertEqual(log.ip, pack_ip('203.0.113.77'))
+        self.assertEqual(log.ip_version, 4)
+        self.assertEqual(unpack_ip(log.ip), '203.0.113.77')
+        self.assertEqual(RequestLog.objects.get(ip_address='2001:db8:1::7').ip_version, 6)
+
+        BlockedIP.block_many(['198.51.100.9'])
+        self.assertEqual(BlockedIP.objects.get().ip, pack_ip('198.51.100.9'))
+
+    def test_in_network_lookup_uses_an_index_range_scan(self):
+        in_network = RequestLog.objects.filter(ip__in_network='203.0.113.0/24')
+        self.assertEqual(
+            sorted(in_network.values_list('ip_address', flat=True)),
+            ['203.0.113.250', '203.0.113.5', '203.0.113.77'],
+        )
+        self.assertEqual(
+            list(RequestLog.objects.filter(ip__in_network='2001:db8:1::/48').values_list('ip_address', flat=True)),
+            ['2001:db8:1::7'],
+        )
+        recent = in_network.filter(timestamp__gte=timezone.now() - timedelta(days=1))
+        self.assertIn('request_log_ip_5d4fc0_idx', recent.explain())
+        self.assertEqual(filter_request_logs(ip_address='203.0.113.0/25').count(), 2)
+
+
+@override_settings(NETWORK_DETECTION_RULES=[
+    {'version': 4, 'prefix_length': 24, 'requests': 150, 'sensitive_requests': 1000, 'min_ips': 4},
+    {'version': 6, 'prefix_length': 64, 'requests': 1000, 'sensitive_requests': 8, 'min_ips': 4},
+])
+class NetworkDetectionTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        now = timezone.now()
+        self.window = (now - timedelta(hours=1), now + timedelta(seconds=1))
+        # Six addresses of one /24, each far below the per-IP threshold
+        logs = [RequestLog(ip_address=f'198.51.100.{host}', path='/api/') for host in range(1, 7) for _ in range(30)]
+        # Five rotating addresses of one /64, two login probes each
+        logs += [RequestLog(ip_address=f'2001:db8:0:7::{host}', path='/login/') for host in range(1, 6) for _ in range(2)]
+        # Spread over several /24s: nothing to flag
+        logs += [RequestLog(ip_address=f'192.0.{net}.1', path='/api/') for net in range(6) for _ in range(30)]
+        RequestLog.objects.bulk_create(logs)
+
+    def test_sharded_detection_flags_networks(self):
+        run_sharded_detection(*self.window, shards=3)
+        self.assertFalse(SuspiciousIP.objects.filter(ip_address__startswith='198.51.100.').exists())
+        self.assertEqual(
+            dict(SuspiciousNetwork.objects.values_list('network', 'reason')),
+            {'198.51.100.0/24': 'network_volume', '2001:db8:0:7::/64': 'network_sensitive_paths'},
+        )
+        details = SuspiciousNetwork.objects.get(network='198.51.100.0/24').details
+        self.assertEqual((details['request_count'], details['ip_count']), (180, 6))
+        self.assertEqual(
+            list(SuspiciousNetwork.containing('2001:db8:0:7::ffff').values_list('network', flat=True)),
+            ['2001:db8:0:7::/64'],
+        )
+        self.assertFalse(SuspiciousNetwork.containing('198.51.101.1').exists())
+
+    def test_columnar_engine_matches_sharded_aggregates(self):
+        _, networks = DetectionEngine(rules={}).run_with_networks(*self.window)
+        merged = merge_partials([aggregate_time_slice(*self.window)])
+        self.assertEqual(networks, evaluate_network_aggregates(merged))
+        self.assertEqual(sorted(networks), ['198.51.100.0/24', '2001:db8:0:7::/64'])
+
+
+class HeavyHitterTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+
+    def tracker(self, **options):
+        return HeavyHitterTracker(capacity=8, width=256, flush_interval=10, clock=self.clock, **options)
+
+    def test_space_saving_bounds_hold_after_evictions(self):
+        summary = SpaceSaving(capacity=8)
+        stream = [f'noise-{i}' for i in range(300)] + ['heavy-a'] * 200 + ['heavy-b'] * 120
+        stream = stream[::3] + stream[1::3] + stream[2::3]
+        for key in stream:
+            summary.add(key)
+        top = {key: (count, error) for key, count, error in summary.top(2)}
+        self.assertEqual(set(top), {'heavy-a', 'heavy-b'})
+        for key, true_count in [('heavy-a', 200), ('heavy-b', 120)]:
+            count, error = top[key]
+            self.assertLessEqual(count - error, true_count)
+            self.assertGreaterEqual(count, true_count)
+        self.assertEqual(len(summary), 8)
+
+    def test_workers_are_merged_through_the_cache(self):
+        first, second = self.tracker(), self.tracker()
+        for _ in range(30):
+            first.record('198.51.100.7', '/api/orders/1/')
+        for i in range(20):
+            second.record('198.51.100.7', f'/api/orders/{i}/')
+            second.record(f'192.0.2.{i}', '/login/')
+        # Nothing is visible before the flush interval
+        self.assertEqual(first.report()['total_requests'], 0)
+
+        self.clock.now += 10
+        first.record('198.51.100.7', '/api/orders/2/')
+        second.flush()
+        report = first.report(limit=3)
+        self.assertEqual((report['total_requests'], report['workers_flushed']), (71, 2))
+        top_ip = report['dimensions']['ip']['top'][0]
+        self.assertEqual((top_ip['key'], top_ip['count'], top_ip['min_count']), ('198.51.100.7', 51, 51))
+        self.assertEqual(report['dimensions']['path']['top'][0]['key'], '/api/orders/:id/')
+        self.assertEqual(report['dimensions']['ip_path']['top'][0]['key'], '198.51.100.7 /api/orders/:id/')
+
+        # A second flush of the same window replaces the worker's slot
+        second.flush()
+        self.assertEqual(first.report()['total_requests'], 71)
+
+        self.clock.now += 60 * 6
+        self.assertEqual(first.report()['total_requests'], 0)
+
+    def test_staff_endpoint(self):
+        from core.heavy_hitters import heavy_hitters
+
+        heavy_hitters.record('198.51.100.9', '/public/')
+        heavy_hitters.flush()
+        client = Client()
+        self.assertEqual(client.get('/heavy-hitters/').status_code, HTTPStatus.FOUND)
+
+        client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = client.get('/heavy-hitters/', {'dimension': 'ip', 'limit': 5})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(list(response.json()['dimensions']), ['ip'])
+        self.assertIn('198.51.100.9', [row['key'] for row in response.json()['dimensions']['ip']['top']])
+        self.assertEqual(client.get('/heavy-hitters/', {'limit': 'x'}).status_code, HTTPStatus.BAD_REQUEST)
+
+
+class UniqueVisitorTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+        self.clock.now = 36000.0
+
+    def at(self, seconds_ago):
+        return datetime.fromtimestamp(self.clock.now - seconds_ago, tz=dt_timezone.utc)
+
+    def counter(self, backend='local'):
+        return UniqueVisitorCounter(backend=backend, flush_interval=10, clock=self.clock)
+
+    def test_counts_are_merged_across_workers_and_windows(self):
+        first, second = self.counter(), self.counter()
+        for i in range(300):
+            first.record(f'198.51.100.{i % 250}', path=f'/api/orders/{i}/')
+            second.record(f'203.0.{i // 250}.{i % 250}', path='/login/')
+        for i in range(100):
+            second.record(f'198.51.100.{i}', path='/api/orders/1/')
+            second.record_country(f'198.51.100.{i}', 'DE')
+        first.flush()
+        second.flush()
+
+        window = {'since': self.at(600), 'until': self.at(0)}
+        self.assertAlmostEqual(first.count('path', '/api/orders/9/', **window), 250, delta=5)
+        self.assertAlmostEqual(first.count('path', '/login/', **window), 300, delta=6)
+        self.assertAlmostEqual(first.count('all', **window), 550, delta=11)
+        self.assertAlmostEqual(first.count('country', 'DE', **window), 100, delta=2)
+
+        self.clock.now += 2 * 3600
+        self.assertEqual(first.count('path', '/login/', since=self.at(600), until=self.at(0)), 0)
+        earlier = first.count('path', '/login/', since=self.at(3 * 3600), until=self.at(0))
+        self.assertAlmostEqual(earlier, 300, delta=6)
+        series = first.series('path', '/login/', since=self.at(3 * 3600), until=self.at(0))
+        self.assertEqual([count > 0 for _, count in series], [False, True, False, False])
+
+    def test_local_counters_are_capped_and_series_read_in_one_pass(self):
+        counter = UniqueVisitorCounter(backend='local', flush_interval=10, clock=self.clock, max_routes=4)
+        for i in range(20):
+            counter.record(f'192.0.2.{i}', path=f'/probe-{chr(97 + i)}.php')
+        counter.flush()
+        # Per minute and hour: 'all', the first four routes, then <other> past the cap
+        self.assertEqual(len(counter.local._counters), 12)
+        window = {'since': self.at(60), 'until': self.at(0)}
+        self.assertAlmostEqual(counter.count('path', OTHER_ROUTES, **window), 16, delta=1)
+
+        with counting() as tally:
+            series = counter.series('all', since=self.at(3600), until=self.at(0), resolution='minute')
+        self.assertEqual(len(series), 61)
+        self.assertEqual(tally.total_cache, 2)
+        self.assertAlmostEqual(series[-1][1], 20, delta=1)
+
+    def test_redis_keys_are_capped_per_bucket(self):
+        client = RecordingRedis()
+        backend = RedisCardinalityBackend(client, {'minute': 60, 'hour': 3600})
+        counter = UniqueVisitorCounter(backend=backend, flush_interval=10, clock=self.clock, max_routes=4)
+        for i in range(20):
+            counter.record(f'192.0.2.{i}', path=f'/probe-{chr(97 + i)}.php')
+        counter.flush()
+        counter.record('192.0.2.99', path='/probe-a.php')
+        counter.record('192.0.2.99', path='/probe-z.php')
+        counter.flush()
+
+        routes = {key.rsplit(':', 1)[1] for key in client.keys if key.split(':')[1] == 'path'}
+        self.assertEqual(routes, {'/probe-a.php', '/probe-b.php', '/probe-c.php', '/probe-d.php', OTHER_ROUTES})
+        self.assertEqual(len(client.keys[f'unique_visitors:path:minute:600:{OTHER_ROUTES}']), 17)
+
+        # A new bucket counts new routes again
+        self.clock.now += 3600
+        counter.record('192.0.2.1', path='/probe-z.php')
+        counter.flush()
+        self.assertIn('unique_visitors:path:minute:660:/probe-z.php', client.keys)
+
+    def test_falls_back_to_local_counters_when_redis_is_down(self):
+        import redis
+
+        unreachable = redis.Redis(host='127.0.0.1', port=1, socket_connect_timeout=0.2)
+        counter = self.counter(backend=RedisCardinalityBackend(unreachable, {'minute': 60, 'hour': 3600}))
+        for i in range(40):
+            counter.record(f'192.0.2.{i}', path='/login/')
+        counter.flush()
+        self.assertAlmostEqual(counter.count('path', '/login/', since=self.at(60), until=self.at(0)), 40, delta=1)
+
+    def test_path_scan_rule_and_endpoint(self):
+        now = timezone.now()
+        visitors = [f'192.0.2.{i}' for i in range(60)]
+        scanners = visitors[:3]
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address=ip, path='/wp-login.php', status_code=404) for ip in visitors]
+            + [RequestLog(ip_address=ip, path='/wp-login.php', status_code=404) for ip in scanners * 4]
+            + [RequestLog(ip_address='198.51.100.1', path='/wp-login.php', status_code=200)]
+        )
+        for ip in visitors:
+            unique_visitors.record(ip, path='/wp-login.php')
+        unique_visitors.flush()
+
+        findings = DetectionEngine(rules={'path_scan': {'min_unique_ips': 50}}).run(
+            now - timedelta(hours=1), now + timedelta(seconds=1)
+        )
+        # One failed request each, like a missing favicon, flags nobody else
+        self.assertEqual(sorted(findings), sorted(scanners))
+        self.assertEqual(findings['192.0.2.1'][0], 'path_scan')
+        self.assertEqual(findings['192.0.2.1'][1]['failed_requests'], 5)
+        self.assertEqual(list(findings['192.0.2.1'][1]['scanned_routes']), ['/wp-login.php'])
+
+        client = Client()
+        client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = client.get('/unique-visitors/', {'path': '/wp-login.php', 'minutes': 10, 'by': 'minute'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertAlmostEqual(response.json()['unique_ips'], 60, delta=1)
+        self.assertEqual(client.get('/unique-visitors/', {'path': '/', 'country': 'DE'}).status_code, 400)
+        for params in ({'minutes': 10 ** 12}, {'minutes': 60 * 24 * 30}, {'minutes': 600, 'by': 'minute'}):
+            self.assertEqual(client.get('/unique-visitors/', params).status_code, 400)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], DETECTION_COMMIT_GRACE_SECONDS=0)
+class LoadHarnessTest(TransactionTestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        # The tables are flushed between tests; drop the interned ids with them
+        user_agents.clear()
+        request_paths.clear()
+
+    def test_replays_generated_flood_through_the_wsgi_stack(self):
+        requests = generate_traffic(['baseline', 'flood'], duration=1, rate=10)
+        attacker = next(request.ip_address for request in requests if request.attacker)
+        harness = LoadHarness(WSGITarget(), requests, concurrency=2, detect_interval=0.2)
+        with replay_environment(cache='locmem', geolocation_latency=0):
+            report = harness.run()
+
+        self.assertEqual(report['requests'], len(requests))
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(set(report['latency_ms']), {'p50', 'p95', 'p99', 'max'})
+        self.assertGreater(report['queries_per_request']['total'], 0)
+        self.assertEqual(report['detection']['attackers'], 1)
+        self.assertEqual(report['detection']['attackers_flagged'], 1)
+        self.assertTrue(SuspiciousIP.objects.filter(ip_address=attacker).exists())
+
+    def test_reads_exported_request_logs(self):
+        RequestLog.objects.create(ip_address='192.0.2.1', path='/a/', method='GET')
+        RequestLog.objects.create(ip_address='192.0.2.2', path='/login/', method='POST')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'logs.ndjson')
+            call_command('export_request_logs', format='ndjson', output=path, stdout=StringIO())
+            requests = read_export(path)
+        self.assertEqual([(r.ip_address, r.method, r.path) for r in requests],
+                         [('192.0.2.1', 'GET', '/a/'), ('192.0.2.2', 'POST', '/login/')])
+        self.assertEqual(requests[0].offset, 0)
+
+    def test_discards_only_the_replayed_clients_data(self):
+        with discard_replay_data(['192.0.2.1']):
+            RequestLog.objects.create(ip_address='192.0.2.1', path='/a/')
+            RequestLog.objects.create(ip_address='192.0.2.2', path='/a/')
+            advance_window(timezone.now() + timedelta(seconds=1))
+        self.assertEqual(list(RequestLog.objects.values_list('ip_address', flat=True)), ['192.0.2.2'])
+        self.assertFalse(IPWindowAggregate.objects.exists())
+        self.assertIsNone(TaskWatermark.objects.get(name='detection_window').window_end)
+
+
+class RoundTripBudgetTest(TransactionTestCase):
+    databases = {'default', 'logs'}
+    HOT_ROUTES = ['/', '/public/', '/api/', '/test-logging/', '/rate-limit-status/']
+
+    def setUp(self):
+        cache.clear()
+        user_agents.clear()
+        request_paths.clear()
+        round_trip_stats.reset()
+        # Keep the periodic sketch flushes out of the counted requests
+        self.intervals = heavy_hitters.flush_interval, unique_visitors.flush_interval
+        heavy_hitters.flush_interval = unique_visitors.flush_interval = 3600
+
+    def tearDown(self):
+        heavy_hitters.flush_interval, unique_visitors.flush_interval = self.intervals
+
+    def test_hot_routes_stay_within_their_budgets(self):
+        for path in self.HOT_ROUTES:
+            Client(REMOTE_ADDR='10.0.0.1').get(path)
+        round_trip_stats.reset()
+        with override_settings(ROUND_TRIP_BUDGET_MODE='raise'):
+            client = Client(REMOTE_ADDR='10.0.0.2')
+            for path in self.HOT_ROUTES:
+                response = client.get(path)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.wsgi_request.round_trips.queries, {'logs': 1})
+
+        metrics = round_trip_stats.metrics()
+        self.assertEqual(metrics['api']['requests'], 1)
+        self.assertEqual(metrics['api']['over_budget'], 0)
+
+    def test_over_budget_requests_raise_or_are_sampled(self):
+        budgets = {'*': {'queries': 0, 'cache': 100}}
+        with override_settings(ROUND_TRIP_BUDGETS=budgets, ROUND_TRIP_BUDGET_MODE='raise'):
+            with self.assertRaisesMessage(RoundTripBudgetExceeded, 'went over its round-trip budget: queries'):
+                Client(REMOTE_ADDR='10.0.0.3').get('/public/')
+
+        round_trip_stats.reset()
+        with override_settings(ROUND_TRIP_BUDGETS=budgets, ROUND_TRIP_LOG_SAMPLE_RATE=3):
+            client = Client(REMOTE_ADDR='10.0.0.4')
+            with self.assertLogs('core.middleware.round_trips', 'WARNING') as logs:
+                for _ in range(5):
+                    client.get('/public/')
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(round_trip_stats.metrics()['public']['over_budget'], 5)
+
+        client = Client()
+        client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        routes = client.get('/round-trips/').json()['routes']
+        self.assertEqual(routes['public']['budget'], {'queries': 4, 'cache': 12})
+
+    def test_staff_routes_stay_within_their_budgets(self):
+        client = Client()
+        client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        routes = ['/heavy-hitters/', '/unique-visitors/?path=/', '/round-trips/', '/export/request-logs/']
+        for path in routes:
+            client.get(path)
+        with override_settings(ROUND_TRIP_BUDGET_MODE='raise'):
+            for path in routes:
+                self.assertEqual(client.get(path).status_code, HTTPStatus.OK)
+
+
+@override_settings(DETECTION_COMMIT_GRACE_SECONDS=0)
+class IncrementalDetectionTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.paths = ['/', '/api/', '/login/', '/admin/', '/.env']
+
+    def add_logs(self, minutes_ago, count, offset=0):
+        RequestLog.objects.bulk_create([
+            RequestLog(
+                ip_address=f'203.0.113.{(i + offset) % 7}',
+                path=self.paths[(i + offset) % len(self.paths)],
+                timestamp=self.now - timedelta(minutes=minutes_ago, seconds=i % 50),
+            )
+            for i in range(count)
+        ])
+
+    def stored(self):
+        return {
+            row.ip_address: (row.requests, row.sensitive_requests, set(row.sensitive_paths))
+            for row in IPWindowAggregate.objects.all()
+        }
+
+    def recomputed(self, end):
+        merged = merge_partials([aggregate_time_slice(end - timedelta(hours=1), end)])
+        return {
+            ip: (data['requests'], data['sensitive_requests'], data['sensitive_paths'])
+            for ip, data in merged.items()
+        }
+
+    def test_sliding_window_matches_full_recompute(self):
+        self.add_logs(100, 40)
+        self.add_logs(50, 60)
+        advance_window(self.now - timedelta(minutes=30))
+        self.assertEqual(self.stored(), self.recomputed(self.now - timedelta(minutes=30)))
+
+        # New traffic, a row stamped ahead of the previous end, and the
+        # 100-minute-old rows leaving the window
+        self.add_logs(20, 30, offset=3)
+        self.add_logs(-5, 10, offset=1)
+        self.add_logs(40, 5, offset=2)
+        for minutes_ago in (15, 5, 0):
+            end = self.now - timedelta(minutes=minutes_ago)
+            _, stats = advance_window(end)
+            self.assertFalse(stats['rebuilt'])
+            self.assertEqual(self.stored(), self.recomputed(end))
+        self.assertEqual(
+            TaskWatermark.objects.get(name='detection_window').position,
+            RequestLog.objects.order_by('-id').values_list('id', flat=True).first(),
+        )
+
+        # A run whose clock is slightly behind the last one's slides back
+        end = self.now - timedelta(seconds=30)
+        _, stats = advance_window(end)
+        self.assertFalse(stats['rebuilt'])
+        self.assertEqual(self.stored(), self.recomputed(end))
+
+        # A window that no longer overlaps the stored one is rebuilt
+        _, stats = advance_window(self.now + timedelta(hours=2))
+        self.assertTrue(stats['rebuilt'])
+        self.assertEqual(self.stored(), {})
+
+    def test_flags_the_same_ips_as_the_sharded_engine(self):
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address='198.51.100.7', path='/api/') for _ in range(120)]
+            + [RequestLog(ip_address='198.51.100.8', path='/wp-admin/')]
+        )
+        end = timezone.now() + timedelta(seconds=1)
+        run_incremental_detection(end)
+        incremental = dict(SuspiciousIP.objects.values_list('ip_address', 'reason'))
+        SuspiciousIP.objects.all().delete()
+        run_sharded_detection(end - timedelta(hours=1), end)
+        self.assertEqual(incremental, dict(SuspiciousIP.objects.values_list('ip_address', 'reason')))
+        self.assertEqual(incremental, {'198.51.100.7': 'high_volume', '198.51.100.8': 'sensitive_paths'})
+
+        # Nothing new since: the next run changes no aggregates
+        _, stats = advance_window(end + timedelta(seconds=1))
+        self.assertEqual(stats['ips_changed'], 0)
+
+    def test_rows_committed_behind_the_watermark_are_not_lost(self):
+        RequestLog.objects.bulk_create([
+            RequestLog(id=100, ip_address='198.51.100.1', path='/login/', timestamp=self.now - timedelta(seconds=2)),
+            RequestLog(id=102, ip_address='198.51.100.1', path='/', timestamp=self.now - timedelta(seconds=1)),
+        ])
+        # Within the grace period neither is folded, so id 101 still can be
+        with override_settings(DETECTION_COMMIT_GRACE_SECONDS=60):
+            advance_window(self.now)
+        self.assertEqual(self.stored(), {})
+        RequestLog.objects.create(id=101, ip_address='198.51.100.1', path='/admin/')
+        RequestLog.objects.filter(id=101).update(timestamp=self.now - timedelta(milliseconds=1500))
+
+        end = self.now + timedelta(seconds=1)
+        advance_window(end)
+        self.assertEqual(self.stored(), self.recomputed(end))
+        self.assertEqual(self.stored()['198.51.100.1'][:2], (3, 2))
+        # Sliding them all out subtracts cleanly
+        _, stats = advance_window(end + timedelta(minutes=59, seconds=59))
+        self.assertFalse(stats['rebuilt'])
+        self.assertEqual(self.stored(), {})
+
+    def flags(self, end, rebuild=False):
+        run_incremental_detection(end, rebuild=rebuild)
+        return dict(SuspiciousIP.objects.values_list('ip_address', 'reason'))
+
+    def test_incremental_and_rebuilt_windows_flag_the_same_ips(self):
+        def logs(ip_address, path, count, **ago):
+            timestamp = self.now - timedelta(**ago)
+            return [RequestLog(ip_address=ip_address, path=path, timestamp=timestamp) for _ in range(count)]
+
+        RequestLog.objects.bulk_create(
+            logs('198.51.100.1', '/', 70, minutes=80)
+            + logs('198.51.100.1', '/', 40, minutes=30)
+            + logs('198.51.100.2', '/login/', 1, minutes=50)
+            + logs('198.51.100.2', '/', 101, minutes=5)
+            + logs('198.51.100.4', '/wp-admin/', 1, minutes=-5)  # written ahead of the clock
+        )
+        last = RequestLog.objects.latest('id').id
+
+        def late_commit():
+            # Ids last + 1 and last + 3 are visible while last + 2 is in flight
+            RequestLog.objects.bulk_create([
+                RequestLog(id=last + 1, ip_address='198.51.100.3', path='/admin/',
+                           timestamp=self.now - timedelta(seconds=2)),
+                RequestLog(id=last + 3, ip_address='198.51.100.3', path='/',
+                           timestamp=self.now - timedelta(seconds=1)),
+            ])
+
+        def committed():
+            RequestLog.objects.create(id=last + 2, ip_address='198.51.100.3', path='/.env')
+            RequestLog.objects.filter(id=last + 2).update(timestamp=self.now - timedelta(milliseconds=1500))
+
+        steps = [
+            (self.now - timedelta(minutes=40), 0, None),
+            (self.now - timedelta(minutes=25), 0, None),
+            (self.now - timedelta(minutes=10), 0, None),
+            (self.now + timedelta(seconds=1), 60, late_commit),
+            (self.now + timedelta(seconds=2), 0, committed),
+            (self.now + timedelta(minutes=6), 0, None),
+        ]
+        rebuilt = {}
+        for end, grace, before in steps:
+            if before:
+                before()
+            with override_settings(DETECTION_COMMIT_GRACE_SECONDS=grace):
+                incremental = self.flags(end)
+                # The same run over a rebuilt window, rolled back afterwards
+                with transaction.atomic(using='logs'):
+                    SuspiciousIP.objects.all().delete()
+                    rebuilt.update(self.flags(end, rebuild=True))
+                    transaction.set_rollback(True, using='logs')
+            self.assertEqual(incremental, rebuilt, end)
+
+        self.assertEqual(incremental, {
+            '198.51.100.1': 'high_volume',
+            '198.51.100.2': 'multiple_reasons',
+            '198.51.100.3': 'sensitive_paths',
+            '198.51.100.4': 'sensitive_paths',
+        })
+
+    def test_scheduled_windows_end_on_interval_boundaries(self):
+        now = datetime(2026, 10, 19, 10, 17, 5, 120, tzinfo=dt_timezone.utc)
+        self.assertEqual(detection_window_end(now), now.replace(minute=0, second=0, microsecond=0))
+        with override_settings(DETECTION_INTERVAL_MINUTES=5):
+            self.assertEqual(detection_window_end(now), now.replace(minute=15, second=0, microsecond=0))
+            self.assertEqual(detection_window_end(now.replace(minute=15, second=0, microsecond=0)).minute, 15)
+
+    def test_drifted_window_is_rebuilt(self):
+        self.add_logs(50, 20)
+        advance_window(self.now - timedelta(minutes=30))
+        # Counts that lost rows, as a late commit used to cause
+        IPWindowAggregate.objects.update(sensitive_requests=0, sensitive_paths={})
+        end = self.now + timedelta(minutes=20)
+        _, stats = advance_window(end)
+        self.assertTrue(stats['rebuilt'])
+        self.assertEqual(self.stored(), self.recomputed(end))
+
+
+@override_settings(
+    SUSPICIOUS_IP_TTLS={'high_volume': 3600}, SUSPICIOUS_IP_DEFAULT_TTL=7200,
+    BLOCKED_IP_TTL=86400, IP_TTL_ESCALATION_FACTOR=2, IP_TTL_MAX=4 * 3600,
+)
+class IPExpiryTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def flag(self, ip_address, reason='high_volume'):
+        flag_suspicious_ips({ip_address: (reason, {})})
+        return SuspiciousIP.objects.get(ip_address=ip_address)
+
+    def test_ttl_per_reason_and_escalation(self):
+        started = timezone.now()
+        entry = self.flag('198.51.100.1')
+        self.assertAlmostEqual((entry.expires_at - started).total_seconds(), 3600, delta=5)
+        self.assertEqual(self.flag('198.51.100.2', 'sensitive_paths').offense_count, 1)
+        self.assertIn('198.51.100.1', suspicious_ips.get())
+
+        # Flagged again while active: same offense, expiry not pulled in
+        again = self.flag('198.51.100.1')
+        self.assertEqual(again.offense_count, 1)
+        self.assertGreaterEqual(again.expires_at, entry.expires_at)
+
+        # Lapsed, then flagged again: twice the TTL, capped at IP_TTL_MAX
+        SuspiciousIP.objects.filter(ip_address='198.51.100.1').update(expires_at=started - timedelta(seconds=1))
+        self.assertEqual(sweep_expired_ips()['suspicious_ips'], (1, 0))
+        self.assertNotIn('198.51.100.1', suspicious_ips.get())
+        for offense_count, hours in [(2, 2), (3, 4), (4, 4)]:
+            SuspiciousIP.objects.filter(ip_address='198.51.100.1').update(is_active=False)
+            entry = self.flag('198.51.100.1')
+            self.assertEqual(entry.offense_count, offense_count)
+            self.assertAlmostEqual((entry.expires_at - started).total_seconds(), hours * 3600, delta=5)
+
+    def test_sweeper_works_in_batches_and_bumps_the_blocklist_version(self):
+        BlockedIP.block_many([f'203.0.113.{i}' for i in range(5)], reason='test')
+        BlockedIP.block_many(['203.0.113.100'], ttl=0)
+        # Blocked again with the default TTL while active: stays permanent
+        BlockedIP.block_many(['203.0.113.100'])
+        self.assertIsNone(BlockedIP.objects.get(ip_address='203.0.113.100').expires_at)
+        with self.assertRaisesMessage(CommandError, '--ttl must be'):
+            call_command('block_ip', '203.0.113.101', ttl=-1, stdout=StringIO())
+        self.assertEqual(len(blocked_ips.get()), 6)
+
+        version = cache.get(blocked_ips.version_key)
+        later = timezone.now() + timedelta(days=2)
+        result = sweep_expired_ips(now=later, batch_size=2)
+        self.assertEqual(result['blocked_ips'], (5, 0))
+        self.assertNotEqual(cache.get(blocked_ips.version_key), version)
+        self.assertEqual(blocked_ips.get(), frozenset({'203.0.113.100'}))
+        self.assertEqual(sweep_expired_ips(now=later)['blocked_ips'], (0, 0))
+
+        # Re-blocked repeat offender: doubled TTL
+        BlockedIP.block_many(['203.0.113.1'])
+        entry = BlockedIP.objects.get(ip_address='203.0.113.1')
+        self.assertEqual(entry.offense_count, 2)
+        self.assertAlmostEqual((entry.expires_at - timezone.now()).total_seconds(), 4 * 3600, delta=5)
+
+        # Long expired entries are deleted, forgetting their offenses
+        result = sweep_expired_ips(now=later + timedelta(days=91), batch_size=2)
+        self.assertEqual(result['blocked_ips'], (1, 5))
+        self.assertEqual(
+            sorted(BlockedIP.objects.values_list('ip_address', flat=True)), ['203.0.113.100']
+        )
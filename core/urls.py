@@ -12,6 +12,11 @@ urlpatterns = [
     path('sensitive-action/', views.SensitiveActionView.as_view(), name='sensitive_action'),
     path('admin/', views.AdminView.as_view(), name='admin'),
     path('trigger-detection/', views.TriggerDetectionView.as_view(), name='trigger_detection'),
+    path('location/', views.location_ingest, name='location_ingest'),
+    path('export/request-logs/', views.export_request_logs, name='export_request_logs'),
+    path('heavy-hitters/', views.heavy_hitters, name='heavy_hitters'),
+    path('unique-visitors/', views.unique_visitors, name='unique_visitors'),
+    path('round-trips/', views.round_trips, name='round_trips'),
 
 
     path('test-google/', views.home, name='test_google'),
@@ -1,12 +1,22 @@
 import os
-from django.http import HttpResponse, JsonResponse
+from decimal import Decimal, InvalidOperation
+from datetime import timedelta
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login 
 from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views import View
 from django_ratelimit.decorators import ratelimit
 from .tasks import detect_suspicious_ips
 from .models import RequestLog
+from .location_buffer import location_buffer
+from .exports import RENDERERS, filter_request_logs, iter_request_logs, parse_export_time
+from .heavy_hitters import DIMENSIONS, heavy_hitters as heavy_hitter_tracker
+from .cardinality import RESOLUTIONS, unique_visitors as unique_visitor_counter
+from .round_trips import RoundTripBudgets, round_trip_stats
 
 def home(request):
     return HttpResponse("Home page")
@@ -221,4 +231,158 @@ class TriggerDetectionView(View):
             'message': 'Anomaly detection task queued in Celery',
             'celery_task_id': task.id,
             'instruction': 'Check your Celery worker terminal to see the task executing'
-        })
\ No newline at end of file
+        })
+
+
+@staff_member_required
+def export_request_logs(request):
+    """
+    Stream RequestLog rows as CSV or NDJSON.
+    Filters: ip (address or CIDR), path_prefix, country, since, until (ISO 8601); format=csv|ndjson
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in RENDERERS:
+        return JsonResponse({'error': f"Unsupported format: {export_format}"}, status=400)
+
+    try:
+        logs = filter_request_logs(
+            ip_address=request.GET.get('ip'),
+            path_prefix=request.GET.get('path_prefix'),
+            country=request.GET.get('country'),
+            since=parse_export_time(request.GET.get('since')),
+            until=parse_export_time(request.GET.get('until')),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    render, content_type = RENDERERS[export_format]
+    response = StreamingHttpResponse(render(iter_request_logs(logs)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="request_logs.{export_format}"'
+    return response
+
+
+@staff_member_required
+def heavy_hitters(request):
+    """
+    Current top IPs, routes and (IP, route) pairs across every worker, with
+    error bounds. Query: limit (default 20), windows, dimension=ip|path|ip_path.
+    """
+    try:
+        limit = int(request.GET.get('limit', 20))
+        windows = int(request.GET.get('windows', heavy_hitter_tracker.windows))
+    except ValueError:
+        return JsonResponse({'error': 'limit and windows must be integers'}, status=400)
+    if not 1 <= limit <= heavy_hitter_tracker.capacity or not 1 <= windows <= heavy_hitter_tracker.windows:
+        return JsonResponse({
+            'error': f"limit must be 1-{heavy_hitter_tracker.capacity} "
+                     f"and windows 1-{heavy_hitter_tracker.windows}"
+        }, status=400)
+    dimension = request.GET.get('dimension')
+    if dimension is not None and dimension not in DIMENSIONS:
+        return JsonResponse({'error': f"Unknown dimension: {dimension}"}, status=400)
+
+    report = heavy_hitter_tracker.report(limit=limit, windows=windows)
+    if dimension:
+        report['dimensions'] = {dimension: report['dimensions'][dimension]}
+    return JsonResponse(report)
+
+
+@staff_member_required
+def unique_visitors(request):
+    """
+    Estimated distinct client IPs, site-wide or for one route (path=) or
+    country (country=). Range: minutes=N back from now (default 60), or
+    since/until (ISO 8601), no longer than the hourly counters are kept.
+    by=minute|hour adds a per-bucket series; by=minute only over the range
+    the per-minute counters are kept.
+    """
+    path, country = request.GET.get('path'), request.GET.get('country')
+    if path and country:
+        return JsonResponse({'error': 'Filter by path or country, not both'}, status=400)
+    dimension, value = ('path', path) if path else ('country', country) if country else ('all', '')
+    try:
+        until = parse_export_time(request.GET.get('until')) or timezone.now()
+        since = parse_export_time(request.GET.get('since'))
+        if since is None:
+            since = until - timedelta(minutes=int(request.GET.get('minutes', 60)))
+    except (ValueError, OverflowError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if since >= until:
+        return JsonResponse({'error': 'since must be before until'}, status=400)
+    resolution = request.GET.get('by')
+    if resolution is not None and resolution not in RESOLUTIONS:
+        return JsonResponse({'error': f"Unknown resolution: {resolution}"}, status=400)
+    retention = unique_visitor_counter.retention['minute' if resolution == 'minute' else 'hour']
+    if (until - since).total_seconds() > retention:
+        return JsonResponse({'error': f"Range longer than the {retention}s the counters are kept"}, status=400)
+
+    data = {
+        'dimension': dimension,
+        'value': value,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'unique_ips': unique_visitor_counter.count(dimension, value, since=since, until=until),
+    }
+    if resolution:
+        data['series'] = [
+            {'start': start.isoformat(), 'unique_ips': count}
+            for start, count in unique_visitor_counter.series(
+                dimension, value, since=since, until=until, resolution=resolution
+            )
+        ]
+    return JsonResponse(data)
+
+
+@staff_member_required
+def round_trips(request):
+    """
+    Database queries and cache calls per request in this process, by URL
+    name, with each route's budget and how many requests went over it.
+    """
+    budgets = RoundTripBudgets(getattr(settings, 'ROUND_TRIP_BUDGETS', {}))
+    return JsonResponse({
+        'mode': getattr(settings, 'ROUND_TRIP_BUDGET_MODE', 'log'),
+        'routes': {
+            route: {**stats, 'budget': budgets.budget_for(route)}
+            for route, stats in round_trip_stats.metrics().items()
+        },
+    })
+
+
+def location_ingest(request):
+    """
+    Accept a location ping from an authenticated client.
+    Pings are coalesced per user and written in bulk by the location buffer.
+    """
+    if request.method != 'POST':
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Only POST method is allowed'
+        }, status=405)
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Authentication required'
+        }, status=401)
+
+    try:
+        latitude = Decimal(request.POST.get('latitude', ''))
+        longitude = Decimal(request.POST.get('longitude', ''))
+        if not (latitude.is_finite() and longitude.is_finite()):
+            raise InvalidOperation
+    except InvalidOperation:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'latitude and longitude must be numbers'
+        }, status=400)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'latitude or longitude out of range'
+        }, status=400)
+
+    precision = Decimal('0.000001')
+    location_buffer.add(
+        request.user.pk, latitude.quantize(precision), longitude.quantize(precision)
+    )
+    return JsonResponse({'status': 'accepted'}, status=202)
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+
+from celery.schedules import crontab
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.ip_gate.EarlyRejectMiddleware",
+    "core.middleware.round_trips.RoundTripBudgetMiddleware",
+    "core.middleware.suspicious_throttle.SuspiciousIPThrottleMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -81,9 +86,23 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # Request logs, blocklists and detection results (see core.db_routers).
+    # WAL lets readers run alongside the steady stream of inserts.
+    "logs": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("LOGS_DB_PATH", BASE_DIR / "logs.sqlite3"),
+        "OPTIONS": {
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL",
+            "transaction_mode": "IMMEDIATE",
+        },
+    },
 }
 
+DATABASE_ROUTERS = ["core.db_routers.RequestLogRouter"]
+REQUEST_LOG_DATABASE = "logs"
+DETECTION_READ_DATABASE = None  # e.g. a "logs_replica" alias for detection reads
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -140,7 +159,53 @@ CACHES = {
 }
 
 
+# Blocked IP gate settings
+IP_INDEX_REFRESH_INTERVAL = 5  # seconds between blocklist version checks
+IP_GATE_FLUSH_INTERVAL = 10  # seconds between counter flushes to the cache
+IP_GATE_LOG_SAMPLE_RATE = 100  # log 1 in N rejected requests
+IP_GATE_WRAP_APPLICATION = False  # also reject in the raw WSGI/ASGI wrapper
+
+# Graduated throttling for IPs flagged by the detection tasks, keyed by SuspiciousIP.reason
+SUSPICIOUS_IP_POLICIES = {
+    'high_volume': {'rate': '30/m'},
+    'burst': {'rate': '30/m'},
+    'error_ratio': {'rate': '20/m'},
+    'path_diversity': {'rate': '20/m', 'delay': 0.5},
+    'sensitive_paths': {'rate': '10/m', 'delay': 0.5},
+    'path_scan': {'rate': '10/m', 'delay': 0.5},
+    'multiple_reasons': {'rate': '5/m', 'challenge': True},
+}
+SUSPICIOUS_IP_DEFAULT_POLICY = {'rate': '30/m'}  # reasons missing above
+SUSPICIOUS_IP_CHALLENGE_MAX_AGE = 3600
+
+# Location ping buffering
+LOCATION_FLUSH_INTERVAL = 5  # seconds between bulk writes of buffered positions
+LOCATION_MIN_MOVE_METERS = 25  # positions closer than this to the stored one are dropped
+
+# Cold archive of old request logs (see core.archive)
+REQUEST_LOG_RETENTION_DAYS = 30  # rows older than this many full days leave request_logs
+REQUEST_LOG_ARCHIVE_DIR = os.environ.get('REQUEST_LOG_ARCHIVE_DIR', BASE_DIR / 'archive')
+REQUEST_LOG_ARCHIVE_RETENTION_DAYS = 365  # segments older than this are deleted
+REQUEST_LOG_ARCHIVE_DELETE_BATCH = 5000  # rows per DELETE when clearing archived rows
+
+# Request logging load shedding: full -> no geolocation -> 1 in N -> counters only
+REQUEST_LOGGING_LATENCY_BUDGET = 0.05  # seconds; p90 of the logging phase above this sheds load
+REQUEST_LOGGING_ERROR_RATE = 0.2  # share of failed log writes that sheds load
+REQUEST_LOGGING_RECOVERY_SECONDS = 30  # healthy time before stepping back up one mode
+REQUEST_LOGGING_SAMPLE_RATE = 10  # rows kept in sampled mode: 1 in N
+
 # IP Geolocation settings
+GEOLOCATION_DB_MAX_AGE_DAYS = 30  # IPGeolocation rows older than this are re-resolved
+GEOLOCATION_WRITE_INTERVAL = 5  # seconds between write-behind flushes to IPGeolocation
+GEOLOCATION_NEGATIVE_CACHE_TTL = 60  # seconds an unresolved lookup is cached before a retry
+GEOLOCATION_PROVIDER = 'core.geolocation_providers.IPInfoProvider'
+GEOLOCATION_CONCURRENCY = 4  # provider lookups in flight per batch
+GEOLOCATION_TIMEOUT = 1.5  # seconds a single provider call may take, start to last byte
+GEOLOCATION_BATCH_TIMEOUT = 4.5  # seconds a batch call (up to 100 IPs) may take
+GEOLOCATION_BREAKER_ERROR_RATE = 0.5  # share of failed recent calls that opens the circuit
+GEOLOCATION_BREAKER_MIN_CALLS = 5  # calls seen before the error rate is trusted
+GEOLOCATION_BREAKER_COOLDOWN = 30  # seconds before a probe is let through an open circuit
+GEOLOCATION_BACKFILL_BATCH_SIZE = 1000  # RequestLog rows per backfill batch
 IPINFO_API_KEY = os.environ.get('IPINFO_API_KEY', '')
 
 # Or for django-ipgeolocation
@@ -180,9 +245,114 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
 
+# Number of time-slice shards detect_suspicious_ips fans out to (Celery chord)
+# when DETECTION_INCREMENTAL is off; a caller can also pass shards= to opt in
+DETECTION_SHARDS = 4
+
+# 'sharded' (ORM aggregations per time slice) or 'columnar' (core.detection engine)
+DETECTION_ENGINE = 'sharded'
+
+# Expiry of SuspiciousIP/BlockedIP entries (core.expiry), in seconds. Each
+# repeat offense multiplies the TTL by the escalation factor, up to IP_TTL_MAX.
+SUSPICIOUS_IP_TTLS = {
+    'high_volume': 6 * 3600,
+    'burst': 6 * 3600,
+    'error_ratio': 12 * 3600,
+    'sensitive_paths': 24 * 3600,
+    'path_diversity': 24 * 3600,
+    'path_scan': 24 * 3600,
+    'multiple_reasons': 72 * 3600,
+}
+SUSPICIOUS_IP_DEFAULT_TTL = 24 * 3600
+BLOCKED_IP_TTL = 30 * 24 * 3600  # None: blocks never expire
+IP_TTL_ESCALATION_FACTOR = 2
+IP_TTL_MAX = 90 * 24 * 3600
+IP_SWEEP_BATCH_SIZE = 1000  # rows per UPDATE/DELETE of the expiry sweeper
+EXPIRED_IP_RETENTION_DAYS = 90  # expired entries (and their offense counts) are deleted after this
+
+# Scheduled detection runs every this many minutes, on the clock (use a
+# divisor of 60), over the hour ending at the boundary. With the incremental
+# engine a shorter interval only costs the traffic in between.
+DETECTION_INTERVAL_MINUTES = 60
+
+# Sharded engine only: fold the rows since the last run into stored per-IP
+# window aggregates (core.incremental_detection) instead of rescanning the hour
+DETECTION_INCREMENTAL = True
+# Rows newer than this may still be uncommitted behind visible later ids;
+# the incremental window folds them in on a later run
+DETECTION_COMMIT_GRACE_SECONDS = 30
+
+# Rules evaluated by the columnar engine, with their options
+DETECTION_RULES = {
+    'volume': {'threshold': 100},
+    'sensitive_paths': {'min_requests': 1},
+    'path_diversity': {'min_distinct_paths': 50},
+    'error_ratio': {'min_requests': 20, 'ratio': 0.5},
+    'burst': {'bucket_seconds': 60, 'per_bucket': 60},
+    'path_scan': {
+        'min_unique_ips': 50, 'min_error_ratio': 0.9, 'min_failed_requests': 5, 'min_scanned_routes': 3,
+    },
+}
+
+# Real-time heavy hitters (core.heavy_hitters): fixed-size sketches per worker,
+# merged through the cache and served at /heavy-hitters/ to staff
+HEAVY_HITTERS_CAPACITY = 200  # keys tracked per dimension by Space-Saving
+HEAVY_HITTERS_SKETCH_WIDTH = 2048  # Count-Min columns; error <= e/width * requests
+HEAVY_HITTERS_SKETCH_DEPTH = 4  # Count-Min rows; confidence 1 - e^-depth
+HEAVY_HITTERS_WINDOW_SECONDS = 60
+HEAVY_HITTERS_WINDOWS = 5  # windows merged into a report
+HEAVY_HITTERS_FLUSH_INTERVAL = 10.0
+
+# Unique visitor HyperLogLog counters (core.cardinality): 'auto' uses Redis
+# PFADD/PFCOUNT when the default cache is django-redis, else in-process counters
+CARDINALITY_BACKEND = 'auto'
+CARDINALITY_FLUSH_INTERVAL = 1.0
+CARDINALITY_MINUTE_RETENTION = 3 * 3600  # per-minute counters, seconds
+CARDINALITY_HOUR_RETENTION = 8 * 24 * 3600  # per-hour counters, seconds
+CARDINALITY_MAX_ROUTES = 1000  # routes counted per bucket by each worker; extra routes go to '<other>'
+
+# Per-request round-trip budgets (core.round_trips), by URL name; '*' is any
+# other route. Steady state: the RequestLog INSERT plus the rate limiter's
+# add/incr; periodic sketch flushes and snapshot refreshes ride on top.
+ROUND_TRIP_BUDGETS = {
+    '*': {'queries': 4, 'cache': 12},
+    'signin': {'queries': 16, 'cache': 12},
+    'login': {'queries': 20, 'cache': 12},
+    # Staff pages: session and user lookups on top of the request log row.
+    # Exported rows are streamed after the response leaves the middleware.
+    'export_request_logs': {'queries': 6, 'cache': 4},
+    'heavy_hitters': {'queries': 6, 'cache': 8},
+    'unique_visitors': {'queries': 6, 'cache': 8},
+    'round_trips': {'queries': 6, 'cache': 4},
+}
+ROUND_TRIP_BUDGET_MODE = 'log'  # 'raise' fails the request (use in tests), 'log' warns, 'off' only counts
+ROUND_TRIP_LOG_SAMPLE_RATE = 100  # over-budget requests logged: 1 in N
+
+# Networks the per-IP counts are rolled up into (core.detection.NetworkAggregator).
+# A network is flagged when at least min_ips of its addresses together send
+# `requests` requests or `sensitive_requests` sensitive-path requests in the hour.
+NETWORK_DETECTION_RULES = [
+    {'version': 4, 'prefix_length': 24, 'requests': 1000, 'sensitive_requests': 20, 'min_ips': 4},
+    {'version': 6, 'prefix_length': 64, 'requests': 1000, 'sensitive_requests': 20, 'min_ips': 4},
+    {'version': 6, 'prefix_length': 48, 'requests': 5000, 'sensitive_requests': 50, 'min_ips': 16},
+]
+
 CELERY_BEAT_SCHEDULE = {
     'detect-suspicious-ips-hourly': {
         'task': 'core.tasks.detect_suspicious_ips',
-        'schedule': 3600.0,  # Every hour (3600 seconds)
-    }
+        'schedule': crontab(minute=f'*/{DETECTION_INTERVAL_MINUTES}'),  # On the hour by default
+        'kwargs': {'scheduled': True},
+    },
+    'backfill-geolocation-hourly': {
+        'task': 'core.tasks.backfill_geolocation',
+        'schedule': 3600.0,
+    },
+    'sweep-expired-ips': {
+        'task': 'core.tasks.sweep_expired_ips',
+        'schedule': 300.0,
+    },
+    'archive-request-logs-daily': {
+        'task': 'core.tasks.archive_request_logs',
+        'schedule': 86400.0,
+    },
 }
\ No newline at end of file
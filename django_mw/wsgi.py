@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_mw.settings")
 
 application = get_wsgi_application()
+
+if getattr(settings, "IP_GATE_WRAP_APPLICATION", False):
+    from core.middleware.ip_gate import EarlyRejectWSGIApp
+
+    application = EarlyRejectWSGIApp(application)